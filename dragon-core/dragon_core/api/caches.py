@@ -0,0 +1,270 @@
+"""
+Small in-memory caches used by the API, and `DiskCache` for derived files that are too large to keep in memory.
+"""
+import os
+import time
+import threading
+from pathlib import Path
+from typing import Optional, Union
+from collections import OrderedDict
+
+
+class NegativeCache:
+    """
+    Bounded set of keys that were recently looked up and not found. Keys expire after `ttl` seconds and the oldest
+    keys are dropped once more than `max_size` are held.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 30.0):
+        """
+        :param max_size: Maximum number of keys held.
+        :param ttl: Seconds after which a key is forgotten.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        # Keys with the time at which they expire, oldest first.
+        self._expiries: OrderedDict[str, float] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            expiry = self._expiries.get(key)
+            if expiry is None:
+                return False
+            if expiry < time.monotonic():
+                del self._expiries[key]
+                return False
+            return True
+
+    def __len__(self):
+        return len(self._expiries)
+
+    def add(self, key) -> None:
+        with self._lock:
+            self._expiries.pop(key, None)
+            self._expiries[key] = time.monotonic() + self.ttl
+            while len(self._expiries) > self.max_size:
+                self._expiries.popitem(last=False)
+
+    def discard(self, key) -> None:
+        with self._lock:
+            self._expiries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._expiries.clear()
+
+
+class ResponseCache:
+    """
+    Serialized responses for entities, each one only valid for the revision of the entity it was built from.
+
+    Every entity has a revision that grows every time the entity is changed with `bump`, or with `bump_all` for changes
+    that affect every response, like the paths the links in them point to. Revisions come from a single counter, so an
+    entity never gets the same revision twice, even after `forget`. Responses are kept in least
+    recently used order and the oldest ones are dropped once their total size goes over `max_bytes`.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        """
+        :param max_bytes: Maximum total length of the cached responses. 0 disables the cache.
+        """
+        self.max_bytes = max_bytes
+        self._revisions: dict[str, int] = {}
+        self._counter = 0
+        # Revision every entity has at least, set by `bump_all`.
+        self._all_revision = 0
+        # Keys are the IDs of the entities, values are tuples of the revision, the validator and the response.
+        self._responses: OrderedDict[str, tuple] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._responses)
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def revision(self, ID: str) -> int:
+        """
+        The current revision of the entity, 0 if it never changed.
+        """
+        return max(self._revisions.get(ID, 0), self._all_revision)
+
+    def bump(self, ID: str) -> int:
+        """
+        Marks the entity as changed, which makes any cached response for it stale.
+
+        :return: The new revision of the entity.
+        """
+        with self._lock:
+            self._counter += 1
+            self._revisions[ID] = self._counter
+            self._drop(ID)
+            return self._counter
+
+    def bump_all(self) -> int:
+        """
+        Marks every entity as changed and drops every cached response.
+
+        :return: The new revision of every entity.
+        """
+        with self._lock:
+            self._counter += 1
+            self._all_revision = self._counter
+            self._responses.clear()
+            self._size = 0
+            return self._counter
+
+    def forget(self, ID: str) -> None:
+        """
+        Drops the entity, for when it is no longer in the lair.
+        """
+        with self._lock:
+            self._revisions.pop(ID, None)
+            self._drop(ID)
+
+    def get(self, ID: str, revision: int, validator=None):
+        """
+        Returns the response cached for the entity at that revision, None if there is none.
+
+        :param validator: Optional value that must be equal to the one the response was stored with, for responses
+            that also depend on something outside of the entity.
+        """
+        with self._lock:
+            entry = self._responses.get(ID)
+            if entry is None or entry[0] != revision or entry[1] != validator:
+                return None
+            self._responses.move_to_end(ID)
+            return entry[2]
+
+    def put(self, ID: str, revision: int, response, validator=None) -> None:
+        """
+        Caches the response of the entity. Ignored if the entity changed since the revision the response was built
+        from.
+
+        :param revision: The revision of the entity read before the response was built.
+        """
+        if len(response) > self.max_bytes:
+            return
+        with self._lock:
+            if self.revision(ID) != revision:
+                return
+            self._drop(ID)
+            self._responses[ID] = (revision, validator, response)
+            self._size += len(response)
+            while self._size > self.max_bytes:
+                _, (_, _, dropped) = self._responses.popitem(last=False)
+                self._size -= len(dropped)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._responses.clear()
+            self._size = 0
+
+    def _drop(self, ID: str) -> None:
+        entry = self._responses.pop(ID, None)
+        if entry is not None:
+            self._size -= len(entry[2])
+
+
+class DiskCache:
+    """
+    Files derived from other files (renders, thumbnails) stored in a directory, one file per key. Keys should change
+    whenever what the file is derived from changes, so that a stored file never has to be invalidated.
+
+    The modification time of every file is the last time it was used, the least recently used ones are deleted once
+    their total size goes over `max_bytes`.
+    """
+
+    def __init__(self, directory: Union[str, Path], max_bytes: int, suffix: str = ''):
+        """
+        :param directory: The directory holding the files. Created with the first file. Files already in it are kept.
+        :param max_bytes: Maximum total size of the files. 0 disables the cache.
+        :param suffix: Suffix of the files, including the dot.
+        """
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        # Keys with the size of their file, least recently used first.
+        self._files: OrderedDict[str, int] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+        if self.directory.is_dir():
+            entries = []
+            for file in self.directory.glob(f'*{suffix}'):
+                # Temporary files start with a dot.
+                if file.name.startswith('.'):
+                    continue
+                try:
+                    stat = file.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime_ns, file.name[:len(file.name) - len(suffix)], stat.st_size))
+            for _, key, size in sorted(entries):
+                self._files[key] = size
+                self._size += size
+            self._evict()
+
+    def __len__(self):
+        return len(self._files)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._files
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def _path(self, key: str) -> Path:
+        return self.directory.joinpath(f'{key}{self.suffix}')
+
+    def get_bytes(self, key: str) -> Optional[bytes]:
+        """
+        Returns the contents of the file stored with key, None if there is none.
+        """
+        with self._lock:
+            if key not in self._files:
+                return None
+            self._files.move_to_end(key)
+
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self._size -= self._files.pop(key, 0)
+            return None
+        return data
+
+    def put_bytes(self, key: str, data: bytes) -> None:
+        """
+        Stores a file. Files larger than the whole cache are not stored.
+        """
+        if len(data) > self.max_bytes:
+            return
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+        # The files can be built again, no need to sync them to disk.
+        tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._size -= self._files.pop(key, 0)
+            self._files[key] = len(data)
+            self._size += len(data)
+            self._evict()
+
+    def _evict(self) -> None:
+        while self._size > self.max_bytes and len(self._files) > 0:
+            key, size = self._files.popitem(last=False)
+            self._size -= size
+            try:
+                self._path(key).unlink()
+            except OSError:
+                pass
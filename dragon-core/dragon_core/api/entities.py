@@ -1,26 +1,44 @@
 import os
 import re
+import atexit
 import json
 import copy
+import time
 import random
 import string
+import inspect
+import functools
+import threading
 from pathlib import Path
 from enum import Enum, auto
 from typing import Optional, Union, Tuple
 
-import nbformat
 import markdown
 from PIL import Image
-from nbconvert import HTMLExporter
 from werkzeug.utils import secure_filename
-from flask import abort, make_response, send_file, current_app
+from werkzeug.exceptions import HTTPException
+from flask import abort, make_response, send_file, current_app, request
 from markdown.extensions.tables import TableExtension
 
 
 from dragon_core.modules import Entity, Library, Notebook, Project, Task, Step, Bucket, Instance, DragonLair
 
+from dragon_core.utils import after_write, SharedLock
 from dragon_core.generators.meta import read_from_TOML
 from dragon_core.components.content_blocks import SupportedContentBlockType, ContentBlock
+from .index import EntityIndex, EntitySkeleton
+from .loader import load_entity_tree, referenced_paths, resolve_references, UUID_PATTERN
+from .images import ImageRegistry, IMAGE_REGISTRY_FILENAME
+from .watcher import LairWatcher
+from .caches import NegativeCache, ResponseCache
+from .links import BlockLinkCache
+from .thumbnails import ThumbnailCache, THUMBNAILS_DIRNAME, IMAGE_SIZES, image_mimetype
+from .renders import RenderCache, RenderQueue, RENDERS_DIRNAME, NOT_RENDERED, stream_html
+from .journal import (Journal, JOURNAL_FILENAME, apply_ops, block_op, version_op, comment_op, set_op,
+                      edit_time_op)
+from .write_behind import WriteBehindScheduler
+from .manifest import Manifest, MANIFEST_FILENAME
+from .storage import StorageBackend, TOMLStorage, SQLiteStorage, SQLITE_FILENAME
 from .converters import (MyMarkdownConverter,
                          CustomLinkExtension,
                          CustomHeadlessTableExtension,
@@ -61,7 +79,7 @@ ENTITY_TYPES = set()
 ALLOWED_PARENTAL_RELATIONS = {}
 
 # Holds all of the entities that exists in the notebook, uuid as key and the entity as value.
-INDEX = {}
+INDEX = EntityIndex()
 
 # Holds as keys the paths to the TOML files and as values the UUID of the entity
 PATH_TO_UUID_INDEX = {}
@@ -70,6 +88,125 @@ UUID_TO_PATH_INDEX = {}
 
 INSTANCEIMAGE = {}
 
+# Path, size, modification time and dimensions of the images of instances. Persisted next to the lair.
+IMAGE_REGISTRY: Optional[ImageRegistry] = None
+
+# Number of processes used to read the lair at startup. None uses the number of cpus.
+LOADING_WORKERS: Optional[int] = None
+# If True, a snapshot of the indices is kept next to the lair file so that restarts only read the changed files.
+USE_INDEX_SNAPSHOT = True
+# If True, only the skeletons of the entities in the libraries are loaded at startup.
+LAZY_LOADING = False
+# Megabytes of entities loaded on demand that are kept in memory when lazy loading is on.
+LAZY_MEMORY_BUDGET_MB = 256
+# Seconds between checks of the lair and bucket directories for files written by other processes. 0 disables them.
+WATCH_INTERVAL = 30.0
+# If True, changes in the lair and bucket directories are reported by the operating system when watchdog is installed.
+WATCH_EVENTS = True
+
+# Watches the lair and bucket directories and reloads the TOML files other processes write.
+WATCHER: Optional[LairWatcher] = None
+
+# If True, small changes to entities are appended to the journal of the lair instead of rewriting their TOML files.
+USE_JOURNAL = False
+# Size in megabytes of the journal after which its changes are written into the TOML files and the journal emptied.
+JOURNAL_COMPACTION_MB = 16
+
+JOURNAL: Optional[Journal] = None
+# IDs of the entities with changes in the journal that are not in their TOML file yet, with the sequence number of
+# their last change.
+JOURNAL_DIRTY: dict[str, int] = {}
+_COMPACTION_LOCK = threading.Lock()
+# Held while a change is added to JOURNAL_DIRTY and the journal, and while a written entity is removed from it.
+_JOURNAL_DIRTY_LOCK = threading.Lock()
+
+# Seconds without new changes after which a changed entity is written to disk. 0 writes changes immediately.
+WRITE_BEHIND_DELAY = 0.0
+# Maximum seconds a change waits before being written to disk when WRITE_BEHIND_DELAY is not 0.
+WRITE_BEHIND_MAX_DELAY = 5.0
+
+WRITE_BEHIND: Optional[WriteBehindScheduler] = None
+
+# IDs recently requested that could not be found anywhere in the lair.
+MISSING_IDS = NegativeCache(max_size=1024, ttl=30.0)
+
+# Maximum size of the cache holding the serialized response of `read_one` for every entity.
+RESPONSE_CACHE_MB = 64
+# Responses of `read_one`, valid until the entity changes. Every change to an entity must bump its revision.
+RESPONSE_CACHE = ResponseCache(max_bytes=RESPONSE_CACHE_MB * 1024 * 1024)
+
+# Markdown links of every content block, parsed once per version of the block.
+LINK_CACHE = BlockLinkCache()
+
+# Maximum size on disk of the html renders of the analysis notebooks of instances.
+RENDER_CACHE_MB = 512
+RENDER_CACHE: Optional[RenderCache] = None
+
+# Maximum size on disk of the downscaled copies of the images of instances.
+THUMBNAIL_CACHE_MB = 256
+THUMBNAIL_CACHE: Optional[ThumbnailCache] = None
+# Seconds browsers keep files requested with their current version, the same URL always returns the same file.
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# Number of processes rendering the notebooks added to instances in the background, 0 disables it.
+RENDER_WORKERS = 2
+# Maximum number of notebooks waiting to be rendered in the background.
+RENDER_QUEUE_SIZE = 64
+RENDER_QUEUE: Optional[RenderQueue] = None
+
+# Held while the indices are patched with files written by other processes.
+_RELOAD_LOCK = threading.RLock()
+
+# The batch of operations being applied by the current thread, see `apply_batch`. While one is active, entities are
+# only written once every operation of the batch succeeded.
+_BATCH = threading.local()
+# Held in shared mode by every API function that changes entities, and exclusively while a batch is applied. Rolling
+# back a batch then never undoes a change made by someone else, and nothing writes an entity halfway through a batch.
+_EDIT_LOCK = SharedLock()
+
+# If True, entities reference each other by UUID in their TOML files instead of by the paths of the files.
+ID_REFERENCES = False
+
+# UUID of every entity with the path of its TOML file. Persisted next to the lair.
+MANIFEST: Optional[Manifest] = None
+
+# Where the entities are stored, either "toml" (a TOML file per entity) or "sqlite" (a single database).
+STORAGE_BACKEND = "toml"
+SQLITE_PATH: Optional[Path] = None
+STORAGE: Optional[StorageBackend] = None
+
+
+def _read_option(key: str, default=None, cast=None):
+    """
+    Reads an optional setting. It comes from the config file when the server is started by the starting script and
+    from the environment variable with the upper case name of the key otherwise.
+
+    :param key: The name of the setting in the config file.
+    :param default: Value returned if the setting is not present.
+    :param cast: Optional callable used to convert the value, environment variables are always strings.
+    """
+    if not LOADING_FROM_ENV:
+        value = CONFIG.get(key, None)
+    else:
+        value = os.getenv(key.upper())
+        if value == "":
+            value = None
+
+    if value is None:
+        return default
+    if cast is not None:
+        return cast(value)
+    return value
+
+
+def _to_bool(value) -> bool:
+    """
+    Converts a setting into a boolean, settings coming from environment variables are strings.
+    """
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return bool(value)
+
 
 def set_initial_indices():
     global LOADING_FROM_ENV
@@ -85,6 +222,33 @@ def set_initial_indices():
     global PATH_TO_UUID_INDEX
     global UUID_TO_PATH_INDEX
     global INSTANCEIMAGE
+    global IMAGE_REGISTRY
+    global LOADING_WORKERS
+    global USE_INDEX_SNAPSHOT
+    global LAZY_LOADING
+    global LAZY_MEMORY_BUDGET_MB
+    global WATCH_INTERVAL
+    global WATCH_EVENTS
+    global MISSING_IDS
+    global RESPONSE_CACHE_MB
+    global RESPONSE_CACHE
+    global RENDER_CACHE_MB
+    global RENDER_CACHE
+    global THUMBNAIL_CACHE_MB
+    global THUMBNAIL_CACHE
+    global RENDER_WORKERS
+    global RENDER_QUEUE_SIZE
+    global RENDER_QUEUE
+    global USE_JOURNAL
+    global JOURNAL_COMPACTION_MB
+    global JOURNAL_DIRTY
+    global WRITE_BEHIND_DELAY
+    global WRITE_BEHIND_MAX_DELAY
+    global ID_REFERENCES
+    global MANIFEST
+    global STORAGE_BACKEND
+    global SQLITE_PATH
+    global STORAGE
 
     if not LOADING_FROM_ENV:
 
@@ -117,12 +281,34 @@ def set_initial_indices():
 
     set_api_url_prefix_and_host(api_url_prefix, url_host)
 
+    LOADING_WORKERS = _read_option('loading_workers', cast=int)
+    USE_INDEX_SNAPSHOT = _read_option('index_snapshot', default=True, cast=_to_bool)
+    LAZY_LOADING = _read_option('lazy_loading', default=False, cast=_to_bool)
+    LAZY_MEMORY_BUDGET_MB = _read_option('lazy_memory_budget_mb', default=256, cast=float)
+    WATCH_INTERVAL = _read_option('watch_interval', default=30.0, cast=float)
+    WATCH_EVENTS = _read_option('watch_events', default=True, cast=_to_bool)
+    USE_JOURNAL = _read_option('journal', default=False, cast=_to_bool)
+    JOURNAL_COMPACTION_MB = _read_option('journal_compaction_mb', default=16, cast=float)
+    WRITE_BEHIND_DELAY = _read_option('write_behind_delay', default=0.0, cast=float)
+    WRITE_BEHIND_MAX_DELAY = _read_option('write_behind_max_delay', default=5.0, cast=float)
+    ID_REFERENCES = _read_option('id_references', default=False, cast=_to_bool)
+    RESPONSE_CACHE_MB = _read_option('response_cache_mb', default=64, cast=float)
+    RENDER_CACHE_MB = _read_option('render_cache_mb', default=512, cast=float)
+    THUMBNAIL_CACHE_MB = _read_option('thumbnail_cache_mb', default=256, cast=float)
+    RENDER_WORKERS = _read_option('render_workers', default=2, cast=int)
+    RENDER_QUEUE_SIZE = _read_option('render_queue_size', default=64, cast=int)
+    STORAGE_BACKEND = _read_option('storage', default="toml", cast=lambda value: str(value).strip().lower())
+    if STORAGE_BACKEND not in ("toml", "sqlite"):
+        raise ValueError(f"Unknown storage backend {STORAGE_BACKEND}, it must be either 'toml' or 'sqlite'")
+
     DRAGONLAIR = DragonLair(LAIRSPATH)
+    SQLITE_PATH = _read_option('sqlite_path', default=DRAGONLAIR.dir_path.joinpath(SQLITE_FILENAME), cast=Path)
 
-    # Handles users that are in the config.
-    for user_email, user_name in config_users.items():
-        if user_email not in DRAGONLAIR.users:
-            DRAGONLAIR.add_user(user_email, user_name)
+    # Handles users that are in the config. The lair is only written if any of them is new.
+    with DRAGONLAIR.hold_writes():
+        for user_email, user_name in config_users.items():
+            if user_email not in DRAGONLAIR.users:
+                DRAGONLAIR.add_user(user_email, user_name)
 
     # List of classes that can contain children. Only Project and Task can contain children for now.
     PARENT_TYPES = ["Library", "Notebook", "Project", "Task"]
@@ -142,7 +328,13 @@ def set_initial_indices():
         "Instance": []
     }
 
-    INDEX = {}
+    memory_budget = int(LAZY_MEMORY_BUDGET_MB * 1024 * 1024) if LAZY_LOADING else None
+    # Entities with changes that are not in their TOML file yet must stay in memory.
+    INDEX = EntityIndex(loader=_materialize_entity,
+                        memory_budget=memory_budget,
+                        can_evict=lambda ID: not _has_unwritten_changes(ID),
+                        on_evict=lambda ent: LINK_CACHE.discard([block.ID for block in ent.content_blocks]))
+    JOURNAL_DIRTY = {}
 
     # Holds as keys the paths to the TOML files and as values the UUID of the entity
     PATH_TO_UUID_INDEX = {}
@@ -151,14 +343,102 @@ def set_initial_indices():
 
     INSTANCEIMAGE = {}
 
+    MISSING_IDS.clear()
+    LINK_CACHE.clear()
+    RESPONSE_CACHE = ResponseCache(max_bytes=int(RESPONSE_CACHE_MB * 1024 * 1024))
+
+    IMAGE_REGISTRY = ImageRegistry(DRAGONLAIR.dir_path.joinpath(IMAGE_REGISTRY_FILENAME))
+    # Without ID references no file needs the manifest to be found, it is only read for files written with them on.
+    MANIFEST = Manifest(DRAGONLAIR.dir_path.joinpath(MANIFEST_FILENAME), read_only=not ID_REFERENCES)
+
+    if STORAGE_BACKEND == "sqlite":
+        STORAGE = SQLiteStorage(SQLITE_PATH)
+    else:
+        STORAGE = TOMLStorage(DRAGONLAIR.dir_path,
+                              max_workers=LOADING_WORKERS,
+                              use_snapshot=USE_INDEX_SNAPSHOT,
+                              manifest=MANIFEST.paths,
+                              translate_ref=None if ID_REFERENCES else _uuid_to_path)
+
     if not RESOURCEPATH.exists():
         RESOURCEPATH.mkdir(parents=True)
 
+    RENDER_CACHE = RenderCache(RESOURCEPATH.joinpath(RENDERS_DIRNAME), max_bytes=int(RENDER_CACHE_MB * 1024 * 1024))
+    RENDER_QUEUE = RenderQueue(RENDER_CACHE, max_workers=RENDER_WORKERS, max_queued=RENDER_QUEUE_SIZE)
+    THUMBNAIL_CACHE = ThumbnailCache(RESOURCEPATH.joinpath(THUMBNAILS_DIRNAME),
+                                     max_bytes=int(THUMBNAIL_CACHE_MB * 1024 * 1024))
+
 
 def reset():
+    global WATCHER
+    global JOURNAL
+    global WRITE_BEHIND
+
+    if WATCHER is not None:
+        WATCHER.stop()
+    if WRITE_BEHIND is not None:
+        WRITE_BEHIND.stop()
+        WRITE_BEHIND = None
+    if JOURNAL is not None:
+        JOURNAL.close()
+        JOURNAL = None
+    if STORAGE is not None:
+        STORAGE.close()
+    if RENDER_QUEUE is not None:
+        RENDER_QUEUE.stop()
+
     set_initial_indices()
+
+    # The journal is always opened if it exists so that changes made while it was enabled are never lost.
+    journal_path = DRAGONLAIR.dir_path.joinpath(JOURNAL_FILENAME)
+    if USE_JOURNAL or journal_path.is_file():
+        JOURNAL = Journal(journal_path)
+
+    # The watcher records the state of the files before they are loaded, anything written while loading is
+    # picked up by the first poll. Entities in a database are only ever written by the server, nothing to watch.
+    WATCHER = None
+    if isinstance(STORAGE, TOMLStorage):
+        WATCHER = LairWatcher(on_change=reload_paths, interval=WATCH_INTERVAL, use_events=WATCH_EVENTS)
+        WATCHER.add_root(LAIRSPATH)
+        for bucket_path in DRAGONLAIR.buckets.values():
+            WATCHER.add_root(Path(bucket_path).parent)
+
     load_all_entities()
 
+    if JOURNAL is not None:
+        replay_journal()
+        if not USE_JOURNAL:
+            JOURNAL.close()
+            JOURNAL = None
+            journal_path.unlink()
+
+    if WRITE_BEHIND_DELAY > 0:
+        WRITE_BEHIND = WriteBehindScheduler(flush=_write_pending_entity,
+                                            quiet_period=WRITE_BEHIND_DELAY,
+                                            max_delay=WRITE_BEHIND_MAX_DELAY)
+
+    if WATCHER is not None:
+        WATCHER.start()
+
+
+def shutdown():
+    """
+    Writes every change that is still only in memory. Runs when the server exits.
+    """
+    if WRITE_BEHIND is not None:
+        WRITE_BEHIND.stop()
+    if WATCHER is not None:
+        WATCHER.stop()
+    if JOURNAL is not None:
+        JOURNAL.close()
+    if STORAGE is not None:
+        STORAGE.close()
+    if RENDER_QUEUE is not None:
+        RENDER_QUEUE.stop()
+
+
+atexit.register(shutdown)
+
 
 def get_indices():
 
@@ -168,61 +448,242 @@ def get_indices():
     return ret
 
 
-def create_path_entity_copy(ent: Entity) -> Entity:
+def _uuid_to_path(ref: str) -> str:
     """
-    Returns a copy of the passed entity with any mention to a UUID replaced with the paths of the TOML files for that
-    entity. This is used to convert from working with paths to working with UUID
+    Translates the ID of an entity into the path of its TOML file, which is how references to other entities are
+    stored on disk. References that are not in the index are written as they are.
+    """
+    return str(UUID_TO_PATH_INDEX.get(ref, ref))
+
 
-    :param ent: The entity you want a copy with the UUIDs replaced with paths :param index: A reverse of the
-     PATH_TO_UUID_INDEX dictionary. This is used to convert from UUID to paths If not passed, it will be created on demand. The
-     intention of having it optional is to avoid having to compute it every time this function is called if this
-     function gets called multiple times for a single operation. :return:
+def _write_entity(ent: Entity, path: Optional[Union[str, Path]] = None, edit: bool = True) -> None:
     """
+    Writes an entity to storage. In TOML files, the UUIDs it holds are replaced by paths unless ID references are on.
+    Every write of an entity should go through here so that the watcher does not report the changes made by the
+    server itself.
 
-    ent.add_edit_timestamp()
+    :param ent: The entity to write.
+    :param path: The path of the TOML file. If None, the path of the entity in the index is used.
+    :param edit: If False, the write only stores changes whose edit time was already recorded (from the journal for
+        example) and no new edit time is added.
+    """
+    RESPONSE_CACHE.bump(ent.ID)
+    if _defer_to_batch(ent, path):
+        return
+
+    if path is None:
+        path = UUID_TO_PATH_INDEX[ent.ID]
+
+    if edit:
+        ent.add_edit_timestamp()
+    written_at = time.monotonic()
+    # Changes appended to the journal after this point might not be in what is written.
+    journal_seq = JOURNAL.last_seq if JOURNAL is not None else None
+    STORAGE.write(ent, path)
+    # Saved once the file is on disk, so the manifest never points to a file that is not in place yet.
+    MANIFEST.set(ent.ID, path)
+
+    if WRITE_BEHIND is not None:
+        WRITE_BEHIND.discard(ent.ID, written_at=written_at)
+
+    # Inside a write batch the file is only in place, and on disk, once the batch ends.
+    after_write(lambda: _entity_written(ent.ID, path, journal_seq))
+
+
+def _entity_written(ID: str, path: Union[str, Path], journal_seq: Optional[int] = None) -> None:
+    if WATCHER is not None:
+        WATCHER.acknowledge(path)
+    MANIFEST.save()
+
+    # The TOML file now holds every change in the journal up to journal_seq. The entity stays dirty if it changed
+    # while it was being written.
+    if journal_seq is not None and ID in JOURNAL_DIRTY:
+        JOURNAL.checkpoint(ID, upto=journal_seq)
+        with _JOURNAL_DIRTY_LOCK:
+            if JOURNAL_DIRTY.get(ID, journal_seq) <= journal_seq:
+                JOURNAL_DIRTY.pop(ID, None)
 
-    copy_ent = copy.deepcopy(ent)
-    if ent.parent in UUID_TO_PATH_INDEX:
-        copy_ent.parent = UUID_TO_PATH_INDEX[ent.parent]
 
-    children_paths = []
-    for child in copy_ent.children:
-        children_paths.append(UUID_TO_PATH_INDEX[child])
-    copy_ent.children = children_paths
+def _defer_to_batch(ent: Entity, path: Optional[Union[str, Path]] = None) -> bool:
+    """
+    Records the entity as touched if the current thread is applying a batch, instead of writing it.
+
+    :return: True if the write was deferred.
+    """
+    touched = getattr(_BATCH, 'touched', None)
+    if touched is None:
+        return False
+    _pin_for_batch(ent.ID)
+    if path is not None or ent.ID not in touched:
+        touched[ent.ID] = path
+    return True
+
+
+def _pin_for_batch(ID: str) -> None:
+    # Touched entities are kept in memory until the batch is written or rolled back. Every batch pins them once.
+    if ID not in _BATCH.pinned:
+        _BATCH.pinned.add(ID)
+        INDEX.pin([ID])
+
+
+def _unpin_batch() -> None:
+    INDEX.unpin(_BATCH.pinned)
+    _BATCH.pinned = set()
 
-    # TODO: This should probably get removed
-    order = []
-    for item, item_type, deleted in copy_ent.order:
-        if item_type == "entity":
-            order.append((UUID_TO_PATH_INDEX[item], item_type, deleted))
+
+def _edited_IDs(args: list) -> list[str]:
+    """
+    Returns the IDs of the entities an API function could change: the entities in its arguments and their parents.
+    """
+    IDs = _argument_IDs(args)
+    for ID in list(IDs):
+        try:
+            parent = INDEX.skeleton(ID).parent
+        except KeyError:
+            continue
+        if parent in INDEX:
+            IDs.append(parent)
+    return IDs
+
+
+def _edits_entities(function):
+    """
+    Decorator of the API functions that change entities. They never run while a batch is being applied, and the
+    entities they get are pinned in memory until they return. Otherwise the index could evict an entity after it was
+    changed but before its write was scheduled, and the change would be lost.
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with _EDIT_LOCK.shared(), INDEX.pinned(_edited_IDs(list(args) + list(kwargs.values()))):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+def _has_unwritten_changes(ID: str) -> bool:
+    """
+    True if the entity has changes that are only in memory or in the journal, or is being changed right now.
+    """
+    return (ID in JOURNAL_DIRTY or INDEX.is_pinned(ID)
+            or (WRITE_BEHIND is not None and WRITE_BEHIND.is_pending(ID)))
+
+
+def _write_pending_entity(ID: str) -> None:
+    """
+    Writes an entity whose write was delayed. Called by the write behind scheduler.
+    """
+    with _EDIT_LOCK.shared():
+        if ID in INDEX:
+            _write_entity(INDEX[ID])
+
+
+def _persist_change(ent: Entity, ops: list[list]) -> None:
+    """
+    Persists a small change to an entity. With the journal enabled only the operations describing the change are
+    appended to it. Otherwise the whole entity is written to its TOML file, right away or, with write behind enabled,
+    once the changes to it stop for a moment.
+
+    :param ent: The changed entity.
+    :param ops: The operations describing the change, created with the functions in the journal module.
+    """
+    RESPONSE_CACHE.bump(ent.ID)
+    # The whole entity is written once the batch is done.
+    if _defer_to_batch(ent):
+        return
+
+    if not USE_JOURNAL:
+        if WRITE_BEHIND is not None:
+            WRITE_BEHIND.schedule(ent.ID)
         else:
-            order.append((item, item_type, deleted))
+            _write_entity(ent)
+        return
 
-    data_buckets = []
-    for bucket in copy_ent.data_buckets:
-        data_buckets.append(UUID_TO_PATH_INDEX[bucket])
-    copy_ent.data_buckets = data_buckets
+    ent.add_edit_timestamp()
+    with _JOURNAL_DIRTY_LOCK:
+        seq = JOURNAL.append(ent.ID, ops + [edit_time_op(ent)], wait=False)
+        JOURNAL_DIRTY[ent.ID] = seq
+    JOURNAL.wait(seq)
 
-    return copy_ent
+    if JOURNAL.size > JOURNAL_COMPACTION_MB * 1024 * 1024:
+        compact_journal()
 
 
-def content_block_path_to_uuid(content: str):
+def compact_journal() -> None:
+    """
+    Writes every entity with changes in the journal into its TOML file and removes those changes from the journal.
+    """
+    with _EDIT_LOCK.shared(), _COMPACTION_LOCK:
+        offset = JOURNAL.flush()
+        with STORAGE.batch():
+            for ID in list(JOURNAL_DIRTY):
+                if ID in INDEX:
+                    _write_entity(INDEX[ID], edit=False)
+        # Only the checkpoints written above and changes made while compacting are left.
+        JOURNAL.trim(offset)
 
-    def replacer(match):
-        # Extract the text and file path from the match
-        text = match.group(1)
-        file_path = match.group(2)
-        # If the file path is a key in the replacements dictionary, replace it
-        # Otherwise, keep the original file path
-        new_file_path = PATH_TO_UUID_INDEX.get(file_path, file_path)
-        # Return the reconstructed string with the replacement file path
-        return f'{text}({new_file_path})'
 
-    # Regex pattern for file paths preceded by text in square brackets and enclosed in parentheses
-    pattern = r'(\[.*?\])\(([\w\-.\/\s]+)\)'
+def replay_journal() -> None:
+    """
+    Applies the changes in the journal that are not in the TOML files yet to the entities in the index, and
+    compacts the journal afterwards.
+    """
+    pending = JOURNAL.pending_ops()
+    for ID, ops in pending.items():
+        if ID not in INDEX:
+            print(f"Ignoring journal entries of entity {ID}, it is not in the lair")
+            continue
+        apply_ops(INDEX[ID], ops)
+        RESPONSE_CACHE.bump(ID)
+        JOURNAL_DIRTY[ID] = JOURNAL.last_seq
+
+    if len(pending) > 0 or JOURNAL.size > 0:
+        compact_journal()
 
-    replaced_s = re.sub(pattern, replacer, content)
-    return replaced_s
+
+def get_analysis_html(ID, index):
+    """
+    API function that returns the html of one of the analysis notebooks of an instance. The html is streamed, gzip
+    compressed if the client accepts it. The ETag changes with the notebook, so a client that already has the current
+    render gets an empty 304 response.
+
+    :param ID: The ID of the instance.
+    :param index: The position of the notebook in the analysis of the instance.
+    """
+    if ID not in INDEX:
+        find_unknown_entity(ID)
+    if ID not in INDEX or not isinstance(INDEX[ID], Instance):
+        abort(404, f"Instance with ID {ID} not found")
+
+    instance = INDEX[ID]
+    if index < 0 or index >= len(instance.analysis):
+        abort(404, f"Instance {ID} does not have an analysis notebook at index {index}")
+
+    analysis_nb = instance.analysis[index]
+    key = RENDER_CACHE.key(analysis_nb)
+    if key is None:
+        abort(404, f"Notebook with path {analysis_nb} not found")
+
+    compress = request.accept_encodings['gzip'] > 0
+    etag = f"{key}-gzip" if compress else key
+    if request.if_none_match.contains_weak(etag):
+        response = make_response("", 304)
+    else:
+        response = current_app.response_class(stream_html(RENDER_QUEUE.render(analysis_nb), compress),
+                                              mimetype='text/html')
+        if compress:
+            response.headers['Content-Encoding'] = 'gzip'
+    response.set_etag(etag)
+    # Always revalidated, the URL stays the same when the notebook changes.
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+def content_block_path_to_uuid(block: ContentBlock) -> str:
+    """
+    Returns the latest version of a content block with the paths in its links replaced by the UUIDs of the entities
+    in those files. The block is only parsed again when it has a new version, see `BlockLinkCache`.
+    """
+    return LINK_CACHE.rewrite_latest(block, PATH_TO_UUID_INDEX)
 
 
 def _parse_and_validate_user(users_str) -> list[str]:
@@ -265,160 +726,276 @@ def add_ent_to_index(entity: Entity, entity_path: Union[Path, str]) -> None:
     :param entity_path: The path on disk to the TOML file that contains the entity.
     """
 
-    if entity.ID not in INDEX:
+    if isinstance(entity, EntitySkeleton):
+        INDEX.add_skeleton(entity)
+    elif entity.ID not in INDEX:
         INDEX[entity.ID] = entity
+    MISSING_IDS.discard(entity.ID)
 
     if entity_path not in PATH_TO_UUID_INDEX:
         PATH_TO_UUID_INDEX[str(entity_path)] = entity.ID
+        # Links in the content blocks of other entities might point to the new path.
+        RESPONSE_CACHE.bump_all()
 
     if entity.ID not in UUID_TO_PATH_INDEX:
         UUID_TO_PATH_INDEX[entity.ID] = str(entity_path)
+        MANIFEST.set(entity.ID, entity_path)
 
 
-def initialize_bucket(bucket_path):
+def _materialize_entity(ID: str) -> Tuple[Entity, int]:
     """
-    Function that initializes a bucket by adding it to the index and initializing the instances it contains.
+    Reads the full entity of a skeleton in the index. Used by the index the first time a skeleton is accessed.
 
-    :param bucket: The bucket that is being initialized.
+    :param ID: The ID of the entity.
+    :return: The entity with its references resolved and the size in bytes of its TOML file.
     """
-    bucket = read_from_TOML(bucket_path)
+    ent, size = STORAGE.read(ID, UUID_TO_PATH_INDEX[ID])
 
-    add_ent_to_index(bucket, bucket_path)
+    dangling = resolve_references(INDEX, PATH_TO_UUID_INDEX, entities={ID: ent})
+    for _, field, ref in dangling:
+        print(f"Entity {ID} has a reference to an entity that is not in the lair ({field}): {ref}")
 
-    for ins_path in bucket.path_to_uuid.keys():
-        instance = read_from_TOML(ins_path)
-        add_ent_to_index(instance, ins_path)
+    return ent, size
 
-        # add images to the image index
-        for img_path in instance.images:
-            path = Path(img_path).resolve()
-            # Only need to add image if it is an actual image, not html plot
-            if path.suffix == '.jpg' or path.suffix == '.png':
-                img = Image.open(path)
-                INSTANCEIMAGE[img_path] = instance.ID
-            elif path.suffix == '.html':
-                pass
 
-    return bucket
+def register_instance_images(instance: Instance, check_images: bool = True) -> None:
+    """
+    Adds the images of an instance to the image index.
+
+    :param instance: The instance whose images are being registered.
+    :param check_images: If True, the records of the images in the image registry are refreshed, which only reads
+        the header of images that are new or changed. Instances coming from a snapshot had their images checked
+        when they were first loaded.
+    """
+    for img_path in instance.images:
+        path = Path(img_path)
+        # Only need to add image if it is an actual image, not html plot
+        if path.suffix == '.jpg' or path.suffix == '.png':
+            if check_images and IMAGE_REGISTRY.refresh(img_path) is None:
+                print(f"Image with path {img_path} of instance {instance.ID} not found")
+                continue
+            INSTANCEIMAGE[img_path] = instance.ID
+        elif path.suffix == '.html':
+            pass
 
 
 def process_content_blocks(entity):
     """
     Function that processes the content blocks of an entity and checks for markdown links.
+    Only versions of the blocks that were not processed before are parsed, so entities reloaded without changes to
+    their blocks do not touch the image registry.
 
     :param entity: The entity whose content blocks are being processed.
     """
-    # Regular expression pattern for markdown links
-    pattern = r'\[(.*?)\]\((.*?)\)'
-
     for block in entity.content_blocks:
-        for content in block.content:
-            if isinstance(content, str):
-                matches = re.findall(pattern, content)
-                for match in matches:
-                    # Tries converting it to path and see if the path exists.
-                    # Catches all failures because we don't want to crash if the path doesn't or isn't a path format.
-                    try:
-                        path = Path(match[1]).resolve()
-                    except Exception as e:
-                        continue
-                    if path.exists() and path.suffix == '.jpg' or path.suffix == '.png':
-                        img = Image.open(path)
+        for path in LINK_CACHE.new_images(block):
+            IMAGE_REGISTRY.refresh(path)
 
 
-def recursively_load_entity(entity_path: Path):
+def health_check():
     """
-    Loads an entity from a TOML file and recursively loads all of its children as well.
+    Function that checks if the server is running
     """
+    return make_response("Server is running", 201)
 
-    ent = read_from_TOML(entity_path)
-
-    add_ent_to_index(ent, entity_path)
 
-    child_list = []
-    if len(ent.children) > 0:
-        for child in ent.children:
-            try:
-                ent_dict, child = recursively_load_entity(child)
-                child_list.append(ent_dict)
-            except Exception as e:
-                print(f"Error reading child {ent.name} with path {UUID_TO_PATH_INDEX[ent.ID]} exception: \n{e}")
-                raise e
+def get_render_status():
+    """
+    API function that returns the state of the background rendering of notebooks: how many are queued, how many were
+    rendered and the size of the render cache.
+    """
+    return json.dumps(RENDER_QUEUE.status()), 200
 
-    # TODO: Change this to check if the bucket has been initialized.
-    # data_buckets = []
-    # for bucket_path in ent.data_buckets:
-    #     bucket = initialize_bucket(bucket_path)
-    #     data_buckets.append(bucket.ID)
 
-    process_content_blocks(ent)
+def load_all_entities():
+    """
+    Function that reads all the entities of the lair and adds them to the indices.
 
+    Every entity reachable from the buckets and libraries of the lair is read from storage first (for TOML files in
+    parallel, see `load_entity_tree`), the references between entities are resolved afterwards in a single pass over
+    the index. If a snapshot from a previous run exists, only the TOML files that changed since it was written are
+    parsed. With lazy loading on, only the skeletons of the entities below the libraries are read.
+    """
 
-    ret_dict = {"id": ent.ID,
-                "name": ent.name,
-                "type": ent.__class__.__name__,
-                "children": child_list,
-                }
+    bucket_paths = [str(bucket_path) for bucket_path in DRAGONLAIR.buckets.values()]
+    library_paths = [str(dragon_library.path) for dragon_library in DRAGONLAIR.libraries]
 
-    return ret_dict, ent
+    loaded = STORAGE.load(bucket_paths)
+    loaded.update(STORAGE.load(library_paths, skeleton_depth=1 if LAZY_LOADING else None))
 
+    for ent_path, loaded_file in loaded.items():
+        add_ent_to_index(loaded_file.entity, ent_path)
+        # If the entity was already in the index, that object is the one kept.
+        loaded_file.entity = INDEX.peek(loaded_file.entity.ID)
+        ent = loaded_file.entity
 
-def health_check():
-    """
-    Function that checks if the server is running
-    """
-    return make_response("Server is running", 201)
+        if isinstance(ent, Instance):
+            register_instance_images(ent, check_images=not loaded_file.from_snapshot)
+        elif not isinstance(ent, (Bucket, EntitySkeleton)) and not loaded_file.from_snapshot:
+            process_content_blocks(ent)
 
+    for dragon_library in DRAGONLAIR.libraries:
+        DRAGONLAIR.insert_library_instance(loaded[str(dragon_library.path)].entity)
+
+    # References are replaced after all the entities are in the index to make sure that the referenced entity
+    # is already there, there might be edge cases where a lower entity in the tree has a parent somewhere else
+    # (probably more important once we start allowing branching)
+    dangling = resolve_references(INDEX, PATH_TO_UUID_INDEX, entities=INDEX.loaded())
+    if len(dangling) > 0:
+        print(f"Found {len(dangling)} references to entities that are not in the lair:")
+        for ID, field, ref in dangling:
+            print(f"    {ID} ({field}): {ref}")
+
+    # Entities that are not in the lair anymore are dropped from the manifest.
+    for ID in [ID for ID in MANIFEST.paths if ID not in UUID_TO_PATH_INDEX]:
+        MANIFEST.remove(ID)
+
+    # Files that still reference other entities by path are rewritten once, so that renaming any entity later only
+    # needs to rewrite its own file.
+    if ID_REFERENCES:
+        by_path = [loaded_file.entity.ID for loaded_file in loaded.values() if loaded_file.by_path]
+        if len(by_path) > 0:
+            print(f"Rewriting {len(by_path)} entities to reference other entities by ID")
+            with STORAGE.batch():
+                for ID in by_path:
+                    _write_entity(INDEX[ID])
+    MANIFEST.save()
+
+    STORAGE.finish_load(loaded)
+
+    IMAGE_REGISTRY.save()
+
+
+def reload_paths(changed: list[str], removed: list[str]) -> None:
+    """
+    Patches the indices with TOML files written or removed by other processes. Called by the watcher.
+
+    Only the changed files are read, together with any file they reference that is not in the lair yet (for example
+    the instances of a bucket). Entities already in the index are replaced by the new version.
+
+    :param changed: Paths of the new or modified TOML files.
+    :param removed: Paths of the removed TOML files.
+    """
+    with _RELOAD_LOCK:
+        _reload_paths(changed, removed)
+
+
+def _reload_paths(changed: list[str], removed: list[str]) -> None:
+    loaded = {}
+    for path in changed:
+        try:
+            loaded[path] = read_from_TOML(path)
+        except Exception as e:
+            print(f"Could not reload entity with path {path} exception: \n{e}")
+
+    # New entities might reference files that are not in any watched directory.
+    new_refs = [MANIFEST.translate(ref) for ent in loaded.values() for ref in referenced_paths(ent)]
+    new_refs = [ref for ref in new_refs
+                if ref not in PATH_TO_UUID_INDEX and ref not in loaded and ref not in INDEX and Path(ref).is_file()]
+    if len(new_refs) > 0:
+        for path, loaded_file in load_entity_tree(new_refs, max_workers=1, manifest=MANIFEST.paths).items():
+            if path not in PATH_TO_UUID_INDEX and path not in loaded:
+                loaded[path] = loaded_file.entity
+
+    paths_changed = False
+    for path, ent in loaded.items():
+        old_path = UUID_TO_PATH_INDEX.get(ent.ID)
+        if old_path is not None and old_path != path:
+            PATH_TO_UUID_INDEX.pop(old_path, None)
+        paths_changed = paths_changed or PATH_TO_UUID_INDEX.get(path) != ent.ID
+        PATH_TO_UUID_INDEX[path] = ent.ID
+        UUID_TO_PATH_INDEX[ent.ID] = path
+        MANIFEST.set(ent.ID, path)
+
+    dangling = resolve_references(INDEX, PATH_TO_UUID_INDEX, entities={ent.ID: ent for ent in loaded.values()})
+    for ID, field, ref in dangling:
+        print(f"Entity {ID} has a reference to an entity that is not in the lair ({field}): {ref}")
+
+    for path, ent in loaded.items():
+        if _has_unwritten_changes(ent.ID):
+            print(f"Ignoring changes to {path} made by another process, the entity has changes that are not written yet")
+            continue
+        if ent.ID in INDEX:
+            INDEX.replace(ent.ID, ent)
+        else:
+            INDEX[ent.ID] = ent
+        RESPONSE_CACHE.bump(ent.ID)
+        MISSING_IDS.discard(ent.ID)
 
-def load_all_entities():
-    """
-    Function that reads all the entities and return a dictionary with nested entities
-    :return:
+        if isinstance(ent, Instance):
+            register_instance_images(ent)
+        elif isinstance(ent, Library):
+            DRAGONLAIR.insert_library_instance(ent)
+        elif not isinstance(ent, Bucket):
+            process_content_blocks(ent)
+
+    for path in removed:
+        ID = PATH_TO_UUID_INDEX.get(path)
+        # If the entity was moved to a different file, its new path is already in the index.
+        if ID is None or UUID_TO_PATH_INDEX.get(ID) != path:
+            continue
+        del PATH_TO_UUID_INDEX[path]
+        del UUID_TO_PATH_INDEX[ID]
+        MANIFEST.remove(ID)
+        RESPONSE_CACHE.forget(ID)
+        paths_changed = True
+        if ID in INDEX:
+            del INDEX[ID]
+        for img_path in [img for img, img_ID in INSTANCEIMAGE.items() if img_ID == ID]:
+            del INSTANCEIMAGE[img_path]
+
+    # Links in the content blocks of any entity might point to the paths that changed.
+    if paths_changed:
+        RESPONSE_CACHE.bump_all()
+
+    IMAGE_REGISTRY.save()
+    MANIFEST.save()
+
+
+def find_unknown_entity(ID: str) -> bool:
+    """
+    Looks for an entity that is not in the index, in case another process wrote it since the watcher last checked.
+    Entity files are named after the first 8 characters of their ID, so only the files with that prefix are read.
+    IDs that are not found are remembered for a while, so asking for them again costs nothing.
+
+    Only the directories as the watcher last listed them are searched, new directories are found by its next poll.
+    Without a watcher polling in the background, the lair and bucket directories are searched for the file instead.
+
+    :param ID: The ID of the entity.
+    :return: True if the entity was found and is now in the index.
     """
+    if ID in INDEX:
+        return True
+    if UUID_PATTERN.match(ID) is None or ID in MISSING_IDS:
+        return False
+
+    prefix = ID[:8] + '_'
+    candidates = WATCHER.find(prefix) if WATCHER is not None else []
+    if (WATCHER is None or WATCH_INTERVAL <= 0) and isinstance(STORAGE, TOMLStorage):
+        roots = [LAIRSPATH] + [Path(bucket_path).parent for bucket_path in DRAGONLAIR.buckets.values()]
+        for root in roots:
+            candidates += [str(path) for path in Path(root).rglob(f'{prefix}*.toml')]
+
+    candidates = [path for path in dict.fromkeys(candidates) if path not in PATH_TO_UUID_INDEX]
+    if len(candidates) > 0:
+        reload_paths(candidates, [])
+        if WATCHER is not None:
+            for path in candidates:
+                WATCHER.acknowledge(path)
 
-    for bucket_path in DRAGONLAIR.buckets.values():
-        bucket = initialize_bucket(bucket_path)
-
-    for dragon_library in DRAGONLAIR.libraries:
-        ret_dict, library = recursively_load_entity(dragon_library.path)
-        DRAGONLAIR.insert_library_instance(library)
-
-    # We replace the parent and children after we are done going through all identities to make sure that
-    # the parent is already in the index, there might be edge cases where a lower entity in the tree has a parent
-    # somewhere else (probably more important once we start allowing branching)
-
-    # Update the parent of the children
-    for key, val in INDEX.items():
-        path = Path(val.parent)
-        if path.is_file():
-            val.parent = PATH_TO_UUID_INDEX[str(path)]
-
-        # Update the children of the parent
-        for child in val.children:
-            path = Path(child)
-            if path.is_file():
-                val.children[val.children.index(child)] = PATH_TO_UUID_INDEX[str(path)]
-
-        # Update the order:
-        order_copy = val.order.copy()
-        for i, (item, item_type, show) in enumerate(order_copy):
-            if item_type == "entity":
-                path = Path(item)
-                if path.is_file():
-                    val.order[i] = (PATH_TO_UUID_INDEX[str(path)], item_type, show)
-
-        for buck in val.data_buckets:
-            path = Path(buck)
-            if path.is_file():
-                val.data_buckets[val.data_buckets.index(buck)] = PATH_TO_UUID_INDEX[str(path)]
+    if ID not in INDEX:
+        MISSING_IDS.add(ID)
+        return False
+    return True
 
 
 def _generate_structure_helper(ent):
 
-    children = [_generate_structure_helper(INDEX[child]) for child in ent.children if INDEX[child].deleted is False]
+    children = [_generate_structure_helper(INDEX.skeleton(child))
+                for child in ent.children if INDEX.skeleton(child).deleted is False]
     name = ent.name
     ID = ent.ID
-    type_ = ent.__class__.__name__
+    type_ = INDEX.entity_type(ID)
     return {"name": name, "id": ID, "children": children, "type": type_}
 
 
@@ -427,15 +1004,36 @@ def generate_structure(ID=None):
     ret = []
     if ID is None:
         for lib in DRAGONLAIR.libraries:
-            ret.append(_generate_structure_helper(INDEX[lib.ID]))
+            ret.append(_generate_structure_helper(INDEX.skeleton(lib.ID)))
     else:
         if ID not in INDEX:
             abort(404, f"Entity with ID {ID} not found")
-        ret = _generate_structure_helper(INDEX[ID])
+        ret = _generate_structure_helper(INDEX.skeleton(ID))
 
     return make_response(json.dumps(ret), 200)
 
 
+def _stat(path) -> Optional[os.stat_result]:
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+
+def _file_version(path, stat: Optional[os.stat_result] = None) -> Optional[str]:
+    """
+    Returns a validator of the contents of a file, made from its size and modification time. None if the file does
+    not exist.
+
+    :param stat: The result of `os.stat` on the file if the caller already has it.
+    """
+    if stat is None:
+        stat = _stat(path)
+    if stat is None:
+        return None
+    return f"{stat.st_size:x}-{stat.st_mtime_ns:x}"
+
+
 # FIXME: This is a bad name, it should probably be read entity or something like that instead.
 def read_one(ID, name_only=False):
     """
@@ -448,8 +1046,9 @@ def read_one(ID, name_only=False):
     if ID == "null":
         abort(404, "ID is null")
 
+    # The entity might have been written by a different process since the last time the watcher checked.
     if ID not in INDEX:
-        load_all_entities()
+        find_unknown_entity(ID)
 
     if ID in INDEX:
         ent = INDEX[ID]
@@ -457,36 +1056,52 @@ def read_one(ID, name_only=False):
         if name_only:
             return ent.name, 200
 
-        ent_copy = copy.deepcopy(ent)
-        for block in ent_copy.content_blocks:
-            if block.block_type == SupportedContentBlockType.text.value:
-                replaced_path = content_block_path_to_uuid(block.content[-1])
-                block.content[-1] = replaced_path
-
-        # If it is an instance, convert the notebooks into html
+        # The revision is read before serializing, a change made meanwhile bumps it and the response is not reused.
+        revision = RESPONSE_CACHE.revision(ID)
+        # Instances list the state of the render of their notebooks, the response is rebuilt if any of them changed.
+        # Every file is only looked at once, the same stat gives the version of the file and the key of its render.
+        validator = None
         if isinstance(ent, Instance):
-            converted_analysis = []
-            for analysis_nb in ent_copy.analysis:
-                    # Read the notebook
-                    nb = nbformat.read(analysis_nb, as_version=4)
-
-                    # Create HTML exporter
-                    html_exporter = HTMLExporter()
-                    html_exporter.theme = "dark"  # Change the theme of the notebook
-                    html_exporter.template_name = 'classic'  # use classic template (you can change this)
-
-                    # Export the notebook to HTML format
-                    (body, resources) = html_exporter.from_notebook_node(nb)
-                    converted_analysis.append((Path(analysis_nb).stem, str(body)))
-
-            # TOML table does not like having a string that is as long as an html file so the conversion needs to happen
-            # after the TOML conversion.
-            serialized = dict(ent_copy.to_TOML()[ent_copy.name])
-            serialized['analysis'] = converted_analysis
-
-            return json.dumps(serialized), 201
+            nb_stats = [_stat(nb) for nb in ent.analysis]
+            validator = (tuple(RENDER_QUEUE.state(nb, stat=stat) for nb, stat in zip(ent.analysis, nb_stats)),
+                         tuple(_file_version(nb, stat) for nb, stat in zip(ent.analysis, nb_stats)),
+                         tuple(_file_version(img) for img in ent.images))
+        cached = RESPONSE_CACHE.get(ID, revision, validator)
+        if cached is not None:
+            return cached, 201
+
+        # The html of the notebooks of instances is not sent with the entity, every notebook is fetched on its own
+        # from `get_analysis_html`. Notebooks that were never rendered start rendering in the background right away.
+        if isinstance(ent, Instance):
+            analysis_refs = []
+            for index, (analysis_nb, status, stat) in enumerate(zip(ent.analysis, validator[0], nb_stats)):
+                if status == NOT_RENDERED and RENDER_QUEUE.submit(analysis_nb):
+                    status = RENDER_QUEUE.state(analysis_nb, stat=stat)
+                analysis_refs.append({'name': Path(analysis_nb).stem,
+                                      'index': index,
+                                      'size': stat.st_size if stat is not None else None,
+                                      'status': status})
+
+        # Content blocks are sent with every version in full, not in the compact form they are stored in. The frontend
+        # expects every content block and comment as a JSON string, like they are stored in the TOML files. The JSON
+        # of the blocks is kept by `LINK_CACHE`, only blocks that changed are encoded again.
+        serialized = ent.to_dict()
+        serialized['content_blocks'] = [
+            LINK_CACHE.encode(block, PATH_TO_UUID_INDEX if block.block_type == SupportedContentBlockType.text.value
+                              else None)
+            for block in ent.content_blocks]
+        serialized['comments'] = [json.dumps(comment, ensure_ascii=False) for comment in serialized['comments']]
 
-        return json.dumps(ent_copy.to_TOML()[ent_copy.name]), 201
+        if isinstance(ent, Instance):
+            # The notebooks are sent as references instead of their paths.
+            serialized['analysis'] = analysis_refs
+            # Images requested with their version are cached by browsers for good, see `get_instance_image`.
+            serialized['image_versions'] = {img: version for img, version in zip(ent.images, validator[2])
+                                            if version is not None}
+
+        response = json.dumps(serialized)
+        RESPONSE_CACHE.put(ID, revision, response, validator)
+        return response, 201
     else:
         abort(404, f"Entity with ID {ID} not found")
 
@@ -518,7 +1133,7 @@ def read_content_block(ID, blockID, whole_content_block=False):
         return send_file(content[0])
 
     if whole_content_block:
-        return json.dumps(str(block)), 201
+        return json.dumps(json.dumps(block.to_dict(full_history=True))), 201
     else:
         return json.dumps(content), 201
 
@@ -545,7 +1160,7 @@ def generate_tree(ID: str, deepness: int = 7):
         for i, child in enumerate(ent.children):
             if i == deepness:
                 break
-            populate_tree(INDEX[child], deepness, parent_tree[ent.name], level+1)
+            populate_tree(INDEX.skeleton(child), deepness, parent_tree[ent.name], level+1)
 
         if len(parent_tree[ent.name]) == len(ent.children):
             parent_tree[ent.name]["__complete__"] = True
@@ -588,7 +1203,7 @@ def generate_tree(ID: str, deepness: int = 7):
                 ret_ = make_tree(value, ret_, fill_indent + 1, empty_indent)
         return ret_
 
-    ent = INDEX[ID]
+    ent = INDEX.skeleton(ID)
 
     tree = {}
     tree = populate_tree(ent, deepness, tree)
@@ -608,7 +1223,7 @@ def _get_rank_and_num_children(ent: Entity) -> Tuple[int, int]:
     for child_id in ent.children:
         if child_id in INDEX:
             num_children += 1
-            child = INDEX[child_id]
+            child = INDEX.skeleton(child_id)
             child_rank, child_num_children = _get_rank_and_num_children(child)
             rank = max(rank, child_rank + 1)
             num_children += child_num_children
@@ -628,11 +1243,12 @@ def read_entity_info(ID):
     if ID not in INDEX:
         abort(404, f"Entity with ID {ID} not found")
 
-    ent = INDEX[ID]
+    ent = INDEX.skeleton(ID)
     rank, num_children = _get_rank_and_num_children(ent)
     return make_response(json.dumps({"rank": rank, "num_children": num_children}), 201)
 
 
+@_edits_entities
 def add_text_block(ID, body, user: str, under_child: str = None):
     """
     Adds a text block to the indicated entity. It does not handle images or tables yet.
@@ -655,13 +1271,12 @@ def add_text_block(ID, body, user: str, under_child: str = None):
     ent.add_text_block(body, user, under_child)
 
     # After adding the content blocks update the file location
-    ent_path = Path(UUID_TO_PATH_INDEX[ID])
-    copy_ent = create_path_entity_copy(ent)
-    copy_ent.to_TOML(ent_path)
+    _persist_change(ent, [block_op(ent.content_blocks[-1]), set_op('order', ent.order)])
 
     return make_response("Content block added", 201)
 
 
+@_edits_entities
 def edit_text_block(ID, blockID, body, user):
 
     if ID not in INDEX:
@@ -674,9 +1289,8 @@ def edit_text_block(ID, blockID, body, user):
     try:
         ret = ent.modify_text_block(blockID, body, user)
         if ret:
-            # Convert uuids in the entity to paths
-            path_copy = create_path_entity_copy(ent)
-            path_copy.to_TOML(Path(UUID_TO_PATH_INDEX[ID]))
+            block = next(b for b in ent.content_blocks if b.ID == blockID)
+            _persist_change(ent, [version_op(block)])
             return make_response("Content block edited successfully", 201)
     except ValueError as e:
         abort(400, str(e))
@@ -701,6 +1315,7 @@ def _add_image(image, filename=None):
     return file_path, filename
 
 
+@_edits_entities
 def add_image_block(ID, user, body, image, under_child=None):
 
     if ID not in INDEX:
@@ -717,13 +1332,12 @@ def add_image_block(ID, user, body, image, under_child=None):
     ent.add_image_block(file_path, filename, user, under_child)
 
     # After adding the content blocks update the file location
-    ent_path = Path(UUID_TO_PATH_INDEX[ID])
-    copy_ent = create_path_entity_copy(ent)
-    copy_ent.to_TOML(ent_path)
+    _persist_change(ent, [block_op(ent.content_blocks[-1]), set_op('order', ent.order)])
 
     return make_response("Content block added", 201)
 
 
+@_edits_entities
 def edit_image_block(ID, blockID, user, body, image=None, title=None):
     if ID not in INDEX:
         abort(404, f"Entity with ID {ID} not found")
@@ -749,9 +1363,8 @@ def edit_image_block(ID, blockID, user, body, image=None, title=None):
     try:
         ret = ent.modify_image_block(blockID, user, image_path=file_path, title=title)
         if ret:
-            # Convert uuids in the entity to paths
-            path_copy = create_path_entity_copy(ent)
-            path_copy.to_TOML(Path(UUID_TO_PATH_INDEX[ID]))
+            block = next(b for b in ent.content_blocks if b.ID == blockID)
+            _persist_change(ent, [version_op(block)])
             return make_response("Content block edited successfully", 201)
     except ValueError as e:
         abort(400, str(e))
@@ -759,6 +1372,7 @@ def edit_image_block(ID, blockID, user, body, image=None, title=None):
     return abort(400, "Something went wrong, try again")
 
 
+@_edits_entities
 def add_image_link_block(ID, user, instance_id, image_path, under_child=None):
     if ID not in INDEX:
         abort(404, f"Entity with ID {ID} not found")
@@ -776,13 +1390,12 @@ def add_image_link_block(ID, user, instance_id, image_path, under_child=None):
     ent.add_image_link_block(instance_id, image_path, user, under_child)
 
     # After adding the content blocks update the file location
-    ent_path = Path(UUID_TO_PATH_INDEX[ID])
-    copy_ent = create_path_entity_copy(ent)
-    copy_ent.to_TOML(ent_path)
+    _persist_change(ent, [block_op(ent.content_blocks[-1]), set_op('order', ent.order)])
 
     return make_response("Content block added", 201)
 
 
+@_edits_entities
 def delete_content_block(ID, blockID):
 
     if ID not in INDEX:
@@ -793,8 +1406,9 @@ def delete_content_block(ID, blockID):
     try:
         ret = ent.delete_block(blockID)
         if ret:
-            path_copy = create_path_entity_copy(ent)
-            path_copy.to_TOML(Path(UUID_TO_PATH_INDEX[ID]))
+            block = next(b for b in ent.content_blocks if b.ID == blockID)
+            _persist_change(ent, [block_op(block), set_op('order', ent.order)])
+            LINK_CACHE.discard([blockID])
             return make_response("Content block deleted successfully", 200)
     except ValueError as e:
         abort(400, str(e))
@@ -802,6 +1416,7 @@ def delete_content_block(ID, blockID):
     return abort(400, "Something went wrong, try again")
 
 
+@_edits_entities
 def add_comment(ID, user, body, content_block_id = None):
     if "comment" not in body:
         abort(400, "Comment is required")
@@ -816,8 +1431,7 @@ def add_comment(ID, user, body, content_block_id = None):
     try:
         ret = ent.add_comment(body=comment_text, user=user, content_block_id=content_block_id)
         if ret:
-            path_copy = create_path_entity_copy(ent)
-            path_copy.to_TOML(Path(UUID_TO_PATH_INDEX[ID]))
+            _persist_change(ent, [comment_op(ent.comments[-1])])
             return make_response("Comment added", 201)
 
     except ValueError as e:
@@ -826,6 +1440,7 @@ def add_comment(ID, user, body, content_block_id = None):
     return abort(400, "Something went wrong, try again")
 
 
+@_edits_entities
 def add_comment_reply(ID, user, comment_id, body):
     if "reply_body" not in body:
         abort(400, "reply_body is required")
@@ -840,8 +1455,8 @@ def add_comment_reply(ID, user, comment_id, body):
     try:
         ret = ent.add_comment_reply(body=reply_body, user=user, comment_id=comment_id)
         if ret:
-            path_copy = create_path_entity_copy(ent)
-            path_copy.to_TOML(Path(UUID_TO_PATH_INDEX[ID]))
+            comment = next(c for c in ent.comments if c.ID == comment_id)
+            _persist_change(ent, [comment_op(comment)])
             return make_response("Comment added", 201)
 
     except ValueError as e:
@@ -850,6 +1465,7 @@ def add_comment_reply(ID, user, comment_id, body):
     return abort(400, "Something went wrong, try again")
 
 
+@_edits_entities
 def resolve_comment(ID, comment_id):
     if ID not in INDEX:
         abort(404, f"Entity with ID {ID} not found")
@@ -858,8 +1474,8 @@ def resolve_comment(ID, comment_id):
     try:
         ret = ent.resolve_comment(comment_id)
         if ret:
-            path_copy = create_path_entity_copy(ent)
-            path_copy.to_TOML(Path(UUID_TO_PATH_INDEX[ID]))
+            comment = next(c for c in ent.comments if c.ID == comment_id)
+            _persist_change(ent, [comment_op(comment)])
             return make_response("Comment resolved", 201)
 
     except ValueError as e:
@@ -869,6 +1485,7 @@ def resolve_comment(ID, comment_id):
 
 
 
+@_edits_entities
 def add_library(body):
     """
     Creates a new library and adds it to the system.
@@ -887,16 +1504,16 @@ def add_library(body):
     library = Library(name=body['name'], user=user)
     lib_path = LAIRSPATH.joinpath(library.ID[:8] + '_' + library.name + '.toml')
 
-    path_copy = create_path_entity_copy(library)
-    path_copy.to_TOML(lib_path)
-
-    DRAGONLAIR.add_library(library, lib_path)
+    with STORAGE.batch():
+        _write_entity(library, lib_path)
+        DRAGONLAIR.add_library(library, lib_path)
     add_ent_to_index(library, lib_path)
 
     return make_response(f"Library named {body['name']} added", 201)
 
 
 # TODO: Check for buckets as well, these should be added from here
+@_edits_entities
 def add_entity(body):
     """
     Creates an entity through the API call. It will add the entity to the parent and create the new TOML file
@@ -910,6 +1527,17 @@ def add_entity(body):
         * under_child: Optional argument. If passed, the entity will be added under the child with the given ID.
             Content blocks count as children.
     """
+    _create_entity(body)
+
+    return make_response("Entity added", 201)
+
+
+def _create_entity(body) -> Entity:
+    """
+    Validates the body of `add_entity`, creates the entity and writes it together with its parent.
+
+    :return: The new entity.
+    """
     if "name" not in body or body['name'] == "":
         abort(400, "Name of entity is required")
     if "type" not in body or body['type'] == "":
@@ -941,20 +1569,30 @@ def add_entity(body):
     parent_path = Path(UUID_TO_PATH_INDEX[parent.ID])
     ent_path = parent_path.parent.joinpath(ent.ID[:8] + "_" + ent.name + ".toml")
 
-    add_ent_to_index(ent, ent_path)
-
-    # Create copy of the entity with paths to create the TOML file.
-    ent_copy = create_path_entity_copy(ent)
-
-    parent.add_child(ent.ID, under_child=under_child)
-    parent_copy = create_path_entity_copy(parent)
+    # The entity is only indexed once the parent accepted it, and dropped again if it cannot be written.
+    children, order = list(parent.children), list(parent.order)
+    try:
+        parent.add_child(ent.ID, under_child=under_child)
+    except ValueError:
+        parent.children, parent.order = children, order
+        abort(404, f"Child with ID {under_child} not found in parent {parent.ID}")
 
-    parent_copy.to_TOML(parent_path)
-    ent_copy.to_TOML(ent_path)
+    add_ent_to_index(ent, ent_path)
+    try:
+        # The parent is written last, so it never lists a child whose file is not there.
+        with STORAGE.batch():
+            _write_entity(ent, ent_path)
+            _write_entity(parent, parent_path)
+    except Exception:
+        parent.children, parent.order = children, order
+        RESPONSE_CACHE.bump(parent.ID)
+        _remove_created_entity(ent.ID)
+        raise
 
-    return make_response("Entity added", 201)
+    return ent
 
 
+@_edits_entities
 def delete_entity(ID):
 
     if ID not in INDEX:
@@ -966,18 +1604,20 @@ def delete_entity(ID):
 
     parent = INDEX[ent.parent]
     parent.delete_child(ID)
-    parent_copy = create_path_entity_copy(parent)
-    parent_copy.to_TOML(Path(UUID_TO_PATH_INDEX[parent.ID]))
 
     # Flag the entity as deleted
     ent.deleted = True
-    ent_copy = create_path_entity_copy(ent)
-    ent_copy.to_TOML(Path(UUID_TO_PATH_INDEX[ID]))
+
+    with STORAGE.batch():
+        _write_entity(parent)
+        _write_entity(ent)
+    LINK_CACHE.discard([block.ID for block in ent.content_blocks])
 
     return make_response("Entity deleted", 201)
 
 
 # TODO: Better record keeping of when the name is change and who changed it is needed.
+@_edits_entities
 def change_entity_name(ID, body):
     """
     Changes the name of an entity and updates the TOML file.
@@ -1002,24 +1642,25 @@ def change_entity_name(ID, body):
     del PATH_TO_UUID_INDEX[str(old_ent_path)]
     PATH_TO_UUID_INDEX[str(new_ent_path)] = ID
     UUID_TO_PATH_INDEX[ID] = str(new_ent_path)
+    RESPONSE_CACHE.bump_all()
 
-    # Update the TOML file
-    ent_copy = create_path_entity_copy(ent)
-    ent_copy.to_TOML(Path(UUID_TO_PATH_INDEX[ID]))
+    with STORAGE.batch():
+        # Update the TOML file, the manifest entry of the entity is updated with it.
+        _write_entity(ent)
 
-    # Update parents
-    parent = INDEX[ent.parent]
-    parent_copy = create_path_entity_copy(parent)
-    parent_copy.to_TOML(Path(UUID_TO_PATH_INDEX[parent.ID]))
+        # Parent and children only hold the path of the entity when references are stored as paths.
+        if not ID_REFERENCES:
+            # Update parents
+            parent = INDEX[ent.parent]
+            _write_entity(parent)
 
-    # Update the children
-    for child in ent.children:
-        child_ent = INDEX[child]
-        child_ent_copy = create_path_entity_copy(child_ent)
-        child_ent_copy.to_TOML(Path(UUID_TO_PATH_INDEX[child]))
+            # Update the children
+            for child in ent.children:
+                child_ent = INDEX[child]
+                _write_entity(child_ent)
 
-    if new_ent_path.is_file():
-        old_ent_path.unlink()
+    if STORAGE.exists(new_ent_path):
+        STORAGE.remove(ID, old_ent_path)
     else:
         abort(400, f"Could not find the file {old_ent_path}")
 
@@ -1028,12 +1669,12 @@ def change_entity_name(ID, body):
 
 def _check_for_notebook_parent(ent):
 
-    parent = INDEX[ent.parent]
+    parent = INDEX.skeleton(ent.parent)
 
     if parent.parent == "" or parent.parent is None:
         return abort(404, f"Entity with ID {ent.ID} is not in a notebook")
 
-    if isinstance(parent, Notebook):
+    if INDEX.entity_type(parent.ID) == "Notebook":
         return parent.ID
 
     return _check_for_notebook_parent(parent)
@@ -1047,11 +1688,11 @@ def get_notebook_parent(ID):
     if ID not in INDEX:
         abort(404, f"Entity with ID {ID} not found")
 
-    ent = INDEX[ID]
-    if isinstance(ent, Notebook):
+    ent = INDEX.skeleton(ID)
+    if INDEX.entity_type(ID) == "Notebook":
         return make_response(ent.ID, 201)
 
-    if isinstance(ent, Library):
+    if INDEX.entity_type(ID) == "Library":
         return abort(404, f"Entity with ID {ID} is a library and does not have a notebook")
 
     return str(_check_for_notebook_parent(ent)), 201
@@ -1105,9 +1746,9 @@ def get_possible_parents():
     :return: json representation of a list of all the possible parents for a given entity
     """
     ret = {}
-    for k, v in INDEX.items():
-        if v.__class__.__name__ in PARENT_TYPES:
-            ret[k] = v.name
+    for k in INDEX:
+        if INDEX.entity_type(k) in PARENT_TYPES:
+            ret[k] = INDEX.skeleton(k).name
     return json.dumps(ret), 201
 
 
@@ -1128,6 +1769,7 @@ def _search_parents_with_buckets(ent):
     return ret_ent
 
 
+@_edits_entities
 def add_bucket(user, name, location=None):
     """
     API function that adds a bucket to the system
@@ -1156,9 +1798,11 @@ def add_bucket(user, name, location=None):
         bucket_path = Path(location).joinpath(bucket.ID[:8] + '_' + bucket.name + '.toml')
 
 
-    path_copy = create_path_entity_copy(bucket)
-    path_copy.to_TOML(bucket_path)
-    DRAGONLAIR.add_bucket(name, bucket, bucket_path)
+    with STORAGE.batch():
+        _write_entity(bucket, bucket_path)
+        DRAGONLAIR.add_bucket(name, bucket, bucket_path)
+    if WATCHER is not None:
+        WATCHER.add_root(bucket_path.parent)
 
     add_ent_to_index(bucket, bucket_path)
 
@@ -1170,6 +1814,7 @@ def delete_bucket(bucketID):...
 
 
 
+@_edits_entities
 def set_target_bucket(ID, bucket_ID):
 
     if bucket_ID not in INDEX:
@@ -1188,12 +1833,12 @@ def set_target_bucket(ID, bucket_ID):
     entity.set_bucket_target(bucket.ID)
 
     # Update the TOML file
-    entity = create_path_entity_copy(entity)
-    entity.to_TOML(Path(UUID_TO_PATH_INDEX[entity.ID]))
+    _write_entity(entity)
 
     return make_response("Target set", 201)
 
 
+@_edits_entities
 def unset_target_bucket(ID, bucket_ID):
     if ID not in INDEX:
         abort(404, f"Entity with ID {ID} not found")
@@ -1205,8 +1850,7 @@ def unset_target_bucket(ID, bucket_ID):
     entity.unset_bucket_target(bucket_ID)
 
     # Update the TOML file
-    entity = create_path_entity_copy(entity)
-    entity.to_TOML(Path(UUID_TO_PATH_INDEX[entity.ID]))
+    _write_entity(entity)
 
     return make_response("Target unset", 201)
 
@@ -1283,6 +1927,7 @@ def get_graphic_suggestions(ID, query_filter="", num_matches=10):
     return json.dumps(matches), 201
 
 
+@_edits_entities
 def add_instance(body):
     """
     API function that adds an instance to a bucket
@@ -1335,17 +1980,16 @@ def add_instance(body):
     instance_path = data_path.joinpath(instance.ID[:8] + '_' + data_path.name + '.toml')
     bucket.add_instance(instance_path, instance.ID)
 
-    bucket_copy = create_path_entity_copy(bucket)
-    bucket_copy.to_TOML(Path(UUID_TO_PATH_INDEX[bucket_ID]))
-
-    instance_copy = create_path_entity_copy(instance)
-    instance_copy.to_TOML(instance_path)
+    with STORAGE.batch():
+        _write_entity(bucket)
+        _write_entity(instance, instance_path)
 
     add_ent_to_index(instance, instance_path)
 
     return make_response("Instance added", 201)
 
 
+@_edits_entities
 def add_analysis_files_to_instance(body):
     """
     Adds a list of analysis files to the specified instance. The body should be a dictionary with the following keys:
@@ -1377,33 +2021,89 @@ def add_analysis_files_to_instance(body):
 
         if path.suffix == '.jpg' or path.suffix == '.png':
             if path not in instance.images and analysis_file not in instance.images:
-                img = Image.open(path)
+                IMAGE_REGISTRY.refresh(path)
                 instance.images.append(str(path))
+                INSTANCEIMAGE[str(path)] = instance.ID
         elif path.suffix == '.html':
             if path not in instance.analysis and analysis_file not in instance.analysis:
                 instance.images.append(str(path))
         elif path.suffix == '.ipynb':
             if path not in instance.analysis and analysis_file not in instance.analysis:
                 instance.analysis.append(str(path))
+                # Rendered in the background so that the first view of the instance finds it in the cache.
+                RENDER_QUEUE.submit(path)
         elif path.suffix == '.json':
             if path not in instance.stored_params and analysis_file not in instance.stored_params:
                 instance.stored_params.append(str(path))
 
-    instance_copy = create_path_entity_copy(instance)
-    instance_copy.to_TOML(data_path)
+    _write_entity(instance, data_path)
+
+    IMAGE_REGISTRY.save()
 
     return make_response("Analysis files added", 201)
 
 
-def get_instance_image(imagePath):
+def get_instance_image(imagePath, size=None, v=None):
+    """
+    API function that returns an image or html plot of an instance.
+
+    Responses have a strong ETag made from the size and modification time of the file and its Last-Modified time, so
+    browsers that already have the file get an empty 304 response. Ranges of the file can be requested. Browsers
+    keep the file for good if the URL has its current version (see `_file_version`), otherwise they always check if
+    it changed before using it.
 
+    :param imagePath: The path of the file, with '#' instead of '/'.
+    :param size: One of the keys of `IMAGE_SIZES` to get a copy of the image downscaled to that width instead of the
+        image itself. Images that are already small enough and html plots are returned as they are.
+    :param v: The version of the file the URL was built with.
+    """
     path = Path(imagePath.replace('#', '/'))
     if not path.is_file() or not path.exists():
         abort(404, f"Image with path {path} not found")
-
-    return send_file(path)
+    if size is not None and size not in IMAGE_SIZES:
+        abort(400, f"Unknown image size {size}, it must be one of {', '.join(IMAGE_SIZES)}")
+
+    stat = os.stat(path)
+    version = f"{stat.st_size:x}-{stat.st_mtime_ns:x}"
+
+    width = None
+    if size is not None and path.suffix.lower() in ('.jpg', '.jpeg', '.png'):
+        width = IMAGE_SIZES[size]
+        # The registry knows the dimensions of the image without opening it.
+        record = IMAGE_REGISTRY.refresh(path)
+        if record is not None and record.width is not None and record.width <= width:
+            width = None
+
+    response = None
+    if width is not None:
+        key = THUMBNAIL_CACHE.key(path, width)
+        # The image was removed after it was checked above.
+        if key is None:
+            abort(404, f"Image with path {path} not found")
+        if request.if_none_match.contains_weak(key):
+            response = make_response("", 304)
+        else:
+            data = THUMBNAIL_CACHE.thumbnail(path, width, key=key)
+            if data is not None:
+                response = make_response(data, 200)
+                response.mimetype = image_mimetype(path)
+        if response is not None:
+            response.set_etag(key)
+            response.last_modified = stat.st_mtime
+
+    if response is None:
+        # Handles If-None-Match, If-Modified-Since and Range requests.
+        response = send_file(path, etag=version, last_modified=stat.st_mtime, conditional=True)
+
+    if v is not None and v == version:
+        response.headers['Cache-Control'] = f"public, max-age={IMMUTABLE_MAX_AGE}, immutable"
+    else:
+        response.headers['Cache-Control'] = "no-cache"
+    response.headers.pop('Expires', None)
+    return response
 
 
+@_edits_entities
 def toggle_star(data_loc: str):
     """
     Toggles the star tag of an instance.This changes both the parameter in the folder containing the instance as well as the TOML file.
@@ -1421,7 +2121,7 @@ def toggle_star(data_loc: str):
     else:
         abort(404, f"Data with path {data_path} not found")
 
-    if not instance_path.is_file():
+    if not STORAGE.exists(instance_path):
         abort(404, f"Instance with path {instance_path} not found")
 
     # FIXME: there definitely is a more efficient way to do this.
@@ -1435,14 +2135,12 @@ def toggle_star(data_loc: str):
         star_path.unlink()
         if "star" in instance.tags:
             instance.tags.remove("star")
-            instance_copy = create_path_entity_copy(instance)
-            instance_copy.to_TOML(instance_path)
+            _write_entity(instance, instance_path)
     else:
         star_path.touch()
         if "star" not in instance.tags:
             instance.tags.append("star")
-            instance_copy = create_path_entity_copy(instance)
-            instance_copy.to_TOML(instance_path)
+            _write_entity(instance, instance_path)
 
     return make_response("Star toggled", 201)
 
@@ -1454,9 +2152,9 @@ def get_buckets():
     :return: json with keys being the ID of the bucket and the value its name.
     """
     ret = {}
-    for k, v in INDEX.items():
-        if isinstance(v, Bucket):
-            ret[k] = v.name
+    for k in INDEX:
+        if INDEX.entity_type(k) == "Bucket":
+            ret[k] = INDEX.skeleton(k).name
     return ret, 201
 
 
@@ -1528,6 +2226,7 @@ def get_fake_mentions():
     return json.dumps(fake_dict), 201
 
 
+@_edits_entities
 def toggle_bookmark(ID):
     """
     API function that toggles the bookmark of an entity
@@ -1540,13 +2239,183 @@ def toggle_bookmark(ID):
     ent = INDEX[ID]
     ent.toggle_bookmark()
 
-    # Convert uuids in the entity to paths and saves the change
-    path_copy = create_path_entity_copy(ent)
-    path_copy.to_TOML(Path(UUID_TO_PATH_INDEX[ID]))
+    _persist_change(ent, [set_op('bookmarked', ent.bookmarked)])
 
     return make_response("Bookmark toggled", 201)
 
 
+# Operations accepted by `apply_batch`, with the function applying each one. The arguments of an operation are the
+# arguments of its function, add_entity takes the body of the add_entity endpoint.
+BATCH_OPERATIONS = {
+    "add_entity": lambda **args: _create_entity(args),
+    "delete_entity": delete_entity,
+    "add_text_block": add_text_block,
+    "edit_text_block": edit_text_block,
+    "delete_content_block": delete_content_block,
+    "add_comment": add_comment,
+    "add_comment_reply": add_comment_reply,
+    "resolve_comment": resolve_comment,
+    "set_target_bucket": set_target_bucket,
+    "unset_target_bucket": unset_target_bucket,
+    "toggle_bookmark": toggle_bookmark,
+}
+
+
+def _resolve_batch_args(args: dict, refs: dict[str, str]) -> dict:
+    """
+    Replaces the arguments of the form {"ref": name} with the ID of the entity created by the operation with that ref.
+    """
+    return {key: refs[value["ref"]] if isinstance(value, dict) and set(value.keys()) == {"ref"} else value
+            for key, value in args.items()}
+
+
+def _validate_batch(operations) -> None:
+    if not isinstance(operations, list) or len(operations) == 0:
+        abort(400, "operations must be a non empty list")
+
+    refs = set()
+    for i, operation in enumerate(operations):
+        if not isinstance(operation, dict) or operation.get("op") not in BATCH_OPERATIONS:
+            abort(400, f"Operation {i} is not one of: {', '.join(BATCH_OPERATIONS.keys())}")
+        args = operation.get("args", {})
+        if not isinstance(args, dict):
+            abort(400, f"The args of operation {i} must be an object")
+        for value in args.values():
+            if isinstance(value, dict) and set(value.keys()) == {"ref"} and value["ref"] not in refs:
+                abort(400, f"Operation {i} uses the ref {value['ref']} before it is created")
+        if "ref" in operation:
+            if operation["op"] != "add_entity":
+                abort(400, f"Operation {i} has a ref but only add_entity creates entities")
+            if operation["ref"] in refs:
+                abort(400, f"The ref {operation['ref']} of operation {i} is already used")
+            refs.add(operation["ref"])
+
+
+def _argument_IDs(value) -> list[str]:
+    """
+    Returns the IDs of the entities in the index found anywhere in an argument of an API function.
+    """
+    if isinstance(value, str):
+        return [value] if value in INDEX else []
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (list, tuple)):
+        return [ID for item in value for ID in _argument_IDs(item)]
+    return []
+
+
+def _keep_originals(IDs: list[str], originals: dict[str, Entity], created: list[str]) -> None:
+    """
+    Copies the entities an operation of a batch could modify before it runs: the entities it gets and their parents.
+    """
+    for ID in IDs:
+        ent = INDEX[ID]
+        for keep in (ID, ent.parent):
+            if keep in INDEX and keep not in originals and keep not in created:
+                originals[keep] = copy.deepcopy(INDEX[keep])
+                _pin_for_batch(keep)
+
+
+def _remove_created_entity(ID: str) -> None:
+    """
+    Removes an entity that was created but never written from the indices.
+    """
+    path = UUID_TO_PATH_INDEX.pop(ID, None)
+    PATH_TO_UUID_INDEX.pop(path, None)
+    MANIFEST.remove(ID)
+    RESPONSE_CACHE.forget(ID)
+    RESPONSE_CACHE.bump_all()
+    if ID in INDEX:
+        del INDEX[ID]
+
+
+def _rollback_batch(originals: dict[str, Entity], created: list[str]) -> None:
+    """
+    Restores the entities touched by a failed batch to the state they had before it, nothing was written yet.
+    """
+    for ID in created:
+        _remove_created_entity(ID)
+    # Restored in place, other objects like the lair hold references to some entities. Nothing else changed them
+    # while the batch was applied, see `_EDIT_LOCK`.
+    for ID, original in originals.items():
+        ent = INDEX[ID]
+        vars(ent).clear()
+        vars(ent).update(vars(original))
+        RESPONSE_CACHE.bump(ID)
+
+
+def apply_batch(body):
+    """
+    Applies a list of operations in order and writes every entity they touched once, after all of them succeeded.
+    If any operation fails, the entities are restored to their state before the batch and nothing is written. Other
+    changes to entities wait for the batch to finish.
+
+    :param body: dictionary with the key:
+        * operations: List of operations. Each one is a dictionary with the keys:
+            * op: The name of the operation, one of the keys of `BATCH_OPERATIONS`.
+            * args: The arguments of the operation. Any argument can be {"ref": name} to use the ID of an entity
+                created earlier in the batch.
+            * ref: Optional, only for add_entity. Name by which later operations refer to the new entity.
+    :return: A list with the result of every operation. Results of add_entity hold the ID of the new entity.
+    """
+    operations = body.get("operations") if isinstance(body, dict) else None
+    _validate_batch(operations)
+
+    with _EDIT_LOCK.exclusive():
+        return _apply_batch(operations)
+
+
+def _apply_batch(operations: list[dict]):
+    # Copies of every entity the batch modified, taken before the first operation that could modify each of them.
+    originals = {}
+    refs = {}
+    created = []
+    results = []
+    touched = _BATCH.touched = {}
+    _BATCH.pinned = set()
+    try:
+        for i, operation in enumerate(operations):
+            function = BATCH_OPERATIONS[operation["op"]]
+            args = _resolve_batch_args(operation.get("args", {}), refs)
+            try:
+                inspect.signature(function).bind(**args)
+            except TypeError as e:
+                _rollback_batch(originals, created)
+                abort(400, f"Operation {i} ({operation['op']}) has invalid arguments: {e}")
+
+            _keep_originals(_argument_IDs(args), originals, created)
+            try:
+                ret = function(**args)
+            except HTTPException as e:
+                _rollback_batch(originals, created)
+                abort(e.code, f"Operation {i} ({operation['op']}) failed: {e.description}")
+            except Exception:
+                _rollback_batch(originals, created)
+                raise
+
+            if isinstance(ret, Entity):
+                created.append(ret.ID)
+                if "ref" in operation:
+                    refs[operation["ref"]] = ret.ID
+                results.append({"op": operation["op"], "status": 201, "ID": ret.ID})
+            else:
+                results.append({"op": operation["op"],
+                                "status": ret.status_code,
+                                "message": ret.get_data(as_text=True)})
+
+        # Every operation succeeded, each touched entity is written once.
+        _BATCH.touched = None
+        with STORAGE.batch():
+            for ID, path in touched.items():
+                if ID in INDEX:
+                    _write_entity(INDEX[ID], path)
+    finally:
+        _BATCH.touched = None
+        _unpin_batch()
+
+    return make_response(json.dumps(results), 201)
+
+
 reset()
 
 # Converters need to be defined at the bottom so they access the indices after they have been instantiated
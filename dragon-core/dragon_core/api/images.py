@@ -0,0 +1,202 @@
+"""
+Registry of the images that belong to instances.
+
+The registry only records the path, size, modification time and dimensions of every image. Dimensions are read
+from the header of the file without decoding the image, and the registry is stored next to the lair file so that
+restarting the server does not need to read any image that did not change.
+"""
+import os
+import json
+import struct
+import threading
+from pathlib import Path
+from dataclasses import dataclass, asdict
+from typing import Optional, Union, Tuple
+
+from PIL import Image
+
+
+IMAGE_REGISTRY_FILENAME = '_image_registry.json'
+
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# JPEG start of frame markers, these are the segments that hold the dimensions of the image.
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+@dataclass
+class ImageRecord:
+    """
+    What the registry knows about a single image.
+
+    - path: The path of the image as stored in the instance.
+    - size: Size in bytes of the file.
+    - mtime_ns: Modification time of the file.
+    - width: Width of the image in pixels, None if it could not be read.
+    - height: Height of the image in pixels, None if it could not be read.
+    """
+    path: str
+    size: int
+    mtime_ns: int
+    width: Optional[int]
+    height: Optional[int]
+
+
+def _probe_png(f) -> Optional[Tuple[int, int]]:
+    header = f.read(24)
+    # The IHDR chunk is always the first one, width and height are its first 8 bytes.
+    if len(header) < 24 or header[:8] != _PNG_SIGNATURE or header[12:16] != b'IHDR':
+        return None
+    width, height = struct.unpack('>II', header[16:24])
+    return width, height
+
+
+def _probe_jpeg(f) -> Optional[Tuple[int, int]]:
+    if f.read(2) != b'\xff\xd8':
+        return None
+
+    while True:
+        byte = f.read(1)
+        # Segments start with 0xFF, which can be repeated as padding.
+        while byte == b'\xff':
+            byte = f.read(1)
+        if len(byte) == 0:
+            return None
+        marker = byte[0]
+
+        # Markers without a length field.
+        if marker == 0xD8 or marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            continue
+        # End of image or start of scan before finding a frame, no dimensions in the header.
+        if marker == 0xD9 or marker == 0xDA:
+            return None
+
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length = struct.unpack('>H', length_bytes)[0]
+
+        if marker in _JPEG_SOF_MARKERS:
+            frame = f.read(5)
+            if len(frame) < 5:
+                return None
+            height, width = struct.unpack('>HH', frame[1:5])
+            return width, height
+
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def probe_image_size(path: Union[str, Path]) -> Optional[Tuple[int, int]]:
+    """
+    Reads the dimensions of an image from its header.
+    PNG and JPEG files are parsed directly, anything else falls back on Pillow, which also only reads the header.
+
+    :param path: The path of the image.
+    :return: Tuple with the width and height of the image. None if the dimensions could not be read.
+    """
+    path = Path(path)
+    try:
+        with open(path, 'rb') as f:
+            if path.suffix.lower() == '.png':
+                dimensions = _probe_png(f)
+            elif path.suffix.lower() in ('.jpg', '.jpeg'):
+                dimensions = _probe_jpeg(f)
+            else:
+                dimensions = None
+        if dimensions is not None:
+            return dimensions
+
+        with Image.open(path) as img:
+            return img.size
+    except Exception as e:
+        return None
+
+
+class ImageRegistry:
+    """
+    Keeps an `ImageRecord` for every image known to the server and stores them in a JSON file.
+    Records are only updated when the size or modification time of the file changes.
+    """
+
+    def __init__(self, file_path: Union[str, Path]):
+        """
+        :param file_path: The JSON file the registry is stored in. Loaded immediately if it exists.
+        """
+        self.file_path = Path(file_path)
+        self.records: dict[str, ImageRecord] = {}
+        self._dirty = False
+        # Guards records and _dirty, refreshed by every request that serves an image.
+        self._lock = threading.Lock()
+        # Only one save writes the file at a time.
+        self._save_lock = threading.Lock()
+
+        if self.file_path.is_file():
+            self.load()
+
+    def load(self) -> None:
+        try:
+            with open(self.file_path, 'r') as f:
+                data = json.load(f)
+            records = {rec['path']: ImageRecord(**rec) for rec in data}
+        except Exception as e:
+            print(f"Ignoring unreadable image registry at {self.file_path} exception: \n{e}")
+            records = {}
+        with self._lock:
+            self.records = records
+            self._dirty = False
+
+    def save(self) -> None:
+        """
+        Writes the registry to disk if anything changed since it was last saved or loaded.
+        """
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                records = list(self.records.values())
+                self._dirty = False
+
+            try:
+                tmp_path = self.file_path.with_name(self.file_path.name + '.tmp')
+                with open(tmp_path, 'w') as f:
+                    json.dump([asdict(rec) for rec in records], f)
+                os.replace(tmp_path, self.file_path)
+            except Exception:
+                with self._lock:
+                    self._dirty = True
+                raise
+
+    def get(self, path: Union[str, Path]) -> Optional[ImageRecord]:
+        """
+        Returns the record of the image without checking the file.
+        """
+        return self.records.get(str(path))
+
+    def refresh(self, path: Union[str, Path]) -> Optional[ImageRecord]:
+        """
+        Returns an up-to-date record of the image. The file is only stat-ed, its header is only read if the file
+        is new or changed since it was last recorded.
+
+        :param path: The path of the image.
+        :return: The record of the image, None if the file does not exist.
+        """
+        path = str(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            with self._lock:
+                if self.records.pop(path, None) is not None:
+                    self._dirty = True
+            return None
+
+        record = self.records.get(path)
+        if record is not None and record.size == stat.st_size and record.mtime_ns == stat.st_mtime_ns:
+            return record
+
+        dimensions = probe_image_size(path)
+        width, height = dimensions if dimensions is not None else (None, None)
+        record = ImageRecord(path=path, size=stat.st_size, mtime_ns=stat.st_mtime_ns, width=width, height=height)
+        with self._lock:
+            self.records[path] = record
+            self._dirty = True
+        return record
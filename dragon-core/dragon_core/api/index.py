@@ -0,0 +1,249 @@
+"""
+In-memory index of the entities of the lair.
+
+When lazy loading is enabled, the server starts with only a skeleton of the entities in the libraries: the fields
+needed to build the structure of the lair. The full entity, with all of its content blocks and comments, is read
+from its TOML file the first time it is accessed and evicted again once the memory budget is exceeded.
+"""
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict, Counter
+from collections.abc import MutableMapping
+from dataclasses import dataclass, field
+from typing import Optional, Callable, Tuple
+
+
+@dataclass
+class EntitySkeleton:
+    """
+    The minimal information of an entity needed to navigate the lair without loading it.
+
+    - ID: The ID of the entity.
+    - name: The name of the entity.
+    - type: The class name of the entity.
+    - parent: The parent of the entity.
+    - children: The children of the entity.
+    - deleted: True if the entity has been deleted.
+    - path: The path of the TOML file the skeleton was read from.
+    """
+    ID: str
+    name: str
+    type: str
+    parent: str
+    children: list[str] = field(default_factory=list)
+    deleted: bool = False
+    path: str = ''
+
+    @classmethod
+    def from_entity(cls, ent, path: str = '') -> 'EntitySkeleton':
+        return cls(ID=ent.ID,
+                   name=ent.name,
+                   type=ent.__class__.__name__,
+                   parent=ent.parent,
+                   children=list(ent.children),
+                   deleted=ent.deleted,
+                   path=str(path))
+
+
+class EntityIndex(MutableMapping):
+    """
+    Dictionary with the UUIDs of entities as keys and the entities as values.
+
+    Entities are either held in memory for as long as they are in the index, or added as skeletons with
+    `add_skeleton`. Skeletons are materialized into full entities with the loader the first time they are accessed.
+    Materialized skeletons are kept in least recently used order and evicted back into skeletons whenever the total
+    size of the materialized entities goes over the memory budget.
+
+    Checking if an ID is in the index or iterating over its keys never materializes anything. Use `skeleton` and
+    `entity_type` when only the structure of the lair is needed.
+    """
+
+    def __init__(self,
+                 loader: Optional[Callable[[str], Tuple[object, int]]] = None,
+                 memory_budget: Optional[int] = None,
+                 can_evict: Optional[Callable[[str], bool]] = None,
+                 on_evict: Optional[Callable[[object], None]] = None):
+        """
+        :param loader: Function that receives the ID of a skeleton and returns the full entity together with its
+            size in bytes (usually the size of its TOML file). Required if skeletons are added.
+        :param memory_budget: Maximum number of bytes of materialized skeletons held in memory. If None, materialized
+            skeletons are never evicted.
+        :param can_evict: Function that receives the ID of a materialized entity and returns False if it must stay in
+            memory, for example because it has changes that are not on disk yet.
+        :param on_evict: Function that receives every entity evicted back into a skeleton.
+        """
+        self.loader = loader
+        self.memory_budget = memory_budget
+        self.can_evict = can_evict if can_evict is not None else (lambda ID: True)
+        self.on_evict = on_evict
+
+        self._entities = {}
+        self._skeletons: dict[str, EntitySkeleton] = {}
+        # Materialized skeletons in least recently used order, with their sizes as values.
+        self._lru: OrderedDict[str, int] = OrderedDict()
+        self._materialized_size = 0
+        # Number of times every pinned entity was pinned, see `pin`.
+        self._pins: Counter = Counter()
+        self._lock = threading.RLock()
+
+    def __getitem__(self, ID):
+        with self._lock:
+            if ID in self._entities:
+                if ID in self._lru:
+                    self._lru.move_to_end(ID)
+                return self._entities[ID]
+
+            if ID not in self._skeletons:
+                raise KeyError(ID)
+
+            ent, size = self.loader(ID)
+            self._entities[ID] = ent
+            self._lru[ID] = size
+            self._materialized_size += size
+            self._evict()
+            return ent
+
+    def __setitem__(self, ID, ent):
+        with self._lock:
+            # Entities set directly are held in memory for as long as they are in the index.
+            self._drop(ID)
+            self._entities[ID] = ent
+
+    def __delitem__(self, ID):
+        with self._lock:
+            if ID not in self._entities and ID not in self._skeletons:
+                raise KeyError(ID)
+            self._drop(ID)
+
+    def __contains__(self, ID):
+        return ID in self._entities or ID in self._skeletons
+
+    def __iter__(self):
+        with self._lock:
+            keys = list(self._entities.keys()) + [ID for ID in self._skeletons if ID not in self._entities]
+        return iter(keys)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entities) + len([ID for ID in self._skeletons if ID not in self._entities])
+
+    def __repr__(self):
+        return repr(self.loaded())
+
+    def _drop(self, ID):
+        self._entities.pop(ID, None)
+        self._skeletons.pop(ID, None)
+        if ID in self._lru:
+            self._materialized_size -= self._lru.pop(ID)
+
+    def _evict(self):
+        if self.memory_budget is None or self._materialized_size <= self.memory_budget:
+            return
+
+        # The most recently used entity is the one being accessed right now, it never gets evicted.
+        for ID in list(self._lru.keys())[:-1]:
+            if self._materialized_size <= self.memory_budget:
+                break
+            if ID in self._pins or not self.can_evict(ID):
+                continue
+
+            # The skeleton is updated in case the entity was modified while in memory.
+            ent = self._entities.pop(ID)
+            self._skeletons[ID] = EntitySkeleton.from_entity(ent, path=self._skeletons[ID].path)
+            self._materialized_size -= self._lru.pop(ID)
+            if self.on_evict is not None:
+                self.on_evict(ent)
+
+    def pin(self, IDs) -> None:
+        """
+        Keeps the entities in memory until they are unpinned as many times as they were pinned, for example while a
+        request changes them and before their write is scheduled. IDs that are not in the index yet can be pinned too.
+        """
+        with self._lock:
+            for ID in IDs:
+                self._pins[ID] += 1
+
+    def unpin(self, IDs) -> None:
+        """
+        Undoes one `pin` of the entities. Entities over the memory budget are evicted with the next access.
+        """
+        with self._lock:
+            for ID in IDs:
+                if ID in self._pins:
+                    self._pins[ID] -= 1
+                    if self._pins[ID] <= 0:
+                        del self._pins[ID]
+
+    @contextmanager
+    def pinned(self, IDs):
+        """
+        Pins the entities for the duration of the block, see `pin`.
+        """
+        IDs = list(IDs)
+        self.pin(IDs)
+        try:
+            yield
+        finally:
+            self.unpin(IDs)
+
+    def is_pinned(self, ID) -> bool:
+        return ID in self._pins
+
+    def replace(self, ID, ent) -> None:
+        """
+        Replaces an entity with a new version of it. An entity that is only materialized on access stays that way,
+        its skeleton is updated and the new version is materialized on the next access.
+        """
+        with self._lock:
+            if ID in self._skeletons:
+                path = self._skeletons[ID].path
+                self._drop(ID)
+                self._skeletons[ID] = EntitySkeleton.from_entity(ent, path=path)
+            else:
+                self[ID] = ent
+
+    def add_skeleton(self, skeleton: EntitySkeleton) -> None:
+        """
+        Adds an entity that is only materialized once accessed. Does nothing if the entity is already in the index.
+        """
+        with self._lock:
+            if skeleton.ID not in self:
+                self._skeletons[skeleton.ID] = skeleton
+
+    def is_materialized(self, ID) -> bool:
+        return ID in self._entities
+
+    def peek(self, ID):
+        """
+        Returns the entity if it is in memory, otherwise its skeleton. Never materializes anything.
+        """
+        with self._lock:
+            if ID in self._entities:
+                return self._entities[ID]
+            return self._skeletons[ID]
+
+    def skeleton(self, ID):
+        """
+        Returns an object with the ID, name, parent, children and deleted fields of the entity, without materializing
+        it. This is the entity itself if it is in memory, which keeps the structure up to date with any change.
+        """
+        return self.peek(ID)
+
+    def entity_type(self, ID) -> str:
+        """
+        Returns the class name of the entity without materializing it.
+        """
+        ent = self.peek(ID)
+        if isinstance(ent, EntitySkeleton):
+            return ent.type
+        return ent.__class__.__name__
+
+    def loaded(self) -> dict:
+        """
+        Returns a dictionary with every ID in the index as keys and, as values, the entity if it is in memory and its
+        skeleton otherwise.
+        """
+        with self._lock:
+            ret = dict(self._skeletons)
+            ret.update(self._entities)
+            return ret
@@ -0,0 +1,375 @@
+"""
+Append-only journal of the small changes made to entities.
+
+Instead of rewriting the whole TOML file of an entity every time a content block is edited or a comment is added,
+only the change is appended to the journal of the lair (`_dragon_lair.journal`). Changes are stored as a list of
+operations, one JSON line per change:
+
+```
+{"ID": "<entity ID>", "ops": [["version", "<block ID>", 3, "new text", "<timestamp>", "user"], ...], "seq": 41}
+{"ID": "<entity ID>", "checkpoint": true, "upto": 41, "seq": 42}
+```
+
+Every entry gets a sequence number that keeps growing for as long as the journal file exists. A checkpoint marks that
+the TOML file of the entity holds every change with a sequence number up to `upto`, the last one appended before the
+entity was serialized. Changes appended while the entity was being written come after that number even if they are
+before the checkpoint in the file, so they are not lost. Every operation can be applied
+more than once without changing the result, so replaying the journal over TOML files that already hold some of the
+changes is safe.
+
+Appends are group committed: a single thread writes every change waiting to be written and fsyncs the journal once
+for all of them, which keeps the cost of an edit independent of the size of the entity and of the number of
+concurrent edits. If writing a group fails, the file is cut back to where the group started and only the callers
+waiting for the entries of that group get the error, later appends are written as usual.
+"""
+import os
+import json
+import threading
+from pathlib import Path
+from typing import Optional, Union, Iterable
+
+from dragon_core.components import ContentBlock, SupportedContentBlockType, Comment
+
+
+JOURNAL_FILENAME = '_dragon_lair.journal'
+
+
+def block_op(block: ContentBlock) -> list:
+    """
+    Operation that adds a content block to the entity or replaces the one with the same ID.
+    """
+    return ["block", block.to_dict()]
+
+
+def version_op(block: ContentBlock) -> list:
+    """
+    Operation that adds the latest version of a content block.
+    """
+    content, author, date = block.latest_version()
+    if block.block_type == SupportedContentBlockType.image:
+        content = (str(content[0]), content[1])
+    return ["version", block.ID, len(block.content) - 1, content, date, author]
+
+
+def comment_op(comment: Comment) -> list:
+    """
+    Operation that adds a comment to the entity or replaces the one with the same ID.
+    """
+    return ["comment", comment.to_dict()]
+
+
+def set_op(field: str, value) -> list:
+    """
+    Operation that sets a field of the entity.
+    """
+    return ["set", field, value]
+
+
+def edit_time_op(ent) -> list:
+    """
+    Operation that adds the latest edit time of the entity.
+    """
+    return ["edit_time", len(ent.edit_times) - 1, ent.edit_times[-1]]
+
+
+def apply_ops(ent, ops: Iterable[list]) -> None:
+    """
+    Applies operations created by the functions of this module to an entity.
+    """
+    for op in ops:
+        kind = op[0]
+        if kind == "block":
+            block = ContentBlock.from_dict(dict(op[1]))
+            for i, existing in enumerate(ent.content_blocks):
+                if existing.ID == block.ID:
+                    ent.content_blocks[i] = block
+                    break
+            else:
+                ent.content_blocks.append(block)
+
+        elif kind == "version":
+            _, block_ID, index, content, date, author = op
+            block = next((b for b in ent.content_blocks if b.ID == block_ID), None)
+            # Versions already in the block were written to the TOML file before.
+            if block is None or len(block.content) != index:
+                continue
+            if block.block_type == SupportedContentBlockType.image:
+                content = (Path(content[0]), content[1])
+            block.content.append(content)
+            block.dates.append(date)
+            block.authors.append(author)
+
+        elif kind == "comment":
+            comment = Comment.from_dict(dict(op[1]))
+            for i, existing in enumerate(ent.comments):
+                if existing.ID == comment.ID:
+                    ent.comments[i] = comment
+                    break
+            else:
+                ent.comments.append(comment)
+
+        elif kind == "set":
+            _, field, value = op
+            if field == "order":
+                value = [tuple(item) for item in value]
+            setattr(ent, field, value)
+
+        elif kind == "edit_time":
+            _, index, time = op
+            if len(ent.edit_times) == index:
+                ent.edit_times.append(time)
+
+        else:
+            raise ValueError(f"Unknown journal operation {kind}")
+
+
+class Journal:
+    """
+    The journal file of a lair. Changes are appended with `append`, which returns once the change is on disk.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self._drop_partial_entry()
+        # Sequence numbers continue after the last one in the file.
+        self._seq_base = self._last_seq_in_file()
+        self._file = open(self.path, 'ab')
+
+        # Guards the file itself, held by the writer thread while writing and by `trim` while rewriting it.
+        self._file_lock = threading.Lock()
+        # Guards the queue of lines waiting to be written.
+        self._cond = threading.Condition()
+        self._pending: list[bytes] = []
+        self._queued = 0
+        # Number of entries that were written or failed to be written.
+        self._written = 0
+        # First and last entry and the error of every group of entries that failed to be written.
+        self._failures: list[tuple[int, int, Exception]] = []
+        self._closed = False
+
+        self._writer = threading.Thread(target=self._run, name='DragonJournal', daemon=True)
+        self._writer.start()
+
+    @property
+    def size(self) -> int:
+        """
+        Size in bytes of the journal file.
+        """
+        with self._file_lock:
+            return self._file.tell()
+
+    @property
+    def last_seq(self) -> int:
+        """
+        Sequence number of the last entry appended so far.
+        """
+        with self._cond:
+            return self._seq_base + self._queued
+
+    def append(self, ID: str, ops: list[list], wait: bool = True) -> int:
+        """
+        Appends a change of an entity to the journal.
+
+        :param ID: The ID of the entity.
+        :param ops: The operations of the change.
+        :param wait: If True, returns only once the change is on disk. Otherwise use `wait` with the returned number.
+        :return: The sequence number of the change.
+        """
+        return self._enqueue({"ID": ID, "ops": ops}, wait)
+
+    def checkpoint(self, ID: str, upto: Optional[int] = None, wait: bool = True) -> int:
+        """
+        Marks that the TOML file of the entity holds every change with a sequence number up to upto.
+
+        :param upto: The `last_seq` read before the entity was serialized. If None, every change appended so far.
+        :return: The sequence number of the checkpoint.
+        """
+        return self._enqueue({"ID": ID, "checkpoint": True, "upto": upto}, wait)
+
+    def wait(self, seq: int) -> None:
+        """
+        Waits until the entry with that sequence number is on disk. Raises the error if it could not be written.
+        """
+        with self._cond:
+            self._wait_written(seq - self._seq_base)
+
+    def flush(self) -> int:
+        """
+        Waits until everything appended so far is on disk or failed to be written. Failures are only raised by
+        `append`, `checkpoint` and `wait` for the entries that were lost.
+
+        :return: The size of the journal at that point.
+        """
+        with self._cond:
+            target = self._queued
+            while self._written < target:
+                self._cond.wait()
+        return self.size
+
+    def read(self) -> list[dict]:
+        """
+        Returns every entry in the journal. A partially written last line, left by a crash, is ignored.
+        """
+        self.flush()
+        return self._read_entries()
+
+    def _read_entries(self) -> list[dict]:
+        entries = []
+        if not self.path.is_file():
+            return entries
+        with open(self.path, 'rb') as f:
+            lines = f.read().splitlines()
+        for i, line in enumerate(lines):
+            if len(line.strip()) == 0:
+                continue
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError as e:
+                if i == len(lines) - 1:
+                    print(f"Ignoring partially written last entry of the journal at {self.path}")
+                else:
+                    raise e
+        return entries
+
+    def pending_ops(self) -> dict[str, list[list]]:
+        """
+        Returns, for every entity, the operations that are not in its TOML file according to its checkpoints.
+        """
+        # Operations of every entity with their sequence numbers. Entries written by older versions have none.
+        changes: dict[str, list[tuple[int, list]]] = {}
+        for entry in self.read():
+            ID = entry["ID"]
+            if entry.get("checkpoint", False):
+                upto = entry.get("upto")
+                if upto is None:
+                    changes.pop(ID, None)
+                else:
+                    changes[ID] = [(seq, ops) for seq, ops in changes.get(ID, []) if seq > upto]
+                    if len(changes[ID]) == 0:
+                        del changes[ID]
+            else:
+                changes.setdefault(ID, []).append((entry.get("seq", 0), entry["ops"]))
+        return {ID: [op for _, ops in entries for op in ops] for ID, entries in changes.items()}
+
+    def trim(self, offset: int) -> None:
+        """
+        Removes the first offset bytes of the journal. Used once every change before offset is in the TOML files.
+        """
+        self.flush()
+        with self._file_lock:
+            with open(self.path, 'rb') as f:
+                f.seek(offset)
+                tail = f.read()
+
+            tmp_path = self.path.with_name(self.path.name + '.tmp')
+            with open(tmp_path, 'wb') as f:
+                f.write(tail)
+                f.flush()
+                os.fsync(f.fileno())
+            self._file.close()
+            os.replace(tmp_path, self.path)
+            self._file = open(self.path, 'ab')
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._writer.join()
+        self._file.close()
+
+    def _last_seq_in_file(self) -> int:
+        last = 0
+        for entry in self._read_entries():
+            last = max(last, entry.get("seq", 0))
+        return last
+
+    def _drop_partial_entry(self) -> None:
+        """
+        Removes a partially written last line, left by a crash, so that new entries start on a line of their own.
+        """
+        if not self.path.is_file():
+            return
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            if len(data) == 0 or data.endswith(b'\n'):
+                return
+            print(f"Removing partially written last entry of the journal at {self.path}")
+            f.truncate(data.rfind(b'\n') + 1)
+
+    def _enqueue(self, entry: dict, wait: bool) -> int:
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("The journal is closed")
+            if entry.get("checkpoint", False) and entry["upto"] is None:
+                entry["upto"] = self._seq_base + self._queued
+            self._queued += 1
+            target = self._queued
+            entry["seq"] = self._seq_base + target
+            self._pending.append(json.dumps(entry, ensure_ascii=False).encode('utf-8') + b'\n')
+            self._cond.notify_all()
+
+            if wait:
+                self._wait_written(target)
+            return entry["seq"]
+
+    def _wait_written(self, target: int) -> None:
+        # Called with self._cond held.
+        while self._written < target:
+            self._cond.wait()
+        for first, last, error in self._failures:
+            if first <= target <= last:
+                raise error
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while len(self._pending) == 0 and not self._closed:
+                    self._cond.wait()
+                if len(self._pending) == 0 and self._closed:
+                    return
+                batch = self._pending
+                self._pending = []
+                first = self._written + 1
+                target = self._queued
+
+            # Everything that arrived while the previous batch was being written goes to disk with a single fsync.
+            with self._file_lock:
+                offset = None
+                try:
+                    offset = self._file.tell()
+                    self._file.write(b''.join(batch))
+                    self._file.flush()
+                    os.fsync(self._file.fileno())
+                except Exception as e:
+                    print(f"Error writing to the journal at {self.path} exception: \n{e}")
+                    self._discard_after(offset)
+                    with self._cond:
+                        self._failures.append((first, target, e))
+                        self._written = target
+                        self._cond.notify_all()
+                    continue
+
+            with self._cond:
+                self._written = target
+                self._cond.notify_all()
+
+    def _discard_after(self, offset: Optional[int]) -> None:
+        """
+        Removes whatever part of a failed batch reached the file, so that the next batch starts on a line of its own.
+        offset is None if the file was not open.
+        """
+        try:
+            self._file.close()
+        except Exception:
+            # The data left in the buffer could not be written either, it is cut off below anyway.
+            pass
+        try:
+            if offset is not None:
+                os.truncate(self.path, offset)
+        except Exception as e:
+            print(f"Could not remove a partially written batch from the journal at {self.path} exception: \n{e}")
+        try:
+            self._file = open(self.path, 'ab')
+        except Exception as e:
+            # Writing to the closed file fails, so the file is opened again with the next batch.
+            print(f"Could not reopen the journal at {self.path} exception: \n{e}")
@@ -0,0 +1,221 @@
+"""
+Markdown links in the content blocks of entities, parsed once for every version of a block.
+
+Content blocks are read from disk every time their file is reloaded and sent to the frontend on every `read_one`, but
+their versions rarely change. `BlockLinkCache` keeps, for the blocks used most recently, the latest version split
+around the links to other entities and the images linked in any of its versions, so that neither the regular
+expressions nor the filesystem are touched again until the block gets a new version. It also keeps the JSON sent to the
+frontend for the blocks, so that a change to one block of an entity does not encode every other block again.
+"""
+import re
+import json
+import hashlib
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional
+
+from dragon_core.components.content_blocks import ContentBlock
+
+
+# Links to files, like `[text](path/to/entity.toml)`. The path is the second group.
+ENTITY_LINK_PATTERN = re.compile(r'(\[.*?\])\(([\w\-.\/\s]+)\)')
+# Any markdown link, like `[text](target)`. The target is the second group.
+MARKDOWN_LINK_PATTERN = re.compile(r'\[(.*?)\]\((.*?)\)')
+
+IMAGE_SUFFIXES = ('.jpg', '.png')
+
+
+def split_entity_links(text: str) -> tuple:
+    """
+    Splits the text around the paths of its links to files. The items at odd positions are the paths, the items at
+    even positions the text between them, so joining every item gives back the text.
+    """
+    segments = []
+    last = 0
+    for match in ENTITY_LINK_PATTERN.finditer(text):
+        segments.append(text[last:match.start(2)])
+        segments.append(match.group(2))
+        last = match.end(2)
+    segments.append(text[last:])
+    return tuple(segments)
+
+
+def linked_images(text: str) -> set[str]:
+    """
+    Returns the resolved paths of the images linked in the text.
+    """
+    images = set()
+    for match in MARKDOWN_LINK_PATTERN.finditer(text):
+        # Catches all failures because we don't want to crash if the target is not a path.
+        try:
+            path = Path(match.group(2)).resolve()
+        except Exception as e:
+            continue
+        if path.suffix in IMAGE_SUFFIXES:
+            images.add(str(path))
+    return images
+
+
+def content_digest(content) -> str:
+    """
+    Returns a short hash of a version of a content block, to tell whether a version changed without keeping it.
+    """
+    text = content if isinstance(content, str) else repr(content)
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+@dataclass
+class ParsedBlock:
+    """
+    Links of a content block, up to version `versions`.
+
+    - versions: The number of versions of the block that were parsed.
+    - digest: The `content_digest` of the latest version of the block.
+    - segments: The latest version split with `split_entity_links`. None if the latest version is not text or has no
+      links, the block itself is used then.
+    - images: The images linked in any of the parsed versions.
+    """
+    versions: int
+    digest: str
+    segments: Optional[tuple]
+    images: set[str] = field(default_factory=set)
+
+
+class BlockLinkCache:
+    """
+    Holds a `ParsedBlock` for the `max_blocks` content blocks used most recently, keyed by the ID of the block.
+
+    Versions are only ever appended to a block, so when a block gets new versions only those are parsed. The entry is
+    rebuilt from scratch if the versions it was built from do not match the block anymore.
+    """
+
+    def __init__(self, max_blocks: int = 100_000, max_encoded_bytes: int = 64 * 1024 * 1024):
+        """
+        :param max_blocks: Maximum number of blocks held. The least recently used block is dropped past it.
+        :param max_encoded_bytes: Maximum total size of the JSON kept by `encode`. 0 disables keeping it.
+        """
+        self.max_blocks = max_blocks
+        self.max_encoded_bytes = max_encoded_bytes
+        # Entries in least recently used order.
+        self._blocks: OrderedDict[str, ParsedBlock] = OrderedDict()
+        # JSON of the blocks in least recently used order, with what it was encoded from.
+        self._encoded: OrderedDict[str, tuple[tuple, str]] = OrderedDict()
+        self._encoded_size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def _update(self, block: ContentBlock) -> tuple[ParsedBlock, set[str]]:
+        """
+        Returns the entry of the block and the images found in the versions that were parsed by this call.
+        """
+        n_versions = len(block.content)
+        latest = block.content[-1]
+        digest = content_digest(latest)
+        entry = self._blocks.get(block.ID)
+        if entry is not None and entry.versions == n_versions and entry.digest == digest:
+            self._blocks.move_to_end(block.ID)
+            return entry, set()
+
+        start = 0
+        images = set()
+        if (entry is not None and entry.versions < n_versions
+                and content_digest(block.content[entry.versions - 1]) == entry.digest):
+            start = entry.versions
+            images = entry.images
+
+        new_images = set()
+        for version in range(start, n_versions):
+            content = block.content[version]
+            if isinstance(content, str):
+                new_images.update(linked_images(content))
+
+        segments = split_entity_links(latest) if isinstance(latest, str) else None
+        if segments is not None and len(segments) == 1:
+            segments = None
+        entry = ParsedBlock(versions=n_versions, digest=digest, segments=segments, images=images | new_images)
+        self._blocks[block.ID] = entry
+        self._blocks.move_to_end(block.ID)
+        while len(self._blocks) > self.max_blocks:
+            self._drop_encoded(self._blocks.popitem(last=False)[0])
+        return entry, new_images - images
+
+    def _drop_encoded(self, block_ID: str) -> None:
+        dropped = self._encoded.pop(block_ID, None)
+        if dropped is not None:
+            self._encoded_size -= len(dropped[1])
+
+    @staticmethod
+    def _join(segments: tuple, replacements: dict[str, str]) -> str:
+        return ''.join(replacements.get(segment, segment) if i % 2 == 1 else segment
+                       for i, segment in enumerate(segments))
+
+    def new_images(self, block: ContentBlock) -> set[str]:
+        """
+        Returns the images linked in the versions of the block that were not parsed before.
+        """
+        with self._lock:
+            return self._update(block)[1]
+
+    def rewrite_latest(self, block: ContentBlock, replacements: dict[str, str]) -> str:
+        """
+        Returns the latest version of the block with the paths of its links replaced by their value in replacements.
+        Paths that are not in replacements are kept.
+        """
+        with self._lock:
+            entry = self._update(block)[0]
+        if entry.segments is None:
+            return block.content[-1]
+        return self._join(entry.segments, replacements)
+
+    def encode(self, block: ContentBlock, replacements: Optional[dict[str, str]] = None) -> str:
+        """
+        Returns the block as a JSON string with every version in full, see `ContentBlock.to_dict`. The string is kept
+        and returned again until the block changes.
+
+        :param replacements: If given, the latest version has the paths of its links replaced like in
+            `rewrite_latest`.
+        """
+        with self._lock:
+            entry = self._update(block)[0]
+            links = None
+            if replacements is not None and entry.segments is not None:
+                links = tuple(replacements.get(path, path) for path in entry.segments[1::2])
+            # Only the versions, the deleted flag and the replaced links of a block ever change.
+            key = (entry.versions, entry.digest, block.deleted, links)
+            kept = self._encoded.get(block.ID)
+            if kept is not None and kept[0] == key:
+                self._encoded.move_to_end(block.ID)
+                return kept[1]
+
+        block_dict = block.to_dict(full_history=True)
+        if links is not None:
+            block_dict['content'] = list(block_dict['content'][:-1]) + [self._join(entry.segments, replacements)]
+        encoded = json.dumps(block_dict)
+
+        if len(encoded) <= self.max_encoded_bytes:
+            with self._lock:
+                self._drop_encoded(block.ID)
+                self._encoded[block.ID] = (key, encoded)
+                self._encoded_size += len(encoded)
+                while self._encoded_size > self.max_encoded_bytes:
+                    self._drop_encoded(next(iter(self._encoded)))
+        return encoded
+
+    def discard(self, block_IDs) -> None:
+        """
+        Drops the entries of the blocks, for blocks that were deleted or are not held in memory anymore.
+        """
+        with self._lock:
+            for block_ID in block_IDs:
+                self._blocks.pop(block_ID, None)
+                self._drop_encoded(block_ID)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._blocks.clear()
+            self._encoded.clear()
+            self._encoded_size = 0
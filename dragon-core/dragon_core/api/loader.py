@@ -0,0 +1,238 @@
+"""
+Helpers used to load the entities of a lair from disk when the server starts.
+
+Entities reference the files of their children, and buckets reference the files of their instances, so the
+files of the lair can only be discovered one level of the tree at a time. Every level is parsed in one go on a
+process pool, which makes the startup time scale with the number of cores instead of the number of files.
+
+References are either the paths of those files or, with ID references on, the UUIDs of the entities, whose files are
+found through the manifest of the lair.
+"""
+import os
+import re
+from pathlib import Path
+from dataclasses import dataclass
+from typing import Optional, Union, Iterable
+from concurrent.futures import ProcessPoolExecutor
+
+from dragon_core.generators.meta import read_from_TOML, read_skeleton_from_TOML
+from .index import EntitySkeleton
+
+
+# Below this many files, spinning up the worker processes costs more than parsing the files in the current process.
+PARALLEL_LOADING_THRESHOLD = 64
+
+UUID_PATTERN = re.compile(r'^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$')
+
+
+@dataclass
+class LoadedFile:
+    """
+    An entity together with the state of the TOML file it was read from.
+
+    - entity: The loaded entity.
+    - mtime_ns: Modification time of the file when it was read.
+    - size: Size in bytes of the file when it was read.
+    - references: The references the entity holds to the TOML files it points to (children and, for buckets,
+        instances), as written in its file.
+    - from_snapshot: True if the entity was not read from disk but reused from a snapshot.
+    - by_path: True if the file references other entities by the paths of their files instead of by their UUIDs.
+    """
+    entity: object
+    mtime_ns: int
+    size: int
+    references: list[str]
+    from_snapshot: bool = False
+    by_path: bool = False
+
+
+def referenced_paths(ent) -> list[str]:
+    """
+    Returns the paths of the TOML files an entity points to when it is freshly read from disk.
+    These are the children of the entity and, for buckets, the instances it holds.
+
+    :param ent: The entity as returned by `read_from_TOML`.
+    """
+    refs = [str(child) for child in ent.children]
+    if hasattr(ent, 'path_to_uuid'):
+        refs.extend(str(path) for path in ent.path_to_uuid.keys())
+    return refs
+
+
+def references_by_path(ent) -> bool:
+    """
+    True if the entity, as freshly read from disk, references other entities by the paths of their files instead of
+    by their UUIDs. The instances of buckets are always referenced by path and are not considered.
+
+    :param ent: The entity or skeleton, before its references are resolved.
+    """
+    refs = [ent.parent] + list(ent.children)
+    if not isinstance(ent, EntitySkeleton):
+        refs.extend(ent.data_buckets)
+    return any(UUID_PATTERN.match(str(ref)) is None for ref in refs if ref != '')
+
+
+def load_entity_tree(root_paths: Iterable[Union[str, Path]],
+                     max_workers: Optional[int] = None,
+                     snapshot: Optional[dict[str, LoadedFile]] = None,
+                     skeleton_depth: Optional[int] = None,
+                     manifest: Optional[dict[str, str]] = None) -> dict[str, LoadedFile]:
+    """
+    Reads every entity reachable from the root paths. The tree is walked breadth first and every level is parsed
+    in parallel with `read_from_TOML`.
+
+    :param root_paths: Paths to the TOML files of the libraries and buckets of the lair.
+    :param max_workers: Maximum number of processes used to parse the files. If None, the number of cpus is used.
+        If 1, everything is parsed in the current process.
+    :param snapshot: Optional files loaded in a previous run. Files whose modification time and size did not change
+        since are not parsed again, their entity is reused instead.
+    :param skeleton_depth: If not None, files this many levels below the roots or deeper are only read as
+        `EntitySkeleton`s. Roots are at level 0.
+    :param manifest: Optional dictionary with UUIDs as keys and the paths of their TOML files as values, used to
+        follow references that are UUIDs instead of paths.
+    :return: Dictionary with the path of every TOML file as keys and the loaded files as values. The keys are the
+        paths as written in the referencing file (or in the manifest), in the order in which they were discovered.
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if snapshot is None:
+        snapshot = {}
+    if manifest is None:
+        manifest = {}
+
+    loaded = {}
+    seen = set()
+    frontier = []
+    for path in root_paths:
+        path = str(path)
+        if path not in seen:
+            seen.add(path)
+            frontier.append(path)
+
+    pool = None
+    depth = 0
+    try:
+        while len(frontier) > 0:
+            as_skeleton = skeleton_depth is not None and depth >= skeleton_depth
+            level = {}
+            to_parse = []
+            for path in frontier:
+                # The file is stat-ed before it is read so that a change made while loading is picked up next time.
+                stat = os.stat(path)
+                previous = snapshot.get(path)
+                if previous is not None and previous.mtime_ns == stat.st_mtime_ns and previous.size == stat.st_size \
+                        and (as_skeleton or not isinstance(previous.entity, EntitySkeleton)):
+                    entity = previous.entity
+                    if as_skeleton and not isinstance(entity, EntitySkeleton):
+                        entity = EntitySkeleton.from_entity(entity, path=path)
+                    level[path] = LoadedFile(entity=entity,
+                                             mtime_ns=stat.st_mtime_ns,
+                                             size=stat.st_size,
+                                             references=previous.references,
+                                             from_snapshot=True,
+                                             by_path=previous.by_path)
+                else:
+                    level[path] = LoadedFile(entity=None, mtime_ns=stat.st_mtime_ns, size=stat.st_size, references=[])
+                    to_parse.append(path)
+
+            if pool is None and max_workers > 1 and len(to_parse) >= PARALLEL_LOADING_THRESHOLD:
+                pool = ProcessPoolExecutor(max_workers=max_workers)
+
+            reader = _read_skeleton if as_skeleton else _read_entity
+            if pool is not None:
+                chunksize = max(1, len(to_parse) // (max_workers * 4))
+                entities = pool.map(reader, to_parse, chunksize=chunksize)
+            else:
+                entities = map(reader, to_parse)
+
+            for path, ent in zip(to_parse, entities):
+                level[path].entity = ent
+                level[path].references = referenced_paths(ent)
+                level[path].by_path = references_by_path(ent)
+
+            next_frontier = []
+            for path, loaded_file in level.items():
+                loaded[path] = loaded_file
+                for ref in loaded_file.references:
+                    ref = manifest.get(ref, ref)
+                    if ref not in seen:
+                        seen.add(ref)
+                        next_frontier.append(ref)
+            frontier = next_frontier
+            depth += 1
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    return loaded
+
+
+def resolve_references(index, path_to_uuid: dict[str, str], entities: Optional[dict] = None) -> list[tuple[str, str, str]]:
+    """
+    Replaces the paths in the parent, children, order and data buckets of every entity in the index with the UUIDs
+    of the entities they point to. Only dictionary lookups are used, the filesystem is never touched.
+
+    A reference is first looked up as written, then in its normalized form (`str(Path(ref))`), which is how paths
+    are stored in the index. References that are already UUIDs of entities in the index are left as they are.
+
+    :param index: Dictionary with UUIDs as keys and entities as values. Modified in place.
+    :param path_to_uuid: Dictionary with the paths of TOML files as keys and the UUIDs of their entities as values.
+    :param entities: Optional dictionary with UUIDs as keys and entities or skeletons as values. If passed, only these
+        are resolved while the index is only used to recognize references that are already UUIDs.
+    :return: List of the dangling references as tuples of the UUID of the referencing entity, the field holding the
+        reference and the reference itself.
+    """
+    dangling = []
+
+    def resolve(ID, field, ref):
+        ref = str(ref)
+        uuid_ = path_to_uuid.get(ref)
+        if uuid_ is None:
+            uuid_ = path_to_uuid.get(str(Path(ref)))
+        if uuid_ is not None:
+            return uuid_
+        if ref not in index:
+            dangling.append((ID, field, ref))
+        return ref
+
+    if entities is None:
+        entities = index
+
+    for ID, ent in entities.items():
+        if ent.parent != '':
+            ent.parent = resolve(ID, 'parent', ent.parent)
+
+        ent.children = [resolve(ID, 'children', child) for child in ent.children]
+
+        # Skeletons only hold the parent and children.
+        if isinstance(ent, EntitySkeleton):
+            continue
+
+        ent.order = [(resolve(ID, 'order', entry[0]), entry[1], entry[2]) if entry[1] == "entity" else entry
+                     for entry in ent.order]
+
+        ent.data_buckets = [resolve(ID, 'data_buckets', buck) for buck in ent.data_buckets]
+
+    return dangling
+
+
+def _read_skeleton(path: str) -> EntitySkeleton:
+    """
+    Reads the skeleton of a single TOML file. Lives at module level so that worker processes can pickle it.
+    """
+    try:
+        return EntitySkeleton(path=path, **read_skeleton_from_TOML(path))
+    except Exception as e:
+        print(f"Error reading entity with path {path} exception: \n{e}")
+        raise e
+
+
+def _read_entity(path: str):
+    """
+    Reads a single TOML file. Lives at module level so that worker processes can pickle it.
+    """
+    try:
+        return read_from_TOML(path)
+    except Exception as e:
+        print(f"Error reading entity with path {path} exception: \n{e}")
+        raise e
@@ -0,0 +1,128 @@
+"""
+Manifest of the entities of a lair.
+
+With ID references on, entities store the UUIDs of their parent and children in their TOML files instead of the paths
+of the files of those entities. The manifest (`_dragon_lair_manifest.json`, next to the lair file) is then the only
+place that knows where the file of every entity is, so renaming an entity only rewrites its own file and its entry in
+the manifest.
+
+The file holds one JSON object per line. Every save appends a line with the entries that changed since the last one,
+removed entities having null as their path, so creating or renaming an entity does not rewrite the whole manifest.
+Once the appended lines outnumber the entities, the file is rewritten with a single line holding every entry.
+"""
+import os
+import sys
+import json
+import threading
+from pathlib import Path
+from typing import Optional, Union
+
+from dragon_core.utils import atomic_write_text
+
+
+MANIFEST_FILENAME = '_dragon_lair_manifest.json'
+
+# Number of appended lines always allowed before the file is rewritten, so small lairs are not rewritten constantly.
+_MIN_COMPACTION_LINES = 1000
+
+
+class Manifest:
+    """
+    Maps the UUID of every entity in the lair to the path of its TOML file and stores the map in a JSON file.
+    """
+
+    def __init__(self, file_path: Union[str, Path], read_only: bool = False):
+        """
+        :param file_path: The JSON file the manifest is stored in. Loaded immediately if it exists.
+        :param read_only: If True the manifest is only loaded, to follow the references of files written while ID
+            references were on. Changes are ignored and nothing is ever saved.
+        """
+        self.file_path = Path(file_path)
+        self.read_only = read_only
+        self.paths: dict[str, str] = {}
+        # Entries changed since the last save, None for removed entities.
+        self._changes: dict[str, Optional[str]] = {}
+        self._appended_lines = 0
+        self._lock = threading.Lock()
+
+        if self.file_path.is_file():
+            self.load()
+
+    def __contains__(self, ID) -> bool:
+        return ID in self.paths
+
+    def __len__(self):
+        return len(self.paths)
+
+    def load(self) -> None:
+        paths = {}
+        try:
+            with open(self.file_path, 'r') as f:
+                lines = [line for line in f.read().splitlines() if line.strip() != '']
+            for line in lines:
+                for ID, path in json.loads(line).items():
+                    if path is None:
+                        paths.pop(ID, None)
+                    else:
+                        paths[ID] = path
+            self._appended_lines = max(len(lines) - 1, 0)
+        except Exception as e:
+            print(f"Ignoring unreadable manifest at {self.file_path} exception: \n{e}")
+            paths = {}
+            # Appending to the file would leave it unreadable, the next save rewrites it.
+            self._appended_lines = sys.maxsize
+        self.paths = paths
+        self._changes = {}
+
+    def save(self) -> None:
+        """
+        Writes the entries changed since the manifest was last saved or loaded to disk, if there are any.
+        """
+        if self.read_only:
+            return
+        with self._lock:
+            if len(self._changes) == 0:
+                return
+            if self._appended_lines >= max(_MIN_COMPACTION_LINES, len(self.paths)):
+                atomic_write_text(self.file_path, json.dumps(self.paths) + '\n')
+                self._appended_lines = 0
+            else:
+                with open(self.file_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(self._changes) + '\n')
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._appended_lines += 1
+            self._changes = {}
+
+    def get(self, ID: str) -> Optional[str]:
+        return self.paths.get(ID)
+
+    def set(self, ID: str, path: Union[str, Path]) -> None:
+        if self.read_only:
+            return
+        path = str(path)
+        with self._lock:
+            if self.paths.get(ID) != path:
+                self.paths[ID] = path
+                self._changes[ID] = path
+
+    def remove(self, ID: str) -> None:
+        if self.read_only:
+            return
+        with self._lock:
+            if self.paths.pop(ID, None) is not None:
+                self._changes[ID] = None
+
+    def update(self, paths: dict[str, str]) -> None:
+        """
+        Sets the paths of every entity in paths, a dictionary with UUIDs as keys and paths as values.
+        """
+        for ID, path in paths.items():
+            self.set(ID, path)
+
+    def translate(self, ref: str) -> str:
+        """
+        Returns the path of the file of the entity if ref is the UUID of an entity in the manifest, ref otherwise.
+        Used to follow references while walking the files of the lair, which can hold either UUIDs or paths.
+        """
+        return self.paths.get(ref, ref)
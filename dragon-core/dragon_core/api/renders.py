@@ -0,0 +1,282 @@
+"""
+Cache on disk of the HTML rendering of the analysis notebooks of instances.
+
+Converting a notebook with nbconvert takes seconds, and the notebooks of an instance are converted every time the
+instance is viewed. Renders are stored in a `DiskCache`, as files named after a hash of everything the rendering
+depends on: the path, modification time and size of the notebook, the theme, the template and the version of
+nbconvert. A notebook that changes gets a new key, its old render is never read again and eventually evicted.
+
+Notebooks added to instances are rendered ahead of time by a `RenderQueue`, so that the first view of a new
+measurement already finds its notebooks in the cache.
+"""
+import os
+import zlib
+import hashlib
+import threading
+import multiprocessing
+import functools
+from pathlib import Path
+from typing import Optional, Union, Iterator
+from concurrent.futures import Future, ProcessPoolExecutor, CancelledError
+from concurrent.futures.process import BrokenProcessPool
+
+import nbformat
+import nbconvert
+from nbconvert import HTMLExporter
+
+from .caches import DiskCache
+
+
+RENDERS_DIRNAME = 'notebook_renders'
+
+DEFAULT_THEME = "dark"
+DEFAULT_TEMPLATE = "classic"
+
+# States of the render of a notebook, see `RenderQueue.state`.
+RENDERED = "rendered"
+QUEUED = "queued"
+NOT_RENDERED = "not_rendered"
+MISSING = "missing"
+
+# Size of the pieces in which renders are sent.
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def render_notebook(path: Union[str, Path], theme: str = DEFAULT_THEME, template: str = DEFAULT_TEMPLATE) -> str:
+    """
+    Converts a notebook into html.
+
+    :param path: The path of the notebook.
+    :param theme: The theme of the html exporter.
+    :param template: The template of the html exporter.
+    :return: The body of the html document.
+    """
+    nb = nbformat.read(path, as_version=4)
+
+    html_exporter = HTMLExporter()
+    html_exporter.theme = theme
+    html_exporter.template_name = template
+
+    (body, resources) = html_exporter.from_notebook_node(nb)
+    return str(body)
+
+
+def stream_html(html: str, compress: bool = False, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Yields the html encoded in utf-8 in pieces of chunk_size characters, gzip compressed if compress is True. Each
+    piece is compressed as it is sent, so the first bytes go out before the whole render is compressed.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+    for start in range(0, len(html), chunk_size):
+        data = html[start:start + chunk_size].encode('utf-8')
+        if compressor is not None:
+            data = compressor.compress(data)
+        if len(data) > 0:
+            yield data
+    if compressor is not None:
+        yield compressor.flush()
+
+
+@functools.lru_cache(maxsize=4096)
+def _render_key(path: str, mtime_ns: int, size: int, theme: str, template: str) -> str:
+    # Memoized, the key of a notebook is asked for every time its instance is read.
+    parts = (str(Path(path).resolve()), str(mtime_ns), str(size), theme, template, nbconvert.__version__)
+    return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()
+
+
+class RenderCache(DiskCache):
+    """
+    Renders of notebooks stored on disk, see `DiskCache`.
+    """
+
+    def __init__(self, directory: Union[str, Path], max_bytes: int = 512 * 1024 * 1024):
+        """
+        :param directory: The directory holding the renders. Created with the first render. Renders already in it
+            are kept.
+        :param max_bytes: Maximum total size of the renders. 0 disables the cache.
+        """
+        super().__init__(directory, max_bytes, suffix='.html')
+
+    def key(self, path: Union[str, Path], theme: str = DEFAULT_THEME, template: str = DEFAULT_TEMPLATE,
+            stat: Optional[os.stat_result] = None) -> Optional[str]:
+        """
+        Returns the key of the render of a notebook. None if the notebook does not exist.
+
+        :param stat: The result of `os.stat` on the notebook if the caller already has it.
+        """
+        if stat is None:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return None
+        return _render_key(str(path), stat.st_mtime_ns, stat.st_size, theme, template)
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Returns the render stored with key, None if there is none.
+        """
+        data = self.get_bytes(key)
+        return data.decode('utf-8') if data is not None else None
+
+    def put(self, key: str, html: str) -> None:
+        """
+        Stores a render. Renders larger than the whole cache are not stored.
+        """
+        self.put_bytes(key, html.encode('utf-8'))
+
+    def render(self, path: Union[str, Path], theme: str = DEFAULT_THEME, template: str = DEFAULT_TEMPLATE) -> str:
+        """
+        Returns the html of a notebook, from the cache if it was rendered before. See `render_notebook`.
+        """
+        key = self.key(path, theme, template) if self.max_bytes > 0 else None
+        if key is None:
+            return render_notebook(path, theme, template)
+
+        html = self.get(key)
+        if html is None:
+            html = render_notebook(path, theme, template)
+            self.put(key, html)
+        return html
+
+
+class RenderQueue:
+    """
+    Renders notebooks into a `RenderCache` in the background, on a pool of processes since nbconvert is CPU bound.
+
+    At most `max_queued` notebooks are waiting or being rendered at a time. Notebooks submitted while the queue is
+    full are not queued, they are rendered by the first request that needs them instead.
+    """
+
+    def __init__(self, cache: RenderCache, max_workers: int = 2, max_queued: int = 64, wait_timeout: float = 30.0):
+        """
+        :param cache: The cache the renders are stored in.
+        :param max_workers: Number of processes rendering notebooks. 0 disables rendering in the background.
+        :param max_queued: Maximum number of notebooks waiting or being rendered.
+        :param wait_timeout: Maximum number of seconds `render` waits for a queued render before rendering the
+            notebook itself.
+        """
+        self.cache = cache
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.wait_timeout = wait_timeout
+        # The pool is only started once the first notebook is submitted.
+        self._pool: Optional[ProcessPoolExecutor] = None
+        # Keys of the renders in progress with their futures.
+        self._pending: dict[str, Future] = {}
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def submit(self, path: Union[str, Path], theme: str = DEFAULT_THEME, template: str = DEFAULT_TEMPLATE) -> bool:
+        """
+        Queues a notebook to be rendered, unless its render is already in the cache or queued.
+
+        :return: True if the render is in the cache or will be, False if it was not queued.
+        """
+        if self.max_workers <= 0 or self.cache.max_bytes <= 0:
+            return False
+        key = self.cache.key(path, theme, template)
+        if key is None:
+            return False
+
+        with self._lock:
+            if key in self._pending or key in self.cache:
+                return True
+            if len(self._pending) >= self.max_queued:
+                self.dropped += 1
+                return False
+            if self._pool is None:
+                # Forking a server with running threads can copy locks held by them into the workers.
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+            try:
+                future = self._pool.submit(render_notebook, str(path), theme, template)
+            except BrokenProcessPool:
+                # A worker died, a new pool is started with the next notebook.
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+                self.failed += 1
+                return False
+            self._pending[key] = future
+
+        future.add_done_callback(lambda done: self._finish(key, path, done))
+        return True
+
+    def _finish(self, key: str, path: Union[str, Path], future: Future) -> None:
+        try:
+            if not future.cancelled():
+                self.cache.put(key, future.result())
+                self.completed += 1
+        except Exception as e:
+            print(f"Could not render notebook {path}: {e}")
+            self.failed += 1
+        finally:
+            # Only removed once the render is in the cache, so it is always found in one of the two.
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def state(self, path: Union[str, Path], theme: str = DEFAULT_THEME, template: str = DEFAULT_TEMPLATE,
+              stat: Optional[os.stat_result] = None) -> str:
+        """
+        Returns whether the render of a notebook is in the cache (`RENDERED`), being rendered in the background
+        (`QUEUED`) or neither (`NOT_RENDERED`). `MISSING` if the notebook does not exist.
+
+        :param stat: The result of `os.stat` on the notebook if the caller already has it.
+        """
+        key = self.cache.key(path, theme, template, stat=stat)
+        if key is None:
+            return MISSING
+        with self._lock:
+            if key in self._pending:
+                return QUEUED
+        if key in self.cache:
+            return RENDERED
+        return NOT_RENDERED
+
+    def render(self, path: Union[str, Path], theme: str = DEFAULT_THEME, template: str = DEFAULT_TEMPLATE) -> str:
+        """
+        Returns the html of a notebook. Waits for the render if the notebook is queued, otherwise it is rendered
+        right away if it is not in the cache. See `RenderCache.render`.
+
+        A queued render that takes longer than `wait_timeout`, for example because it is still behind many other
+        notebooks or its worker hangs, is not waited for anymore and the notebook is rendered right away.
+        """
+        key = self.cache.key(path, theme, template)
+        with self._lock:
+            future = self._pending.get(key) if key is not None else None
+        if future is not None:
+            try:
+                return future.result(timeout=self.wait_timeout)
+            except (Exception, CancelledError) as e:
+                # Includes TimeoutError, the render in the background is left to finish and fill the cache.
+                pass
+        return self.cache.render(path, theme, template)
+
+    def status(self) -> dict:
+        """
+        Returns the number of notebooks queued and rendered so far, and the size of the cache.
+        """
+        with self._lock:
+            queued = len(self._pending)
+        return {'queued': queued,
+                'max_queued': self.max_queued,
+                'workers': self.max_workers,
+                'completed': self.completed,
+                'failed': self.failed,
+                'dropped': self.dropped,
+                'cached': len(self.cache),
+                'cache_bytes': self.cache.size}
+
+    def stop(self) -> None:
+        """
+        Stops the pool. Notebooks still waiting are not rendered.
+        """
+        with self._lock:
+            pool = self._pool
+            self._pool = None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,70 @@
+"""
+Binary snapshot of the loaded lair. It is written next to the `_dragon_lair.toml` file after the lair is loaded,
+and lets the next start of the server skip parsing every TOML file that has not changed since.
+
+The snapshot is a pickle, it should only ever be read from a lair directory that the server itself manages.
+"""
+import os
+import pickle
+from pathlib import Path
+from typing import Optional
+
+from .loader import LoadedFile
+
+
+SNAPSHOT_FILENAME = '_dragon_lair.snapshot'
+
+# Increase whenever the classes stored in the snapshot change in a way that makes old snapshots unusable.
+SNAPSHOT_VERSION = 3
+
+
+def snapshot_path(lair_dir: Path) -> Path:
+    return Path(lair_dir).joinpath(SNAPSHOT_FILENAME)
+
+
+def read_snapshot(lair_dir: Path) -> Optional[dict[str, LoadedFile]]:
+    """
+    Reads the snapshot of the lair in lair_dir.
+
+    :param lair_dir: Directory holding the `_dragon_lair.toml` file.
+    :return: Dictionary with the path of every TOML file as keys and the loaded files as values. None if there is no
+        usable snapshot.
+    """
+    path = snapshot_path(lair_dir)
+    if not path.is_file():
+        return None
+
+    try:
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+    except Exception as e:
+        print(f"Ignoring unreadable snapshot at {path} exception: \n{e}")
+        return None
+
+    if not isinstance(data, dict) or data.get('version') != SNAPSHOT_VERSION:
+        print(f"Ignoring snapshot at {path}, it was written by a different version of Lab Dragon")
+        return None
+
+    return data['files']
+
+
+def write_snapshot(lair_dir: Path, files: dict[str, LoadedFile]) -> None:
+    """
+    Writes the snapshot of the lair in lair_dir. The entities are stored as they are at the moment of calling,
+    which must match the state of the files at the modification times and sizes recorded in the loaded files.
+
+    :param lair_dir: Directory holding the `_dragon_lair.toml` file.
+    :param files: The loaded files, as returned by `load_entity_tree`.
+    """
+    path = snapshot_path(lair_dir)
+    tmp_path = path.with_name(path.name + '.tmp')
+
+    data = {'version': SNAPSHOT_VERSION,
+            'files': {p: LoadedFile(entity=f.entity, mtime_ns=f.mtime_ns, size=f.size, references=f.references,
+                                    by_path=f.by_path)
+                      for p, f in files.items()}}
+
+    # Written to a temporary file first so that a crash never leaves a half written snapshot behind.
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
@@ -0,0 +1,477 @@
+"""
+Storage backends for the entities of a lair.
+
+Everything in the API layer is written against `StorageBackend`, so entities can either live in the tree of TOML files
+the lair has always used (`TOMLStorage`) or in a single SQLite database next to the lair (`SQLiteStorage`).
+
+Entities are located by the path of their TOML file in both backends. With SQLite the path is only a key stored in the
+database, no file is ever written there, so the lair file, the indices and the buckets keep working unchanged and a
+lair can be moved between backends with `dragon_convert_lair`.
+"""
+import os
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Callable, Iterable, Optional, Union
+
+from dragon_core.utils import write_batch
+from dragon_core.generators.meta import read_from_TOML, entity_class
+from dragon_core.components import ContentBlock, Comment, SupportedContentBlockType, VersionHistory
+from .index import EntitySkeleton
+from .loader import LoadedFile, load_entity_tree, references_by_path
+from .snapshot import read_snapshot, write_snapshot
+
+
+SQLITE_FILENAME = '_dragon_lair.sqlite'
+
+# Attributes of an entity that are stored in their own tables instead of in the fields of the entity.
+_SEPARATE_FIELDS = ('content_blocks', 'comments', 'path_to_uuid', 'uuid_to_path')
+
+
+class StorageBackend(ABC):
+    """
+    Persists the entities of a lair. Entities are identified by their ID and located by the path of their TOML file.
+    """
+
+    @abstractmethod
+    def load(self, root_paths: Iterable[Union[str, Path]], skeleton_depth: Optional[int] = None) -> dict[str, LoadedFile]:
+        """
+        Reads every entity reachable from the root paths. Same contract as `load_entity_tree`.
+
+        :param root_paths: Paths of the libraries or buckets of the lair.
+        :param skeleton_depth: If not None, entities this many levels below the roots or deeper are only read as
+            `EntitySkeleton`s.
+        :return: Dictionary with the path of every entity as keys and the loaded entities as values.
+        """
+
+    def finish_load(self, loaded: dict[str, LoadedFile]) -> None:
+        """
+        Called once every entity of the lair is loaded and its references are resolved.
+
+        :param loaded: Every entity returned by `load`.
+        """
+
+    @abstractmethod
+    def read(self, ID: str, path: Union[str, Path]) -> tuple[object, int]:
+        """
+        Reads a single entity, as it was stored.
+
+        :return: The entity and the size in bytes it takes in storage.
+        """
+
+    @abstractmethod
+    def write(self, ent, path: Union[str, Path]) -> None:
+        """
+        Stores an entity, replacing any previous version of it.
+        """
+
+    @abstractmethod
+    def remove(self, ID: str, path: Union[str, Path]) -> None:
+        """
+        Removes the old location of an entity after it was written to a different path.
+        """
+
+    @abstractmethod
+    def exists(self, path: Union[str, Path]) -> bool:
+        """
+        True if an entity is stored at path.
+        """
+
+    @contextmanager
+    def batch(self):
+        """
+        Groups every write made inside it. Callbacks registered with `after_write` run once everything is stored.
+        """
+        with write_batch():
+            yield
+
+    def close(self) -> None:
+        pass
+
+
+class TOMLStorage(StorageBackend):
+    """
+    Every entity in its own TOML file, the tree of files is walked through the references between entities.
+
+    :param lair_dir: Directory holding the `_dragon_lair.toml` file.
+    :param max_workers: Maximum number of processes used to parse the files when loading.
+    :param use_snapshot: If True, the snapshot of the previous load is used to skip files that did not change.
+    :param manifest: Optional dictionary with UUIDs as keys and paths as values, used to follow references by ID.
+    :param translate_ref: Optional function applied to the references to other entities when writing.
+    """
+
+    def __init__(self,
+                 lair_dir: Union[str, Path],
+                 max_workers: Optional[int] = None,
+                 use_snapshot: bool = True,
+                 manifest: Optional[dict[str, str]] = None,
+                 translate_ref: Optional[Callable[[str], str]] = None):
+        self.lair_dir = Path(lair_dir)
+        self.max_workers = max_workers
+        self.use_snapshot = use_snapshot
+        self.manifest = manifest
+        self.translate_ref = translate_ref
+        self._snapshot = None
+
+    def load(self, root_paths: Iterable[Union[str, Path]], skeleton_depth: Optional[int] = None) -> dict[str, LoadedFile]:
+        if self.use_snapshot and self._snapshot is None:
+            self._snapshot = read_snapshot(self.lair_dir) or {}
+        return load_entity_tree(root_paths,
+                                max_workers=self.max_workers,
+                                snapshot=self._snapshot,
+                                skeleton_depth=skeleton_depth,
+                                manifest=self.manifest)
+
+    def finish_load(self, loaded: dict[str, LoadedFile]) -> None:
+        self._snapshot = None
+        # The snapshot holds the entities with their references already resolved. Only written if something changed.
+        if self.use_snapshot and any(not loaded_file.from_snapshot for loaded_file in loaded.values()):
+            write_snapshot(self.lair_dir, loaded)
+
+    def read(self, ID: str, path: Union[str, Path]) -> tuple[object, int]:
+        return read_from_TOML(path), os.path.getsize(path)
+
+    def write(self, ent, path: Union[str, Path]) -> None:
+        ent.to_TOML(Path(path), translate_ref=self.translate_ref)
+
+    def remove(self, ID: str, path: Union[str, Path]) -> None:
+        Path(path).unlink(missing_ok=True)
+
+    def exists(self, path: Union[str, Path]) -> bool:
+        return Path(path).is_file()
+
+
+class SQLiteStorage(StorageBackend):
+    """
+    Every entity of the lair in a single SQLite database, in WAL mode so that reads never wait for a write.
+
+    Entities reference each other by ID. Content blocks store one row per version, text blocks with the keyframes and
+    deltas of their `VersionHistory`, so saving a block only inserts the versions that are new. Writes made inside
+    `batch` are a single transaction.
+
+    :param db_path: Path of the database file. Created if it does not exist.
+    """
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS entities (
+            ID TEXT PRIMARY KEY,
+            type TEXT NOT NULL,
+            name TEXT NOT NULL,
+            parent TEXT NOT NULL,
+            path TEXT NOT NULL UNIQUE,
+            deleted INTEGER NOT NULL,
+            fields TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS entities_parent ON entities (parent);
+        CREATE INDEX IF NOT EXISTS entities_type ON entities (type);
+
+        CREATE TABLE IF NOT EXISTS content_blocks (
+            ID TEXT PRIMARY KEY,
+            entity_ID TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            block_type INTEGER NOT NULL,
+            creation_user TEXT NOT NULL,
+            creation_time TEXT NOT NULL,
+            deleted INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS content_blocks_entity ON content_blocks (entity_ID);
+
+        CREATE TABLE IF NOT EXISTS content_block_versions (
+            block_ID TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            date TEXT NOT NULL,
+            author TEXT NOT NULL,
+            PRIMARY KEY (block_ID, version)
+        ) WITHOUT ROWID;
+
+        CREATE TABLE IF NOT EXISTS comments (
+            ID TEXT PRIMARY KEY,
+            entity_ID TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            target TEXT NOT NULL,
+            resolved INTEGER NOT NULL,
+            deleted INTEGER NOT NULL,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS comments_entity ON comments (entity_ID);
+        CREATE INDEX IF NOT EXISTS comments_target ON comments (target);
+
+        CREATE TABLE IF NOT EXISTS bucket_instances (
+            bucket_ID TEXT NOT NULL,
+            instance_path TEXT NOT NULL,
+            instance_ID TEXT NOT NULL,
+            PRIMARY KEY (bucket_ID, instance_path)
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, db_path: Union[str, Path]):
+        self.db_path = Path(db_path)
+        # A single connection shared by every thread, the lock makes sure only one of them uses it at a time.
+        self._connection = sqlite3.connect(str(self.db_path), check_same_thread=False, isolation_level=None)
+        self._lock = threading.RLock()
+        self._depth = 0
+        # Number of versions of every content block known to be in the database. Updated while writing, so it is
+        # cleared when a transaction is rolled back.
+        self._stored_versions: dict[str, int] = {}
+
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.executescript(self._SCHEMA)
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            if self._depth == 0:
+                self._connection.execute("BEGIN IMMEDIATE")
+            self._depth += 1
+            try:
+                yield self._connection
+            except BaseException:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._connection.execute("ROLLBACK")
+                    self._stored_versions.clear()
+                raise
+            self._depth -= 1
+            if self._depth == 0:
+                self._connection.execute("COMMIT")
+
+    @contextmanager
+    def batch(self):
+        # The callbacks of the write batch run after the transaction commits.
+        with write_batch():
+            with self._transaction():
+                yield
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    def load(self, root_paths: Iterable[Union[str, Path]], skeleton_depth: Optional[int] = None) -> dict[str, LoadedFile]:
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT ID, type, name, parent, path, deleted, json_extract(fields, '$.children') FROM entities"
+            ).fetchall()
+            instances = self._connection.execute("SELECT bucket_ID, instance_ID FROM bucket_instances").fetchall()
+
+        by_ID = {row[0]: row for row in rows}
+        by_path = {row[4]: row for row in rows}
+        children = {row[0]: json.loads(row[6]) if row[6] is not None else [] for row in rows}
+        # Buckets also reference the instances they hold.
+        references = {ID: list(refs) for ID, refs in children.items()}
+        for bucket_ID, instance_ID in instances:
+            references[bucket_ID].append(instance_ID)
+
+        # Walked breadth first from the roots, like the TOML tree, so entities that are not reachable are left out.
+        levels = {}
+        seen = set()
+        frontier = []
+        for path in root_paths:
+            row = by_path.get(str(path))
+            if row is None:
+                raise FileNotFoundError(f"No entity stored with path {path} in {self.db_path}, TOML lairs can be "
+                                        f"imported with dragon_convert_lair")
+            if row[0] not in seen:
+                seen.add(row[0])
+                frontier.append(row[0])
+        depth = 0
+        while len(frontier) > 0:
+            for ID in frontier:
+                levels[ID] = depth
+            next_frontier = []
+            for ID in frontier:
+                for ref in references[ID]:
+                    if ref in by_ID and ref not in seen:
+                        seen.add(ref)
+                        next_frontier.append(ref)
+            frontier = next_frontier
+            depth += 1
+
+        full = [ID for ID, level in levels.items() if skeleton_depth is None or level < skeleton_depth]
+        entities = self._read_entities(full)
+
+        loaded = {}
+        for ID in levels:
+            _, type_name, name, parent, path, deleted, _ = by_ID[ID]
+            if ID in entities:
+                ent, size = entities[ID]
+            else:
+                ent = EntitySkeleton(ID=ID, name=name, type=type_name, parent=parent, children=children[ID],
+                                     deleted=bool(deleted), path=path)
+                size = 0
+            loaded[path] = LoadedFile(entity=ent, mtime_ns=0, size=size, references=references[ID],
+                                      by_path=references_by_path(ent))
+        return loaded
+
+    def read(self, ID: str, path: Union[str, Path]) -> tuple[object, int]:
+        entities = self._read_entities([ID])
+        if ID not in entities:
+            raise KeyError(f"Entity with ID {ID} is not stored in {self.db_path}")
+        return entities[ID]
+
+    def _read_entities(self, IDs: list[str]) -> dict[str, tuple[object, int]]:
+        """
+        Instantiates the entities with the given IDs. Every table is queried once for all of them.
+
+        :return: Dictionary with the IDs as keys and tuples of the entity and the number of bytes it was read from
+            as values.
+        """
+        selected = json.dumps(IDs)
+        with self._lock:
+            execute = self._connection.execute
+            rows = execute("SELECT ID, type, fields FROM entities WHERE ID IN (SELECT value FROM json_each(?))",
+                           (selected,)).fetchall()
+            block_rows = execute(
+                "SELECT ID, entity_ID, block_type, creation_user, creation_time, deleted FROM content_blocks "
+                "WHERE entity_ID IN (SELECT value FROM json_each(?)) ORDER BY entity_ID, position",
+                (selected,)).fetchall()
+            version_rows = execute(
+                "SELECT v.block_ID, v.content, v.date, v.author FROM content_block_versions v "
+                "JOIN content_blocks b ON b.ID = v.block_ID "
+                "WHERE b.entity_ID IN (SELECT value FROM json_each(?)) ORDER BY v.block_ID, v.version",
+                (selected,)).fetchall()
+            comment_rows = execute(
+                "SELECT entity_ID, data FROM comments WHERE entity_ID IN (SELECT value FROM json_each(?)) "
+                "ORDER BY entity_ID, position",
+                (selected,)).fetchall()
+            instance_rows = execute(
+                "SELECT bucket_ID, instance_path, instance_ID FROM bucket_instances "
+                "WHERE bucket_ID IN (SELECT value FROM json_each(?))",
+                (selected,)).fetchall()
+
+        sizes = {ID: len(fields) for ID, _, fields in rows}
+
+        versions: dict[str, tuple[list, list, list]] = {}
+        for block_ID, content, date, author in version_rows:
+            contents, dates, authors = versions.setdefault(block_ID, ([], [], []))
+            contents.append(json.loads(content))
+            dates.append(date)
+            authors.append(json.loads(author))
+
+        blocks: dict[str, list[ContentBlock]] = {}
+        for block_ID, entity_ID, block_type, creation_user, creation_time, deleted in block_rows:
+            contents, dates, authors = versions.get(block_ID, ([], [], []))
+            sizes[entity_ID] += sum(len(str(content)) for content in contents)
+            self._stored_versions[block_ID] = len(contents)
+            if block_type == SupportedContentBlockType.text.value:
+                contents = {'versions': contents}
+            blocks.setdefault(entity_ID, []).append(ContentBlock.from_dict({'ID': block_ID,
+                                                                            'creation_user': json.loads(creation_user),
+                                                                            'creation_time': creation_time,
+                                                                            'deleted': bool(deleted),
+                                                                            'content': contents,
+                                                                            'dates': dates,
+                                                                            'authors': authors,
+                                                                            'block_type': block_type}))
+
+        comments: dict[str, list[Comment]] = {}
+        for entity_ID, data in comment_rows:
+            sizes[entity_ID] += len(data)
+            comments.setdefault(entity_ID, []).append(Comment.from_dict(json.loads(data)))
+
+        path_to_uuid: dict[str, dict[str, str]] = {}
+        for bucket_ID, instance_path, instance_ID in instance_rows:
+            path_to_uuid.setdefault(bucket_ID, {})[instance_path] = instance_ID
+
+        entities = {}
+        for ID, type_name, fields in rows:
+            data = json.loads(fields)
+            data['content_blocks'] = blocks.get(ID, [])
+            data['comments'] = comments.get(ID, [])
+            if ID in path_to_uuid:
+                data['path_to_uuid'] = path_to_uuid[ID]
+            entities[ID] = (entity_class(type_name)(**data), sizes[ID])
+        return entities
+
+    def write(self, ent, path: Union[str, Path]) -> None:
+        fields = {key: value for key, value in vars(ent).items()
+                  if key not in _SEPARATE_FIELDS and not key.startswith('_')}
+
+        with self._transaction() as connection:
+            execute = connection.execute
+            execute("INSERT INTO entities (ID, type, name, parent, path, deleted, fields) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (ID) DO UPDATE SET type = excluded.type, name = excluded.name, "
+                    "parent = excluded.parent, path = excluded.path, deleted = excluded.deleted, "
+                    "fields = excluded.fields",
+                    (ent.ID, ent.__class__.__name__, ent.name, str(ent.parent), str(path), int(ent.deleted),
+                     json.dumps(fields, default=str)))
+
+            self._write_blocks(connection, ent)
+
+            execute("DELETE FROM comments WHERE entity_ID = ?", (ent.ID,))
+            connection.executemany(
+                "INSERT INTO comments (ID, entity_ID, position, target, resolved, deleted, data) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(comment.ID, ent.ID, position, comment.target, int(comment.resolved), int(comment.deleted),
+                  str(comment)) for position, comment in enumerate(ent.comments)])
+
+            if hasattr(ent, 'path_to_uuid'):
+                execute("DELETE FROM bucket_instances WHERE bucket_ID = ?", (ent.ID,))
+                connection.executemany(
+                    "INSERT INTO bucket_instances (bucket_ID, instance_path, instance_ID) VALUES (?, ?, ?)",
+                    [(ent.ID, str(instance_path), instance_ID)
+                     for instance_path, instance_ID in ent.path_to_uuid.items()])
+
+    def _write_blocks(self, connection: sqlite3.Connection, ent) -> None:
+        block_IDs = [block.ID for block in ent.content_blocks]
+        stale = connection.execute(
+            "SELECT ID FROM content_blocks WHERE entity_ID = ? AND ID NOT IN (SELECT value FROM json_each(?))",
+            (ent.ID, json.dumps(block_IDs))).fetchall()
+        for (block_ID,) in stale:
+            connection.execute("DELETE FROM content_block_versions WHERE block_ID = ?", (block_ID,))
+            self._stored_versions.pop(block_ID, None)
+        connection.execute("DELETE FROM content_blocks WHERE entity_ID = ? AND ID NOT IN "
+                           "(SELECT value FROM json_each(?))", (ent.ID, json.dumps(block_IDs)))
+
+        for position, block in enumerate(ent.content_blocks):
+            connection.execute(
+                "INSERT INTO content_blocks (ID, entity_ID, position, block_type, creation_user, creation_time, deleted) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (ID) DO UPDATE SET entity_ID = excluded.entity_ID, "
+                "position = excluded.position, deleted = excluded.deleted",
+                (block.ID, ent.ID, position, block.block_type.value, json.dumps(block.creation_user), block.creation_time,
+                 int(block.deleted)))
+
+            if isinstance(block.content, VersionHistory):
+                contents = block.content.encoded()
+            elif block.block_type in (SupportedContentBlockType.image, SupportedContentBlockType.image_link):
+                contents = [(str(content[0]), content[1]) for content in block.content]
+            else:
+                contents = list(block.content)
+
+            stored = self._stored_versions.get(block.ID)
+            if stored is None:
+                stored = connection.execute("SELECT COUNT(*) FROM content_block_versions WHERE block_ID = ?",
+                                            (block.ID,)).fetchone()[0]
+            if stored > len(contents):
+                connection.execute("DELETE FROM content_block_versions WHERE block_ID = ? AND version >= ?",
+                                   (block.ID, len(contents)))
+            # Versions are only ever appended, the last stored one is written again in case it was replaced.
+            start = max(0, min(stored, len(contents)) - 1)
+            connection.executemany(
+                "INSERT OR REPLACE INTO content_block_versions (block_ID, version, content, date, author) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(block.ID, version, json.dumps(contents[version]), str(block.dates[version]),
+                  json.dumps(block.authors[version])) for version in range(start, len(contents))])
+            self._stored_versions[block.ID] = len(contents)
+
+    def remove(self, ID: str, path: Union[str, Path]) -> None:
+        # The row of the entity moved with it, only something else left at the old path is removed.
+        with self._transaction() as connection:
+            row = connection.execute("SELECT ID FROM entities WHERE path = ?", (str(path),)).fetchone()
+            if row is None or row[0] == ID:
+                return
+            connection.execute("DELETE FROM content_block_versions WHERE block_ID IN "
+                               "(SELECT ID FROM content_blocks WHERE entity_ID = ?)", (row[0],))
+            for table, column in (('content_blocks', 'entity_ID'), ('comments', 'entity_ID'),
+                                  ('bucket_instances', 'bucket_ID'), ('entities', 'ID')):
+                connection.execute(f"DELETE FROM {table} WHERE {column} = ?", (row[0],))
+
+    def exists(self, path: Union[str, Path]) -> bool:
+        with self._lock:
+            return self._connection.execute("SELECT 1 FROM entities WHERE path = ?",
+                                            (str(path),)).fetchone() is not None
@@ -0,0 +1,110 @@
+"""
+Downscaled copies of the images of instances, for the places where they are only shown small.
+
+Images of instances are usually plots saved at full resolution, several megabytes each, while the frontend shows most
+of them in grids and cards a few hundred pixels wide. Downscaled copies are made the first time they are asked for and
+stored in a `DiskCache`, named after a hash of the path, modification time and size of the image and the width of
+the copy, so a copy is never served for an image that changed after it was made.
+"""
+import os
+import hashlib
+from io import BytesIO
+from pathlib import Path
+from typing import Optional, Union
+
+from PIL import Image
+
+from .caches import DiskCache
+
+
+THUMBNAILS_DIRNAME = 'image_thumbnails'
+
+# Maximum width in pixels of every size in which images can be requested.
+IMAGE_SIZES = {
+    'thumbnail': 400,
+    'preview': 1200,
+}
+
+# Changing how copies are made must change this, so that copies made before are not used.
+_THUMBNAIL_VERSION = 1
+
+_JPEG_SUFFIXES = ('.jpg', '.jpeg')
+
+
+def image_mimetype(path: Union[str, Path]) -> str:
+    """
+    Returns the mimetype of the downscaled copies of an image. Copies keep the format of the image, JPEG for photos
+    and PNG for everything else, which keeps the lines of plots sharp.
+    """
+    return 'image/jpeg' if Path(path).suffix.lower() in _JPEG_SUFFIXES else 'image/png'
+
+
+def downscale_image(path: Union[str, Path], width: int) -> Optional[bytes]:
+    """
+    Makes a copy of an image that is at most width pixels wide, keeping its aspect ratio.
+
+    :param path: The path of the image.
+    :param width: The maximum width of the copy.
+    :return: The encoded copy. None if the image is not wider than width, the image itself should be used then.
+    """
+    with Image.open(path) as img:
+        if img.width <= width:
+            return None
+        height = max(1, round(img.height * width / img.width))
+
+        # Palette images can only be resized with the nearest neighbour, which makes plots unreadable.
+        if img.mode in ('P', '1'):
+            img = img.convert('RGBA')
+        # For JPEG files thumbnail decodes the image already reduced, which is much faster than decoding it in full.
+        img.thumbnail((width, height), Image.Resampling.LANCZOS, reducing_gap=2.0)
+
+        buffer = BytesIO()
+        if image_mimetype(path) == 'image/jpeg':
+            img.convert('RGB').save(buffer, 'JPEG', quality=85, optimize=True)
+        else:
+            img.save(buffer, 'PNG', optimize=True)
+        return buffer.getvalue()
+
+
+class ThumbnailCache(DiskCache):
+    """
+    Downscaled copies of images stored on disk, see `DiskCache`.
+    """
+
+    def __init__(self, directory: Union[str, Path], max_bytes: int = 256 * 1024 * 1024):
+        """
+        :param directory: The directory holding the copies. Created with the first copy. Copies already in it are kept.
+        :param max_bytes: Maximum total size of the copies. 0 disables the cache.
+        """
+        super().__init__(directory, max_bytes)
+
+    def key(self, path: Union[str, Path], width: int) -> Optional[str]:
+        """
+        Returns the key of the copy of an image. None if the image does not exist.
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        parts = (str(Path(path).resolve()), str(stat.st_mtime_ns), str(stat.st_size), str(width),
+                 str(_THUMBNAIL_VERSION))
+        return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()
+
+    def thumbnail(self, path: Union[str, Path], width: int, key: Optional[str] = None) -> Optional[bytes]:
+        """
+        Returns a copy of the image at most width pixels wide, from the cache if it was made before. See
+        `downscale_image`.
+
+        :param key: The key of the copy if the caller already has it.
+        """
+        if key is None and self.max_bytes > 0:
+            key = self.key(path, width)
+        if key is None:
+            return downscale_image(path, width)
+
+        data = self.get_bytes(key)
+        if data is None:
+            data = downscale_image(path, width)
+            if data is not None:
+                self.put_bytes(key, data)
+        return data
@@ -0,0 +1,373 @@
+"""
+Watcher for the TOML files of the lair.
+
+Other processes (measurement scripts for example) write TOML files into the lair and bucket directories. The watcher
+notices new, modified and removed files so that only those files need to be read again.
+
+When watchdog is installed, the watcher is told about changes by the operating system (inotify on Linux) and only
+looks at the files and directories that changed. Otherwise, and on filesystems that do not report changes (network
+filesystems), it polls: directories are only listed again when their modification time changes, which is the case
+whenever a file is created, removed or renamed in them, and only the files of those directories are stat-ed. Every
+known file is only stat-ed once every `full_check_every` polls, to catch files modified in place.
+"""
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Callable, Optional, Union
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+
+# Files written by entities always start with the first 8 characters of their ID.
+ENTITY_FILENAME_PATTERN = re.compile(r'^[0-9a-fA-F]{8}_.*\.toml$')
+
+# Seconds the events of the operating system are collected for before the files they name are looked at, so that a
+# file written in several steps is only reported once.
+EVENTS_DELAY = 0.2
+
+# Types of watchdog events that can change what is in a file. Opening and closing a file do not.
+_CHANGE_EVENTS = ('created', 'modified', 'deleted', 'moved')
+
+
+class _EventHandler(FileSystemEventHandler):
+
+    def __init__(self, watcher: 'LairWatcher'):
+        super().__init__()
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        if event.event_type not in _CHANGE_EVENTS:
+            return
+        paths = [event.src_path]
+        if event.event_type == 'moved':
+            paths.append(event.dest_path)
+        self.watcher._notify([os.fsdecode(path) for path in paths], event.is_directory)
+
+
+class LairWatcher:
+    """
+    Watches a set of directories (recursively) for changes in entity TOML files.
+
+    Changes are reported by calling `on_change` with the new or modified paths and the removed paths. Once `start` is
+    called they are reported from a background thread, as the operating system tells about them if watchdog is
+    available and `use_events` is True, or by polling every `interval` seconds otherwise. Polls can also be triggered
+    synchronously with `poll`.
+    """
+
+    def __init__(self,
+                 on_change: Callable[[list[str], list[str]], None],
+                 interval: float = 30.0,
+                 pattern: re.Pattern = ENTITY_FILENAME_PATTERN,
+                 use_events: bool = True,
+                 full_check_every: int = 10):
+        """
+        :param on_change: Called with the list of new or modified paths and the list of removed paths.
+        :param interval: Seconds between polls of the background thread when polling. 0 disables the background
+            thread, also for events.
+        :param pattern: Only files with names matching the pattern are watched.
+        :param use_events: If True and watchdog is installed, changes are reported by the operating system instead
+            of polling.
+        :param full_check_every: Every how many polls every known file is stat-ed.
+        """
+        self.on_change = on_change
+        self.interval = interval
+        self.pattern = pattern
+        self.use_events = use_events
+        self.full_check_every = full_check_every
+
+        self.roots: list[str] = []
+        # Modification time of every directory and the files and subdirectories found when it was last listed.
+        self._dirs: dict[str, tuple[int, list[str], list[str]]] = {}
+        # Modification time and size of every watched file.
+        self._files: dict[str, tuple[int, int]] = {}
+
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self._observer = None
+        self._watches = {}
+        # Files and directories named by events since they were last looked at.
+        self._event_files: set[str] = set()
+        self._event_dirs: set[str] = set()
+        self._events = threading.Event()
+
+    @property
+    def uses_events(self) -> bool:
+        """
+        True if changes are being reported by the operating system.
+        """
+        return self._observer is not None
+
+    def add_root(self, directory: Union[str, Path]) -> None:
+        """
+        Starts watching a directory and all of its subdirectories. The current state of its files is recorded
+        without reporting them as changes. Directories inside a watched root are already watched, roots inside the
+        new directory are replaced by it.
+        """
+        directory = str(directory)
+        with self._lock:
+            if any(Path(directory).is_relative_to(root) for root in self.roots):
+                return
+            for root in [root for root in self.roots if Path(root).is_relative_to(directory)]:
+                self.roots.remove(root)
+                if self._observer is not None and root in self._watches:
+                    self._observer.unschedule(self._watches.pop(root))
+            self.roots.append(directory)
+            changed, removed = [], []
+            self._scan_dir(directory, changed, removed)
+            for path in changed:
+                self._record(path)
+            if self._observer is not None:
+                self._schedule(directory)
+
+    def acknowledge(self, path: Union[str, Path]) -> None:
+        """
+        Records the current state of a file so that a change made by this process is not reported.
+        """
+        path = str(path)
+        with self._lock:
+            self._record(path)
+            # The directory is listed again on the next poll anyway if a new file was created in it.
+
+    def find(self, prefix: str) -> list[str]:
+        """
+        Returns the watched files whose name starts with prefix, as of the last time their directory was listed.
+        Does not touch the filesystem.
+        """
+        with self._lock:
+            return [path for _, _, files in self._dirs.values() for path in files
+                    if os.path.basename(path).startswith(prefix)]
+
+    def poll(self, check_files: bool = True) -> tuple[list[str], list[str]]:
+        """
+        Checks every watched directory for changes and calls `on_change` if there are any.
+
+        :param check_files: If False, only the files of directories that changed are stat-ed. Files modified in
+            place, without being renamed or created, are not found then.
+        :return: Tuple with the list of new or modified paths and the list of removed paths.
+        """
+        with self._lock:
+            changed, removed = [], []
+            for root in self.roots:
+                self._scan_dir(root, changed, removed)
+
+            if check_files:
+                seen = set(changed).union(removed)
+                for path in list(self._files.keys()):
+                    if path not in seen:
+                        self._check_file(path, changed, removed)
+
+            return self._report(changed, removed)
+
+    def start(self) -> None:
+        """
+        Starts reporting changes on a background thread.
+        """
+        if self._thread is not None or self.interval <= 0:
+            return
+        self._stop.clear()
+
+        target = self._run
+        if self.use_events and Observer is not None:
+            try:
+                self._observer = Observer()
+                with self._lock:
+                    for root in self.roots:
+                        self._schedule(root)
+                self._observer.start()
+                target = self._run_events
+            except Exception as e:
+                # For example when the limit of inotify watches of the system is reached.
+                print(f"Could not watch the lair for events, polling every {self.interval} seconds instead "
+                      f"exception: \n{e}")
+                self._observer = None
+                self._watches = {}
+
+        self._thread = threading.Thread(target=target, name='LairWatcher', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._events.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+            self._watches = {}
+        self._thread.join()
+        self._thread = None
+
+    def _run(self) -> None:
+        polls = 0
+        while not self._stop.wait(self.interval):
+            polls += 1
+            try:
+                self.poll(check_files=polls % self.full_check_every == 0)
+            except Exception as e:
+                print(f"Error while checking the lair for changes exception: \n{e}")
+
+    def _run_events(self) -> None:
+        while not self._stop.is_set():
+            self._events.wait()
+            if self._stop.wait(EVENTS_DELAY):
+                return
+            try:
+                self.process_events()
+            except Exception as e:
+                print(f"Error while checking the lair for changes exception: \n{e}")
+
+    def _schedule(self, root: str) -> None:
+        self._watches[root] = self._observer.schedule(_EventHandler(self), root, recursive=True)
+
+    def _notify(self, paths: list[str], is_directory: bool) -> None:
+        with self._lock:
+            for path in paths:
+                if is_directory:
+                    self._event_dirs.add(path)
+                elif self.pattern.match(os.path.basename(path)):
+                    self._event_files.add(path)
+                # Files and directories removed or moved are only reported as non directory events by some systems.
+                elif path in self._dirs:
+                    self._event_dirs.add(path)
+            self._events.set()
+
+    def process_events(self) -> tuple[list[str], list[str]]:
+        """
+        Looks at the files and directories named by the events received so far and calls `on_change` if any of them
+        changed. Called by the background thread, can also be called synchronously.
+
+        :return: Tuple with the list of new or modified paths and the list of removed paths.
+        """
+        with self._lock:
+            self._events.clear()
+            files, self._event_files = self._event_files, set()
+            directories, self._event_dirs = self._event_dirs, set()
+
+            changed, removed = [], []
+            # Parents first, so that a new tree of directories is only listed once.
+            for directory in sorted(directories, key=len):
+                if directory in self._dirs and os.path.isdir(directory):
+                    continue
+                self._directory_changed(directory, changed, removed)
+            seen = set(changed).union(removed)
+            for path in files:
+                if path not in seen:
+                    self._check_file(path, changed, removed)
+
+            return self._report(changed, removed)
+
+    def _report(self, changed: list[str], removed: list[str]) -> tuple[list[str], list[str]]:
+        for path in changed:
+            self._record(path)
+        for path in removed:
+            self._files.pop(path, None)
+
+        if len(changed) > 0 or len(removed) > 0:
+            self.on_change(changed, removed)
+        return changed, removed
+
+    def _record(self, path: str) -> None:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self._files.pop(path, None)
+            return
+        self._files[path] = (stat.st_mtime_ns, stat.st_size)
+
+    def _check_file(self, path: str, changed: list[str], removed: list[str]) -> None:
+        """
+        Stats a file and adds it to changed if it is new or was modified, to removed if it disappeared.
+        """
+        parent = os.path.dirname(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            if path in self._files:
+                removed.append(path)
+                if parent in self._dirs and path in self._dirs[parent][2]:
+                    self._dirs[parent][2].remove(path)
+            return
+        if self._files.get(path) != (stat.st_mtime_ns, stat.st_size):
+            changed.append(path)
+        if parent in self._dirs and path not in self._dirs[parent][2]:
+            self._dirs[parent][2].append(path)
+
+    def _directory_changed(self, directory: str, changed: list[str], removed: list[str]) -> None:
+        """
+        Lists a directory created, removed or moved after its parent was listed, and updates its parent.
+        """
+        if not any(Path(directory).is_relative_to(root) for root in self.roots):
+            return
+        parent = os.path.dirname(directory)
+        subdirs = self._dirs[parent][1] if parent in self._dirs else None
+        if os.path.isdir(directory):
+            self._scan_dir(directory, changed, removed)
+            if subdirs is not None and directory not in subdirs:
+                subdirs.append(directory)
+        else:
+            self._forget_dir(directory, removed)
+            if subdirs is not None and directory in subdirs:
+                subdirs.remove(directory)
+
+    def _scan_dir(self, directory: str, changed: list[str], removed: list[str]) -> None:
+        """
+        Walks the directory tree, only listing the directories whose modification time changed. Files that appear in
+        a listed directory or were replaced in it are added to changed, files that disappeared to removed.
+        """
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            self._forget_dir(directory, removed)
+            return
+
+        previous = self._dirs.get(directory)
+        if previous is not None and previous[0] == mtime:
+            subdirs = previous[1]
+        else:
+            files, subdirs = [], []
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                        elif self.pattern.match(entry.name):
+                            files.append(entry.path)
+            except OSError:
+                self._forget_dir(directory, removed)
+                return
+
+            old_files = set(previous[2]) if previous is not None else set()
+            for path in files:
+                if path not in old_files and path not in self._files:
+                    changed.append(path)
+                # Files written by renaming a new file over them change the directory too.
+                elif path in self._files:
+                    self._check_file(path, changed, removed)
+            for path in old_files.difference(files):
+                removed.append(path)
+
+            if previous is not None:
+                for subdir in set(previous[1]).difference(subdirs):
+                    self._forget_dir(subdir, removed)
+
+            self._dirs[directory] = (mtime, subdirs, files)
+
+        for subdir in subdirs:
+            self._scan_dir(subdir, changed, removed)
+
+    def _forget_dir(self, directory: str, removed: list[str]) -> None:
+        previous = self._dirs.pop(directory, None)
+        if previous is None:
+            return
+        removed.extend(previous[2])
+        for subdir in previous[1]:
+            self._forget_dir(subdir, removed)
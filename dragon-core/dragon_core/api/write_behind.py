@@ -0,0 +1,138 @@
+"""
+Delayed writing of entities to disk.
+
+The frontend saves text blocks every few seconds while the user types. Instead of writing the TOML file of the entity
+on every save, the write is scheduled and all the saves to the same entity that arrive close to each other end up in a
+single write.
+"""
+import time
+import threading
+from typing import Callable, Optional
+
+from dragon_core.utils import write_batch
+
+
+class WriteBehindScheduler:
+    """
+    Schedules writes of entities by ID. An entity is written once no new write was scheduled for it during
+    `quiet_period` seconds, or at the latest `max_delay` seconds after the first write that is still pending.
+    Writes happen on a background thread that calls `flush` with the ID of the entity.
+    """
+
+    def __init__(self, flush: Callable[[str], None], quiet_period: float = 1.0, max_delay: float = 5.0):
+        """
+        :param flush: Function that writes the entity with the given ID.
+        :param quiet_period: Seconds without new changes after which an entity is written.
+        :param max_delay: Maximum seconds a change waits before being written.
+        """
+        self.flush = flush
+        self.quiet_period = quiet_period
+        self.max_delay = max_delay
+
+        # ID of every entity waiting to be written with the time of its first and of its last pending change.
+        self._pending: dict[str, tuple[float, float]] = {}
+        # IDs of the entities being written. They count as pending until their write is on disk.
+        self._in_flight: set[str] = set()
+        self._cond = threading.Condition()
+        self._stopped = False
+
+        self._thread = threading.Thread(target=self._run, name='WriteBehindScheduler', daemon=True)
+        self._thread.start()
+
+    def schedule(self, ID: str) -> None:
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError("The scheduler is stopped")
+            now = time.monotonic()
+            first, _ = self._pending.get(ID, (now, now))
+            self._pending[ID] = (first, now)
+            self._cond.notify_all()
+
+    def is_pending(self, ID: str) -> bool:
+        return ID in self._pending or ID in self._in_flight
+
+    def discard(self, ID: str, written_at: Optional[float] = None) -> None:
+        """
+        Drops the pending write of an entity, used when the entity was written some other way.
+
+        :param written_at: The `time.monotonic()` at which the entity started being written. Changes scheduled after
+            it might not be in what was written, so the pending write is kept for them.
+        """
+        with self._cond:
+            times = self._pending.get(ID)
+            if times is not None and (written_at is None or times[1] <= written_at):
+                del self._pending[ID]
+
+    def flush_all(self) -> None:
+        """
+        Writes every pending entity right away.
+        """
+        with self._cond:
+            IDs = list(self._pending.keys())
+            self._pending.clear()
+            self._in_flight.update(IDs)
+        self._flush(IDs)
+
+    def stop(self) -> None:
+        """
+        Stops the background thread after writing every pending entity.
+        """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._thread.join()
+        self.flush_all()
+
+    def _due(self, now: float) -> tuple[list[str], Optional[float]]:
+        due = []
+        next_due = None
+        for ID, (first, last) in self._pending.items():
+            due_at = min(last + self.quiet_period, first + self.max_delay)
+            if due_at <= now:
+                due.append(ID)
+            elif next_due is None or due_at < next_due:
+                next_due = due_at
+        for ID in due:
+            del self._pending[ID]
+        self._in_flight.update(due)
+        return due, next_due
+
+    def _flush(self, IDs: list[str]) -> None:
+        written = []
+        failed = []
+        try:
+            # Entities that are due at the same time are synced to disk together.
+            with write_batch():
+                for ID in IDs:
+                    try:
+                        self.flush(ID)
+                        written.append(ID)
+                    except Exception as e:
+                        print(f"Error writing entity {ID}, trying again later. exception: \n{e}")
+                        failed.append(ID)
+        except Exception as e:
+            print(f"Error syncing entities {IDs} to disk, trying again later. exception: \n{e}")
+            failed += written
+            written = []
+
+        with self._cond:
+            # Entities stay pending until they are on disk, so they are never evicted with unwritten changes.
+            self._in_flight.difference_update(IDs)
+            now = time.monotonic()
+            for ID in failed:
+                first, last = self._pending.get(ID, (now, now))
+                self._pending[ID] = (first, last)
+            if len(failed) > 0:
+                self._cond.notify_all()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return
+                due, next_due = self._due(time.monotonic())
+                if len(due) == 0:
+                    timeout = None if next_due is None else max(0.0, next_due - time.monotonic())
+                    self._cond.wait(timeout)
+                    continue
+            self._flush(due)
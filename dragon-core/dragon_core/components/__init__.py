@@ -1,4 +1,5 @@
 from .param import Parameter
+from .version_history import VersionHistory
 from .content_blocks import ContentBlock, SupportedContentBlockType, create_text_block, create_image_block, create_image_link_block
 from .comments import Comment, Reply, create_comment
 from .table import Table
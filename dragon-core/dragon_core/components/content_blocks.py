@@ -8,6 +8,7 @@ from typing import Union, Tuple, List, Any
 
 from ..utils import create_timestamp
 from .table import Table
+from .version_history import VersionHistory
 
 
 
@@ -33,7 +34,8 @@ class ContentBlock:
     - creation_user: The user that originally created the content block.
     - creation_time: Timestamp of the creation of the content block.
     - deleted: A boolean indicating if the content block has been deleted.
-    - content: A list holding every modified content.
+    - content: A list holding every modified content. For text blocks this is a `VersionHistory`, which stores the
+        versions as deltas.
     - dates: A list of timestamps of the content block.
     - authors: A list of users that have modified the content block.
     - block_type: The type of the content block. This is an instance of SupportedContentBlockType.
@@ -47,6 +49,10 @@ class ContentBlock:
     authors: List[str]
     block_type: SupportedContentBlockType
 
+    def __post_init__(self):
+        if self.block_type == SupportedContentBlockType.text and not isinstance(self.content, VersionHistory):
+            self.content = VersionHistory(self.content)
+
     def modify(self, content: Union[str, tuple[Path, str]], user: str) -> None:
         """
         Modify the content_block.
@@ -75,14 +81,23 @@ class ContentBlock:
         """
         return self.content[-1], self.authors[-1], self.dates[-1]
 
-    def to_dict(self) -> dict:
+    def to_dict(self, full_history: bool = False) -> dict:
         """
         Convert the ContentBlock to a dictionary suitable for JSON serialization.
+
+        :param full_history: If True, every version of a text block is written in full. Otherwise, text blocks with
+            more than one version are written as `{"versions": [...]}` with the keyframes and deltas of their
+            `VersionHistory`, which is how they are stored on disk.
         """
 
         serialized_content = self.content
         if self.block_type == SupportedContentBlockType.image:
             serialized_content = [(str(content[0]), content[1]) for content in self.content]
+        elif isinstance(self.content, VersionHistory):
+            if full_history or len(self.content) == 1:
+                serialized_content = list(self.content)
+            else:
+                serialized_content = {'versions': self.content.encoded()}
 
         return {
             'ID': self.ID,
@@ -103,6 +118,8 @@ class ContentBlock:
         data['block_type'] = SupportedContentBlockType(data['block_type'])
         if data['block_type'] == SupportedContentBlockType.image:
             data['content'] = [(Path(content[0]), content[1]) for content in data['content']]
+        elif isinstance(data['content'], dict):
+            data['content'] = VersionHistory.from_encoded(data['content']['versions'])
         return cls(**data)
 
     def __str__(self):
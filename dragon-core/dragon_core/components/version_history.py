@@ -0,0 +1,149 @@
+"""
+Compact storage of the versions of a text content block.
+
+Text blocks get a new version every time they are saved, and most saves only change a few characters. Instead of
+keeping every version in full, a `VersionHistory` keeps a full copy (keyframe) every `KEYFRAME_INTERVAL` versions and,
+for the versions in between, only the part that changed from the previous version:
+
+```
+["first version", [5, 8, " edited"], [21, 0, "!"], ...]
+```
+
+A delta `[prefix, suffix, inserted]` means that the new version keeps the first `prefix` and the last `suffix`
+characters of the previous one and has `inserted` in between. Old versions are only decoded when they are asked for,
+the latest one is always kept decoded.
+"""
+from typing import Iterable, Union
+from collections.abc import MutableSequence
+
+
+def _delta(old: str, new: str) -> list:
+    """
+    Returns the delta that turns old into new.
+    """
+    limit = min(len(old), len(new))
+    prefix = 0
+    while prefix < limit and old[prefix] == new[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < limit - prefix and old[len(old) - 1 - suffix] == new[len(new) - 1 - suffix]:
+        suffix += 1
+    return [prefix, suffix, new[prefix:len(new) - suffix]]
+
+
+def _apply(old: str, delta: list) -> str:
+    prefix, suffix, inserted = delta
+    return old[:prefix] + inserted + old[len(old) - suffix:]
+
+
+class VersionHistory(MutableSequence):
+    """
+    List of the versions of a text content block, stored as keyframes and deltas. Behaves like a list of strings.
+
+    Appending a version and reading the latest one are O(1) on the number of versions. Reading an older version
+    decodes at most `KEYFRAME_INTERVAL` deltas. Any other modification of the list re-encodes the whole history.
+    """
+
+    # A full copy of the text is stored every this many versions.
+    KEYFRAME_INTERVAL = 32
+
+    def __init__(self, versions: Iterable[str] = ()):
+        # Keyframes are stored as strings and deltas as lists.
+        self._entries: list[Union[str, list]] = []
+        self._latest = None
+        for version in versions:
+            self.append(version)
+
+    @classmethod
+    def from_encoded(cls, entries: list) -> 'VersionHistory':
+        """
+        Creates the history from the entries returned by `encoded`.
+        """
+        history = cls()
+        history._entries = list(entries)
+        if len(history._entries) > 0:
+            history._latest = history._decode(len(history._entries) - 1)
+        return history
+
+    def encoded(self) -> list:
+        """
+        Returns the keyframes and deltas of the history, ready to be serialized to JSON.
+        """
+        return list(self._entries)
+
+    def _decode(self, index: int) -> str:
+        # Walk back to the closest keyframe and apply the deltas after it.
+        start = index
+        while not isinstance(self._entries[start], str):
+            start -= 1
+        text = self._entries[start]
+        for delta in self._entries[start + 1:index + 1]:
+            text = _apply(text, delta)
+        return text
+
+    def _normalize(self, index: int) -> int:
+        if index < 0:
+            index += len(self._entries)
+        if index < 0 or index >= len(self._entries):
+            raise IndexError("version index out of range")
+        return index
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self._entries)))]
+        index = self._normalize(index)
+        if index == len(self._entries) - 1:
+            return self._latest
+        return self._decode(index)
+
+    def __iter__(self):
+        text = None
+        for entry in self._entries:
+            text = entry if isinstance(entry, str) else _apply(text, entry)
+            yield text
+
+    def append(self, version: str) -> None:
+        if len(self._entries) % self.KEYFRAME_INTERVAL == 0:
+            self._entries.append(version)
+        else:
+            self._entries.append(_delta(self._latest, version))
+        self._latest = version
+
+    def __setitem__(self, index, value) -> None:
+        if not isinstance(index, slice) and self._normalize(index) == len(self._entries) - 1:
+            # Replacing the latest version only needs its own entry re-encoded.
+            last = self._entries.pop()
+            previous = None if isinstance(last, str) else self._decode(len(self._entries) - 1)
+            self._entries.append(value if previous is None else _delta(previous, value))
+            self._latest = value
+            return
+        versions = list(self)
+        versions[index] = value
+        self._rebuild(versions)
+
+    def __delitem__(self, index) -> None:
+        versions = list(self)
+        del versions[index]
+        self._rebuild(versions)
+
+    def insert(self, index: int, value: str) -> None:
+        versions = list(self)
+        versions.insert(index, value)
+        self._rebuild(versions)
+
+    def _rebuild(self, versions: list[str]) -> None:
+        self._entries = []
+        self._latest = None
+        for version in versions:
+            self.append(version)
+
+    def __eq__(self, other):
+        if isinstance(other, (VersionHistory, list)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return f"VersionHistory({list(self)!r})"
@@ -42,4 +42,114 @@ def verify_and_parse_config(config_path: Path) -> dict:
         raise ValueError("host not found in config file")
     ret['host'] = c['host']
 
+    # Number of processes used to read the lair at startup. If not specified, the number of cpus is used.
+    if 'loading_workers' in c:
+        ret['loading_workers'] = c['loading_workers']
+    else:
+        ret['loading_workers'] = None
+
+    # Keeps a binary snapshot of the loaded lair next to the lair file so restarts only read the files that changed.
+    if 'index_snapshot' in c:
+        ret['index_snapshot'] = c['index_snapshot']
+    else:
+        ret['index_snapshot'] = True
+
+    # Only loads the skeleton of the entities in the libraries at startup, full entities are read on first access.
+    if 'lazy_loading' in c:
+        ret['lazy_loading'] = c['lazy_loading']
+    else:
+        ret['lazy_loading'] = False
+
+    # Memory budget in megabytes for the entities loaded on demand when lazy loading is on.
+    if 'lazy_memory_budget_mb' in c:
+        ret['lazy_memory_budget_mb'] = c['lazy_memory_budget_mb']
+    else:
+        ret['lazy_memory_budget_mb'] = 256
+
+    # Seconds between checks of the lair and bucket directories for files written by other processes.
+    if 'watch_interval' in c:
+        ret['watch_interval'] = c['watch_interval']
+    else:
+        ret['watch_interval'] = 30.0
+
+    # If true, the operating system reports changes in the lair and bucket directories when watchdog is installed,
+    # instead of polling them every watch_interval seconds.
+    if 'watch_events' in c:
+        ret['watch_events'] = c['watch_events']
+    else:
+        ret['watch_events'] = True
+
+    # Appends small changes (content blocks, comments, bookmarks) to a journal instead of rewriting the TOML files.
+    if 'journal' in c:
+        ret['journal'] = c['journal']
+    else:
+        ret['journal'] = False
+
+    # Size in megabytes of the journal after which its changes are written into the TOML files.
+    if 'journal_compaction_mb' in c:
+        ret['journal_compaction_mb'] = c['journal_compaction_mb']
+    else:
+        ret['journal_compaction_mb'] = 16
+
+    # Seconds without new changes after which an edited entity is written to disk. 0 writes every change immediately.
+    if 'write_behind_delay' in c:
+        ret['write_behind_delay'] = c['write_behind_delay']
+    else:
+        ret['write_behind_delay'] = 0.0
+
+    # Maximum seconds an edit waits before being written to disk when write_behind_delay is not 0.
+    if 'write_behind_max_delay' in c:
+        ret['write_behind_max_delay'] = c['write_behind_max_delay']
+    else:
+        ret['write_behind_max_delay'] = 5.0
+
+    # If True, entities reference each other by UUID in their TOML files, with the manifest of the lair mapping UUIDs
+    # to files. Renaming an entity then only rewrites its own file.
+    if 'id_references' in c:
+        ret['id_references'] = c['id_references']
+    else:
+        ret['id_references'] = False
+
+    # Maximum size in megabytes of the cache holding the serialized entities sent to the frontend.
+    if 'response_cache_mb' in c:
+        ret['response_cache_mb'] = c['response_cache_mb']
+    else:
+        ret['response_cache_mb'] = 64
+
+    # Maximum size in megabytes of the html renders of analysis notebooks kept in the resource path.
+    if 'render_cache_mb' in c:
+        ret['render_cache_mb'] = c['render_cache_mb']
+    else:
+        ret['render_cache_mb'] = 512
+
+    # Maximum size in megabytes of the downscaled copies of instance images kept in the resource path.
+    if 'thumbnail_cache_mb' in c:
+        ret['thumbnail_cache_mb'] = c['thumbnail_cache_mb']
+    else:
+        ret['thumbnail_cache_mb'] = 256
+
+    # Number of processes rendering the notebooks added to instances in the background. 0 disables it.
+    if 'render_workers' in c:
+        ret['render_workers'] = c['render_workers']
+    else:
+        ret['render_workers'] = 2
+
+    # Maximum number of notebooks waiting to be rendered in the background.
+    if 'render_queue_size' in c:
+        ret['render_queue_size'] = c['render_queue_size']
+    else:
+        ret['render_queue_size'] = 64
+
+    # Where the entities are stored: "toml" for a TOML file per entity or "sqlite" for a single SQLite database.
+    if 'storage' in c:
+        ret['storage'] = c['storage']
+    else:
+        ret['storage'] = "toml"
+
+    # Path of the SQLite database. If not present, _dragon_lair.sqlite next to the lair file is used.
+    if 'sqlite_path' in c:
+        ret['sqlite_path'] = c['sqlite_path']
+    else:
+        ret['sqlite_path'] = None
+
     return ret
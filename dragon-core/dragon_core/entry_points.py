@@ -13,6 +13,8 @@ from starlette.middleware.cors import CORSMiddleware
 
 from dragon_core.config import verify_and_parse_config
 from dragon_core.scripts.new_env_creator import create_simulated_env
+from dragon_core.scripts.rewrite_lair import rewrite_lair
+from dragon_core.scripts.convert_lair import import_lair, export_lair
 
 
 def start_server(config_path: Path) -> None:
@@ -58,6 +60,42 @@ def dragon_ignite_fire_sack() -> None:
     start_server(config_path)
 
 
+def dragon_rewrite_lair() -> None:
+    parser = argparse.ArgumentParser(description='Rewrites every entity file of a lair with the current file layout. '
+                                                 'Stop the server before running it.')
+    parser.add_argument("lair_directory", type=str, help="Directory holding the _dragon_lair.toml file")
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="Number of processes used to read the files, the number of cpus by default")
+
+    args = parser.parse_args()
+
+    count = rewrite_lair(Path(args.lair_directory), max_workers=args.workers)
+    print(f"Rewrote {count} entity files")
+
+
+def dragon_convert_lair() -> None:
+    parser = argparse.ArgumentParser(description='Moves the entities of a lair between its TOML files and a SQLite '
+                                                 'database. Stop the server before running it.')
+    parser.add_argument("lair_directory", type=str, help="Directory holding the _dragon_lair.toml file")
+    parser.add_argument("--to", type=str, choices=["sqlite", "toml"], required=True,
+                        help="Storage the entities are moved to")
+    parser.add_argument("-d", "--database", type=str, default=None,
+                        help="Path of the SQLite database, _dragon_lair.sqlite in the lair directory by default")
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="Number of processes used to read the TOML files, the number of cpus by default")
+    parser.add_argument("--id-references", action="store_true",
+                        help="When writing TOML files, reference other entities by UUID instead of by path")
+
+    args = parser.parse_args()
+
+    if args.to == "sqlite":
+        count = import_lair(Path(args.lair_directory), db_path=args.database, max_workers=args.workers)
+        print(f"Imported {count} entities into the database")
+    else:
+        count = export_lair(Path(args.lair_directory), db_path=args.database, id_references=args.id_references)
+        print(f"Exported {count} entities into TOML files")
+
+
 def start_debug_server() -> None:
 
     # Replace path to config
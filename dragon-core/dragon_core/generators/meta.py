@@ -100,6 +100,16 @@ def generate_class(config_path: Union[str, Path],
         f.write(schema_output)
 
 
+def entity_class(type_name: str) -> type:
+    """
+    Returns the class of an entity from the name of its type, as stored in the `type` field of its file.
+
+    :param type_name: The class name of the entity.
+    """
+    module = importlib.import_module(f'dragon_core.modules.{type_name.lower()}')
+    return getattr(module, type_name)
+
+
 # TODO: Have error catching this for when there are more than a single item
 def read_from_TOML(path: Union[str, Path]) -> object:
     """
@@ -113,8 +123,7 @@ def read_from_TOML(path: Union[str, Path]) -> object:
 
     data = data[next(iter(data))]
 
-    module = importlib.import_module(f'dragon_core.modules.{data["type"].lower()}')
-    _class = getattr(module, data.pop('type'))
+    _class = entity_class(data.pop('type'))
 
     if len(data['content_blocks']) > 0:
         data['content_blocks'] = [ContentBlock.from_dict(json.loads(x)) for x in data['content_blocks']]
@@ -127,6 +136,27 @@ def read_from_TOML(path: Union[str, Path]) -> object:
     return ins
 
 
+def read_skeleton_from_TOML(path: Union[str, Path]) -> dict:
+    """
+    Reads only the fields of a TOML file needed to place the entity in the lair. Content blocks and comments are not
+    parsed and no class is instantiated.
+
+    :param path: The path to the TOML file.
+    :return: Dictionary with the ID, name, type, parent, children and deleted fields of the entity.
+    """
+    with open(str(path), 'rb') as f:
+        data = toml.load(f)
+
+    data = data[next(iter(data))]
+
+    return dict(ID=data['ID'],
+                name=data['name'],
+                type=data['type'],
+                parent=data.get('parent', ''),
+                children=data.get('children', []),
+                deleted=data.get('deleted', False))
+
+
 def generate_all_classes() -> None:
     """
     Helper class to create all the classes in the schemas directory.
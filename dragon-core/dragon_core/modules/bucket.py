@@ -4,11 +4,12 @@ The customization of this entity is still to be determined, so for now I will be
 """
 import re
 from pathlib import Path
-from typing import Optional, Union
+from typing import Callable, Optional, Union
 
 import tomlkit
 
 from dragon_core.modules.entity import Entity
+from dragon_core.utils import atomic_write_text
 from dragon_core.generators.meta import read_from_TOML
 
 
@@ -39,10 +40,10 @@ class Bucket(Entity):
     def get_instance_uuid(self, instance_path):
         return self.path_to_uuid[instance_path]
 
-    def to_TOML(self, path: Optional[Union[str, Path]] = None):
+    def to_TOML(self, path: Optional[Union[str, Path]] = None, translate_ref: Optional[Callable[[str], str]] = None):
 
         if hasattr(super(), 'to_TOML'):
-            doc = super().to_TOML()
+            doc = super().to_TOML(translate_ref=translate_ref)
             vals = doc[self.name]
         else:
             doc = tomlkit.document()
@@ -63,11 +64,22 @@ class Bucket(Entity):
                 path = path.joinpath(self.name + '.toml')
             if self.START_FILENAME_WITH_ID and not path.name.startswith(self.ID[:8] + '_'):
                 path = path.parent.joinpath(self.ID[:8] + '_' + path.name)
-            with open(path, 'w') as f:
-                f.write(doc.as_string())
+            atomic_write_text(path, doc.as_string())
 
         return doc
 
+    def to_dict(self, translate_ref: Optional[Callable[[str], str]] = None, full_history: bool = False) -> dict:
+
+        if hasattr(super(), 'to_dict'):
+            vals = super().to_dict(translate_ref=translate_ref, full_history=full_history)
+        else:
+            vals = {}
+
+        vals['type'] = self.__class__.__name__
+        vals['path_to_uuid'] = {str(k): str(v) for k, v in self.path_to_uuid.items()}
+
+        return vals
+
     def suggest_data(self, query: str = "", min_threshold: int = 5):
         matched_paths = {}
         pattern = re.compile(query)
@@ -2,11 +2,12 @@ import uuid
 from typing import List
 from pathlib import Path
 from dataclasses import dataclass
+from contextlib import contextmanager
 
-from tomlkit import document, comment, table, dump, load, aot, item
+from tomlkit import document, comment, table, load, aot, item
 
 from .library import Library
-from dragon_core.utils import create_timestamp
+from dragon_core.utils import create_timestamp, atomic_write_text
 
 
 @dataclass
@@ -70,9 +71,17 @@ class DragonLair:
     * Entities instantiate the Libraries themselves.
     * Entities loads the entities by calling the insert_instance method.
 
+    Changes are only written when something that is stored in the file changes, once per change or once per
+    `hold_writes` block. Only the latest `MAX_MODIFIED_TIMESTAMPS` modification timestamps are kept in the file, older
+    ones are appended to `_dragon_lair_history.log`, one per line.
+
     """
 
     _FILENAME: str = '_dragon_lair.toml'
+    _HISTORY_FILENAME: str = '_dragon_lair_history.log'
+
+    # Number of modification timestamps kept in the lair file.
+    MAX_MODIFIED_TIMESTAMPS: int = 10
 
     def __init__(self, dir_path: Path):
         """
@@ -103,6 +112,12 @@ class DragonLair:
 
         # If the file is not there, create it.
         self.file_path = self.dir_path.joinpath(self._FILENAME)
+        self.history_path = self.dir_path.joinpath(self._HISTORY_FILENAME)
+
+        # True if something changed since the file was last written.
+        self._dirty = False
+        # Number of open hold_writes blocks, the file is only written once all of them end.
+        self._holds = 0
 
         if not self.file_path.exists():
             self.start_fresh_lair()
@@ -133,8 +148,7 @@ class DragonLair:
         else:
             raise FileExistsError(f'directory {self.file_path} already exists, cannot create lair')
 
-        with open(self.file_path, 'w') as f:
-            dump(doc, f)
+        atomic_write_text(self.file_path, doc.as_string())
 
         self.ID = ID
         self.creation_timestamp = meta['creation_timestamp']
@@ -178,42 +192,42 @@ class DragonLair:
             raise ValueError(f"Bucket with name {name} already exists in the lair")
 
         self.buckets[name] = bucket_path
-        self.to_file()
+        self._changed()
 
     def delete_bucket(self, name):
         if name not in self.buckets:
             raise ValueError(f"Bucket with name {name} does not exist in the lair")
 
         del self.buckets[name]
-        self.to_file()
+        self._changed()
 
     def add_user(self, email, name, profile_color=""):
         if email in self.users:
             raise ValueError(f"User with email {email} already exists in the lair")
 
         self.users[email] = User(email=email, name=name, profile_color=profile_color)
-        self.to_file()
+        self._changed()
 
     def delete_user(self, email):
         if email not in self.users:
             raise ValueError(f"User with email {email} does not exist in the lair")
 
         del self.users[email]
-        self.to_file()
+        self._changed()
 
     def set_user_color(self, email: str, color: str):
         if email not in self.users:
             raise ValueError(f"User with email {email} does not exist in the lair")
 
         self.users[email].profile_color = color
-        self.to_file()
+        self._changed()
 
     def insert_library_instance(self, library_instance: Library):
+        # The instance is not stored in the file, so nothing needs to be written.
         for lib in self.libraries:
             if lib.ID == library_instance.ID:
                 lib.instance = library_instance
                 break
-        self.to_file()
 
     def add_library(self, lib: Library, lib_path: Path):
         if lib.name in self.libraries:
@@ -224,7 +238,7 @@ class DragonLair:
                                             deleted=False,
                                             path=lib_path,
                                             instance=lib))
-        self.to_file()
+        self._changed()
 
     def delete_library(self, lib_name: str):
         if lib_name not in self.libraries:
@@ -235,7 +249,41 @@ class DragonLair:
                 lib.deleted = True
                 break
 
-        self.to_file()
+        self._changed()
+
+    @contextmanager
+    def hold_writes(self):
+        """
+        Groups every change made in the block into a single write of the file when the block ends.
+        """
+        self._holds += 1
+        try:
+            yield
+        finally:
+            self._holds -= 1
+            self.save()
+
+    def save(self):
+        """
+        Writes the file if anything changed since it was last written and no `hold_writes` block is open.
+        """
+        if self._dirty and self._holds == 0:
+            self.to_file()
+
+    def _changed(self):
+        self._dirty = True
+        self.save()
+
+    def _roll_timestamps(self):
+        """
+        Moves the oldest modification timestamps to the history log so that only the latest ones stay in the file.
+        """
+        excess = len(self.modified_timestamps) - self.MAX_MODIFIED_TIMESTAMPS
+        if excess <= 0:
+            return
+        with open(self.history_path, 'a') as f:
+            f.write(''.join(timestamp + '\n' for timestamp in self.modified_timestamps[:excess]))
+        self.modified_timestamps = self.modified_timestamps[excess:]
 
     def to_file(self):
         doc = document()
@@ -245,6 +293,7 @@ class DragonLair:
         meta['ID'] = self.ID
         meta['creation_timestamp'] = self.creation_timestamp
         self.modified_timestamps.append(create_timestamp())  # Add another modification timestamp
+        self._roll_timestamps()
         meta['modified_timestamps'] = self.modified_timestamps
         doc.add("meta", meta)
 
@@ -271,8 +320,8 @@ class DragonLair:
             tab['path'] = str(library.path)
             doc.add(library.name, tab)
 
-        with open(self.file_path, 'w') as f:
-            dump(doc, f)
+        atomic_write_text(self.file_path, doc.as_string())
+        self._dirty = False
 
 
 
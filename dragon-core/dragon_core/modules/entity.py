@@ -1,10 +1,11 @@
+import json
 import uuid
 import tomlkit
 
 from pathlib import Path
-from typing import List, Tuple, Optional, Union
+from typing import Callable, List, Tuple, Optional, Union
 
-from dragon_core.utils import create_timestamp
+from dragon_core.utils import create_timestamp, atomic_write_text, json_to_toml_literal
 from dragon_core.components import (ContentBlock,
                                     SupportedContentBlockType,
                                     Table, create_text_block,
@@ -107,16 +108,18 @@ class Entity(object):
         else:
             self.end_time = end_time
 
-    def to_TOML(self, path: Optional[Union[str,Path]] = None):
+    def to_TOML(self, path: Optional[Union[str,Path]] = None, translate_ref: Optional[Callable[[str], str]] = None):
 
         if hasattr(super(), 'to_TOML'):
-            doc = super().to_TOML()
+            doc = super().to_TOML(translate_ref=translate_ref)
             vals = doc[self.name]
         else:
             doc = tomlkit.document()
             vals = tomlkit.table()
 
         vals['type'] = self.__class__.__name__
+        # Function used to write the references to other entities, their IDs are written as they are by default.
+        ref = str if translate_ref is None else translate_ref
         vals['user'] = self.user
         vals['ID'] = self.ID
         
@@ -124,25 +127,26 @@ class Entity(object):
         
         vals['previous_names'] = self.previous_names
         
-        vals['parent'] = str(self.parent)
+        vals['parent'] = ref(self.parent)
         
         vals['deleted'] = self.deleted
         
         vals['description'] = self.description
         
-        # Same as children, we want to save the str version of every content block, not the object.
-        vals['content_blocks'] = [str(block) for block in self.content_blocks]
+        # Same as children, we want to save the str version of every content block, not the object. The JSON of every
+        # block and comment is written as a literal string, which is much cheaper to write and parse than a basic one.
+        vals['content_blocks'] = self._json_array(self.content_blocks)
 
-        vals['comments'] = [str(comment) for comment in self.comments]
+        vals['comments'] = self._json_array(self.comments)
 
         # We want to save the str version of every child, not the object.
-        vals['children'] = [str(child) for child in self.children]
+        vals['children'] = [ref(child) for child in self.children]
 
         vals['edit_times'] = self.edit_times
 
         vals['params'] = self.params
         
-        vals['data_buckets'] = self.data_buckets
+        vals['data_buckets'] = [ref(bucket) for bucket in self.data_buckets]
         
         vals['bookmarked'] = self.bookmarked
         
@@ -161,11 +165,66 @@ class Entity(object):
                 path = path.joinpath(self.name + '.toml')
             if self.START_FILENAME_WITH_ID and not path.name.startswith(self.ID[:8] + '_'):
                 path = path.parent.joinpath(self.ID[:8] + '_' + path.name)
-            with open(path, 'w') as f:
-                f.write(doc.as_string())
+            atomic_write_text(path, doc.as_string())
 
         return doc
 
+    def to_dict(self, translate_ref: Optional[Callable[[str], str]] = None, full_history: bool = False) -> dict:
+        """
+        Returns the same fields `to_TOML` writes as plain Python objects, ready for JSON. Content blocks and comments
+        are dictionaries instead of JSON strings. Much cheaper than building the TOML document when nothing is written.
+
+        :param translate_ref: Optional function applied to the references to other entities, like in `to_TOML`.
+        :param full_history: If True, every version of the text blocks is included in full, see `ContentBlock.to_dict`.
+        """
+        if hasattr(super(), 'to_dict'):
+            vals = super().to_dict(translate_ref=translate_ref, full_history=full_history)
+        else:
+            vals = {}
+
+        vals['type'] = self.__class__.__name__
+        ref = str if translate_ref is None else translate_ref
+        vals['user'] = self.user
+        vals['ID'] = self.ID
+        vals['name'] = self.name
+        vals['previous_names'] = list(self.previous_names)
+        vals['parent'] = ref(self.parent)
+        vals['deleted'] = self.deleted
+        vals['description'] = self.description
+        vals['content_blocks'] = [block.to_dict(full_history=full_history) for block in self.content_blocks]
+        vals['comments'] = [comment.to_dict() for comment in self.comments]
+        vals['children'] = [ref(child) for child in self.children]
+        vals['edit_times'] = list(self.edit_times)
+        vals['params'] = list(self.params)
+        vals['data_buckets'] = [ref(bucket) for bucket in self.data_buckets]
+        vals['bookmarked'] = self.bookmarked
+        vals['start_time'] = self.start_time
+        vals['end_time'] = self.end_time
+        vals['order'] = [[str(x[0]), str(x[1]), str(x[2])] for x in self.order]
+
+        return vals
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Entity':
+        """
+        Creates the entity from a dictionary returned by `to_dict`. Content blocks and comments can also be the JSON
+        strings stored in the TOML files.
+        """
+        data = dict(data)
+        data.pop('type', None)
+        data['content_blocks'] = [ContentBlock.from_dict(json.loads(block) if isinstance(block, str) else dict(block))
+                                  for block in data.get('content_blocks', [])]
+        data['comments'] = [Comment.from_dict(json.loads(comment) if isinstance(comment, str) else dict(comment))
+                            for comment in data.get('comments', [])]
+        return cls(**data)
+
+    @staticmethod
+    def _json_array(items) -> tomlkit.items.Array:
+        array = tomlkit.array()
+        array.extend(json_to_toml_literal(str(item)) for item in items)
+        array.multiline(len(array) > 0)
+        return array
+
     def __str__(self):
         return str(self.to_TOML())
 
@@ -1,8 +1,9 @@
 import tomlkit
 
-from typing import List, Tuple, Dict, Optional, Union
+from typing import Callable, List, Tuple, Dict, Optional, Union
 from pathlib import Path as Path
 from dragon_core.modules.entity import Entity as Entity
+from dragon_core.utils import atomic_write_text
 
 from labcore.data.datadict_storage import datadict_from_hdf5
 
@@ -56,10 +57,10 @@ class Instance(Entity):
         # if len(data) != 0:
         #     self.populate_itself()
 
-    def to_TOML(self, path: Optional[Union[str,Path]] = None):
+    def to_TOML(self, path: Optional[Union[str,Path]] = None, translate_ref: Optional[Callable[[str], str]] = None):
 
         if hasattr(super(), 'to_TOML'):
-            doc = super().to_TOML()
+            doc = super().to_TOML(translate_ref=translate_ref)
             vals = doc[self.name]
         else:
             doc = tomlkit.document()
@@ -89,11 +90,28 @@ class Instance(Entity):
                 path = path.joinpath(self.name + '.toml')
             if self.START_FILENAME_WITH_ID and not path.name.startswith(self.ID[:8] + '_'):
                 path = path.parent.joinpath(self.ID[:8] + '_' + path.name)
-            with open(path, 'w') as f:
-                f.write(doc.as_string())
+            atomic_write_text(path, doc.as_string())
 
         return doc
 
+    def to_dict(self, translate_ref: Optional[Callable[[str], str]] = None, full_history: bool = False) -> dict:
+
+        if hasattr(super(), 'to_dict'):
+            vals = super().to_dict(translate_ref=translate_ref, full_history=full_history)
+        else:
+            vals = {}
+
+        vals['type'] = self.__class__.__name__
+        vals['version'] = self.version
+        vals['stored_params'] = [str(x) for x in self.stored_params]
+        vals['tags'] = self.tags
+        vals['images'] = [str(x) for x in self.images]
+        vals['data'] = [str(x) for x in self.data]
+        vals['data_structure'] = self.data_structure
+        vals['analysis'] = [str(x) for x in self.analysis]
+
+        return vals
+
     def __str__(self):
         return str(self.to_TOML())
 
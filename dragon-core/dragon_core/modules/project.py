@@ -1,15 +1,16 @@
 import tomlkit
 
 from pathlib import Path
-from typing import Optional, Union
+from typing import Callable, Optional, Union
 from dragon_core.modules.entity import Entity as Entity
+from dragon_core.utils import atomic_write_text
 
 
 class Project(Entity):
-    def to_TOML(self, path: Optional[Union[str,Path]] = None):
+    def to_TOML(self, path: Optional[Union[str,Path]] = None, translate_ref: Optional[Callable[[str], str]] = None):
 
         if hasattr(super(), 'to_TOML'):
-            doc = super().to_TOML()
+            doc = super().to_TOML(translate_ref=translate_ref)
             vals = doc[self.name]
         else:
             doc = tomlkit.document()
@@ -25,11 +26,21 @@ class Project(Entity):
                 path = path.joinpath(self.name + '.toml')
             if self.START_FILENAME_WITH_ID and not path.name.startswith(self.ID[:8] + '_'):
                 path = path.parent.joinpath(self.ID[:8] + '_' + path.name)
-            with open(path, 'w') as f:
-                f.write(doc.as_string())
+            atomic_write_text(path, doc.as_string())
 
         return doc
 
+    def to_dict(self, translate_ref: Optional[Callable[[str], str]] = None, full_history: bool = False) -> dict:
+
+        if hasattr(super(), 'to_dict'):
+            vals = super().to_dict(translate_ref=translate_ref, full_history=full_history)
+        else:
+            vals = {}
+
+        vals['type'] = self.__class__.__name__
+
+        return vals
+
     def __str__(self):
         return str(self.to_TOML())
 
@@ -0,0 +1,108 @@
+"""
+Moves the entities of a lair between the TOML files and the SQLite database.
+
+Entities keep the paths of their TOML files as their location in the database, so the `_dragon_lair.toml` file is valid
+for both and a lair can be converted back and forth. The server should not be running while converting.
+"""
+from pathlib import Path
+from typing import Optional, Union
+
+from dragon_core.utils import atomic_write_text
+from dragon_core.modules import DragonLair
+from dragon_core.api.loader import resolve_references
+from dragon_core.api.manifest import Manifest, MANIFEST_FILENAME
+from dragon_core.api.storage import StorageBackend, TOMLStorage, SQLiteStorage, SQLITE_FILENAME
+
+
+def _load_lair(lair: DragonLair, storage: StorageBackend) -> dict:
+    root_paths = [str(bucket_path) for bucket_path in lair.buckets.values()]
+    root_paths += [str(dragon_library.path) for dragon_library in lair.libraries]
+    return storage.load(root_paths)
+
+
+def _open_lair(lair_directory: Path) -> DragonLair:
+    if not lair_directory.joinpath(DragonLair._FILENAME).is_file():
+        raise FileNotFoundError(f"No lair found at {lair_directory}")
+    return DragonLair(lair_directory)
+
+
+def import_lair(lair_directory: Union[str, Path],
+                db_path: Optional[Union[str, Path]] = None,
+                max_workers: Optional[int] = None) -> int:
+    """
+    Copies every entity of a lair from its TOML files into the SQLite database. The TOML files are not modified.
+
+    :param lair_directory: The directory holding the `_dragon_lair.toml` file.
+    :param db_path: Path of the database. If None, `_dragon_lair.sqlite` in the lair directory is used.
+    :param max_workers: Maximum number of processes used to read the files. If None, the number of cpus is used.
+    :return: The number of entities imported.
+    """
+    lair_directory = Path(lair_directory)
+    lair = _open_lair(lair_directory)
+    manifest = Manifest(lair_directory.joinpath(MANIFEST_FILENAME))
+    if db_path is None:
+        db_path = lair_directory.joinpath(SQLITE_FILENAME)
+
+    loaded = _load_lair(lair, TOMLStorage(lair_directory,
+                                          max_workers=max_workers,
+                                          use_snapshot=False,
+                                          manifest=manifest.paths))
+
+    # The database only holds references by ID.
+    index = {loaded_file.entity.ID: loaded_file.entity for loaded_file in loaded.values()}
+    path_to_uuid = {path: loaded_file.entity.ID for path, loaded_file in loaded.items()}
+    for ID, field, ref in resolve_references(index, path_to_uuid):
+        print(f"Entity {ID} has a reference to an entity that is not in the lair ({field}): {ref}")
+
+    storage = SQLiteStorage(db_path)
+    try:
+        with storage.batch():
+            for path, loaded_file in loaded.items():
+                storage.write(loaded_file.entity, path)
+    finally:
+        storage.close()
+
+    return len(loaded)
+
+
+def export_lair(lair_directory: Union[str, Path],
+                db_path: Optional[Union[str, Path]] = None,
+                id_references: bool = False) -> int:
+    """
+    Writes every entity of a lair from the SQLite database into its TOML file. Existing files are overwritten.
+
+    :param lair_directory: The directory holding the `_dragon_lair.toml` file.
+    :param db_path: Path of the database. If None, `_dragon_lair.sqlite` in the lair directory is used.
+    :param id_references: If True, references between entities are written as UUIDs and the manifest of the lair is
+        updated. Otherwise they are written as paths.
+    :return: The number of entities exported.
+    """
+    lair_directory = Path(lair_directory)
+    lair = _open_lair(lair_directory)
+    if db_path is None:
+        db_path = lair_directory.joinpath(SQLITE_FILENAME)
+    if not Path(db_path).is_file():
+        raise FileNotFoundError(f"No database found at {db_path}")
+
+    storage = SQLiteStorage(db_path)
+    try:
+        loaded = _load_lair(lair, storage)
+    finally:
+        storage.close()
+
+    uuid_to_path = {loaded_file.entity.ID: path for path, loaded_file in loaded.items()}
+    translate_ref = None if id_references else lambda ref: uuid_to_path.get(ref, ref)
+
+    toml_storage = TOMLStorage(lair_directory, use_snapshot=False)
+    with toml_storage.batch():
+        for path, loaded_file in loaded.items():
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            # Written directly to the stored path, to_TOML could pick a different filename.
+            atomic_write_text(path, loaded_file.entity.to_TOML(translate_ref=translate_ref).as_string())
+
+        if id_references:
+            manifest = Manifest(lair_directory.joinpath(MANIFEST_FILENAME))
+            manifest.update(uuid_to_path)
+            manifest.save()
+
+    return len(loaded)
@@ -0,0 +1,42 @@
+"""
+Rewrites every entity file of a lair with the current layout of the TOML files.
+
+Files are read and written by the same version of dragon-core, so nothing but the layout changes: references are kept
+as they are written in every file and no edit timestamp is added. Useful after upgrading, to get files written by older
+versions into the layout that is fastest to load (content blocks and comments as literal strings, text block versions
+as deltas) without waiting for every entity to be edited.
+"""
+from pathlib import Path
+from typing import Optional, Union
+
+from dragon_core.utils import atomic_write_text, write_batch
+from dragon_core.modules import DragonLair
+from dragon_core.api.loader import load_entity_tree
+from dragon_core.api.manifest import Manifest, MANIFEST_FILENAME
+
+
+def rewrite_lair(lair_directory: Union[str, Path], max_workers: Optional[int] = None) -> int:
+    """
+    Rewrites every entity reachable from the libraries and buckets of the lair. The server should not be running.
+
+    :param lair_directory: The directory holding the `_dragon_lair.toml` file.
+    :param max_workers: Maximum number of processes used to read the files. If None, the number of cpus is used.
+    :return: The number of files rewritten.
+    """
+    lair_directory = Path(lair_directory)
+    if not lair_directory.joinpath(DragonLair._FILENAME).is_file():
+        raise FileNotFoundError(f"No lair found at {lair_directory}")
+
+    lair = DragonLair(lair_directory)
+    manifest = Manifest(lair_directory.joinpath(MANIFEST_FILENAME))
+
+    root_paths = [str(bucket_path) for bucket_path in lair.buckets.values()]
+    root_paths += [str(dragon_library.path) for dragon_library in lair.libraries]
+    loaded = load_entity_tree(root_paths, max_workers=max_workers, manifest=manifest.paths)
+
+    with write_batch():
+        for path, loaded_file in loaded.items():
+            # The document is written directly to the path it was read from, to_TOML could pick a different filename.
+            atomic_write_text(path, loaded_file.entity.to_TOML().as_string())
+
+    return len(loaded)
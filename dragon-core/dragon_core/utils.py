@@ -1,8 +1,15 @@
 """
 Module containing helpful functions that don't really fit anywhere else
 """
+import os
+import threading
 from pathlib import Path
+from contextlib import contextmanager
 from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, Union
+
+import tomlkit
 
 
 def create_timestamp() -> str:
@@ -15,6 +22,19 @@ def create_timestamp() -> str:
     return timestamp
 
 
+def json_to_toml_literal(json_text: str) -> tomlkit.items.String:
+    """
+    Wraps a JSON document in a TOML literal string (single quotes). Literal strings have no escape sequences, so they
+    are written and parsed without going through every character of the document like basic strings are. The
+    characters literal strings cannot hold only appear inside JSON strings, where they are replaced by the equivalent
+    JSON escape sequence. The JSON document read back from the file is the same.
+
+    :param json_text: A JSON document, as returned by `json.dumps`.
+    """
+    json_text = json_text.replace("'", "\\u0027").replace("\x7f", "\\u007f")
+    return tomlkit.string(json_text, literal=True)
+
+
 def delete_directory_contents(directory_path: Path, delete_only_toml: bool = False) -> None:
     """
     Deletes all files and subdirectories in a directory. if delete_only_toml is True, will only delete toml files in the
@@ -41,3 +61,180 @@ def delete_directory_contents(directory_path: Path, delete_only_toml: bool = Fal
                 delete_directory_contents(item)
                 # Delete empty subdirectory
                 item.rmdir()
+
+
+class _WriteBatch:
+    """
+    Files written by `atomic_write_text` inside a `write_batch` block, waiting for the block to end.
+    """
+
+    def __init__(self):
+        # Open temporary file with the path it replaces, in the order they were written.
+        self.files: list[tuple] = []
+        self.callbacks: list[Callable[[], None]] = []
+
+
+_BATCHES = threading.local()
+
+
+def _fsync_directory(directory: Path) -> None:
+    # Directories cannot be opened, and do not need to be synced, on Windows.
+    if os.name == 'nt':
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _commit(files: list[tuple], callbacks: list[Callable[[], None]]) -> None:
+    """
+    Makes the temporary files durable, moves them to their final paths and syncs every directory touched once.
+    """
+    try:
+        if len(files) == 1:
+            os.fsync(files[0][0].fileno())
+        elif len(files) > 1:
+            # Concurrent fsyncs are merged by the filesystem into a single flush of its journal.
+            with ThreadPoolExecutor(max_workers=min(len(files), 8)) as pool:
+                list(pool.map(lambda item: os.fsync(item[0].fileno()), files))
+    finally:
+        for f, _ in files:
+            f.close()
+
+    directories = {}
+    for f, path in files:
+        os.replace(f.name, path)
+        directories[path.parent] = None
+    for directory in directories:
+        _fsync_directory(directory)
+
+    for callback in callbacks:
+        callback()
+
+
+def atomic_write_text(path: Union[str, Path], text: str) -> None:
+    """
+    Writes text to a file without ever leaving a partially written file behind. The text is written to a temporary
+    file in the same directory, which is synced to disk and renamed over the target.
+
+    Inside a `write_batch` block the rename happens when the block ends, together with every other file written in it.
+
+    :param path: The file to write.
+    :param text: The contents of the file.
+    """
+    path = Path(path)
+    # The leading dot keeps the temporary file from looking like an entity to the watcher.
+    tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    f = open(tmp_path, 'w', encoding='utf-8')
+    try:
+        f.write(text)
+        f.flush()
+    except BaseException:
+        f.close()
+        os.remove(tmp_path)
+        raise
+
+    batch = getattr(_BATCHES, 'current', None)
+    if batch is None:
+        _commit([(f, path)], [])
+        return
+
+    # A file written twice in the same batch only keeps its last version.
+    for i, (previous, previous_path) in enumerate(batch.files):
+        if previous_path == path:
+            previous.close()
+            if previous.name != f.name:
+                os.remove(previous.name)
+            del batch.files[i]
+            break
+    batch.files.append((f, path))
+
+
+def after_write(callback: Callable[[], None]) -> None:
+    """
+    Calls callback once the files written so far are on disk: right away outside a `write_batch` block, when the
+    block ends inside one.
+    """
+    batch = getattr(_BATCHES, 'current', None)
+    if batch is None:
+        callback()
+    else:
+        batch.callbacks.append(callback)
+
+
+@contextmanager
+def write_batch() -> Iterator[None]:
+    """
+    Groups the files written with `atomic_write_text` in the block, so that all of them are synced to disk together
+    when it ends instead of one at a time. Nested blocks join the outermost one. Batches are per thread.
+
+    Files written before an exception in the block are still written, but the callbacks of `after_write` are dropped:
+    whatever the block failed to write, like a database transaction that was rolled back, must not be taken as written.
+    """
+    if getattr(_BATCHES, 'current', None) is not None:
+        yield
+        return
+
+    batch = _WriteBatch()
+    _BATCHES.current = batch
+    try:
+        yield
+    except BaseException:
+        _BATCHES.current = None
+        _commit(batch.files, [])
+        raise
+    _BATCHES.current = None
+    _commit(batch.files, batch.callbacks)
+
+
+class SharedLock:
+    """
+    A lock that any number of threads can hold in shared mode at the same time, or a single thread in exclusive mode.
+
+    The thread holding it exclusively can also take it in shared mode, and both modes are reentrant for it. A thread
+    holding it only in shared mode must not ask for it exclusively, it would wait for itself.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._shared = 0
+        self._owner = None
+        self._depth = 0
+
+    @contextmanager
+    def shared(self) -> Iterator[None]:
+        me = threading.get_ident()
+        with self._cond:
+            counted = self._owner != me
+            if counted:
+                while self._owner is not None:
+                    self._cond.wait()
+                self._shared += 1
+        try:
+            yield
+        finally:
+            if counted:
+                with self._cond:
+                    self._shared -= 1
+                    if self._shared == 0:
+                        self._cond.notify_all()
+
+    @contextmanager
+    def exclusive(self) -> Iterator[None]:
+        me = threading.get_ident()
+        with self._cond:
+            if self._owner != me:
+                while self._owner is not None or self._shared > 0:
+                    self._cond.wait()
+                self._owner = me
+            self._depth += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._owner = None
+                    self._cond.notify_all()
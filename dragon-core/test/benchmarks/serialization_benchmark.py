@@ -0,0 +1,81 @@
+"""
+Micro-benchmark of the serialization of a large entity for the API, through the TOML document (`to_TOML`), directly
+to Python objects (`to_dict`), and like `read_one` does after one block of the entity changed, with the JSON of the
+other blocks kept by a `BlockLinkCache`.
+
+Run it from the dragon-core directory:
+
+    python test/benchmarks/serialization_benchmark.py --blocks 200 --versions 20 --comments 50
+"""
+import json
+import timeit
+import argparse
+
+from dragon_core.modules import Project
+from dragon_core.components import create_text_block, create_comment
+from dragon_core.api.links import BlockLinkCache
+
+
+def create_large_entity(n_blocks: int, n_versions: int, n_comments: int) -> Project:
+    ent = Project(name='Large project', user='benchmark')
+    for i in range(n_blocks):
+        block = create_text_block(f"Paragraph {i} with some **markdown** and a [link](https://example.com).", 'benchmark')
+        for version in range(1, n_versions):
+            block.modify(block.content[-1] + f" Edit {version}.", 'benchmark')
+        ent.content_blocks.append(block)
+        ent.order.append((block.ID, "content_block", ""))
+    for i in range(n_comments):
+        ent.comments.append(create_comment(f"Comment {i}", ent.ID, ent.ID, 'benchmark'))
+    return ent
+
+
+def through_toml(ent: Project) -> str:
+    serialized = dict(ent.to_TOML()[ent.name])
+    serialized['content_blocks'] = [json.dumps(block.to_dict(full_history=True)) for block in ent.content_blocks]
+    return json.dumps(serialized)
+
+
+def through_dict(ent: Project) -> str:
+    serialized = ent.to_dict(full_history=True)
+    serialized['content_blocks'] = [json.dumps(block) for block in serialized['content_blocks']]
+    serialized['comments'] = [json.dumps(comment, ensure_ascii=False) for comment in serialized['comments']]
+    return json.dumps(serialized)
+
+
+def through_cache(ent: Project, cache: BlockLinkCache) -> str:
+    serialized = ent.to_dict()
+    serialized['content_blocks'] = [cache.encode(block, {}) for block in ent.content_blocks]
+    serialized['comments'] = [json.dumps(comment, ensure_ascii=False) for comment in serialized['comments']]
+    return json.dumps(serialized)
+
+
+def edit_and_serialize(ent: Project, cache: BlockLinkCache) -> str:
+    block = ent.content_blocks[0]
+    block.modify(block.content[-1] + " Edit.", 'benchmark')
+    return through_cache(ent, cache)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compares serializing an entity for the API with to_TOML and to_dict')
+    parser.add_argument("--blocks", type=int, default=200, help="Number of text blocks of the entity")
+    parser.add_argument("--versions", type=int, default=20, help="Number of versions of every text block")
+    parser.add_argument("--comments", type=int, default=50, help="Number of comments of the entity")
+    parser.add_argument("--repeat", type=int, default=20, help="Number of serializations timed for each method")
+    args = parser.parse_args()
+
+    ent = create_large_entity(args.blocks, args.versions, args.comments)
+    cache = BlockLinkCache()
+    assert json.loads(through_toml(ent)) == json.loads(through_dict(ent)) == json.loads(through_cache(ent, cache))
+
+    toml_time = min(timeit.repeat(lambda: through_toml(ent), number=1, repeat=args.repeat))
+    dict_time = min(timeit.repeat(lambda: through_dict(ent), number=1, repeat=args.repeat))
+    # Editing one block is part of the timing, it is much cheaper than serializing the entity.
+    cache_time = min(timeit.repeat(lambda: edit_and_serialize(ent, cache), number=1, repeat=args.repeat))
+    print(f"to_TOML: {toml_time * 1000:.2f} ms")
+    print(f"to_dict: {dict_time * 1000:.2f} ms")
+    print(f"to_dict, one block changed: {cache_time * 1000:.2f} ms")
+    print(f"speedup: {toml_time / dict_time:.1f}x, {toml_time / cache_time:.1f}x with kept blocks")
+
+
+if __name__ == '__main__':
+    main()
@@ -493,3 +493,67 @@ def test_post_entities_id_toggle_bookmark_wrong(client):
 
 
 
+
+
+def test_post_batch(client, root_entity):
+    root_file, root_entity = root_entity
+
+    operations = [
+        {'op': 'add_entity', 'ref': 'project',
+         'args': {'name': 'Batch project', 'type': 'Project', 'parent': root_entity['ID'], 'user': 'Smaug'}},
+        {'op': 'add_text_block', 'args': {'ID': {'ref': 'project'}, 'body': 'Written in a batch', 'user': 'Smaug'}},
+        {'op': 'toggle_bookmark', 'args': {'ID': {'ref': 'project'}}},
+    ]
+    ret = client.post('/api/batch', json={'operations': operations})
+    assert ret.status_code == 201
+
+    results = json.loads(ret.text)
+    assert [result['op'] for result in results] == ['add_entity', 'add_text_block', 'toggle_bookmark']
+    ID = results[0]['ID']
+
+    project_file = root_file.parent / f'{ID[:8]}_Batch project.toml'
+    with project_file.open('rb') as f:
+        entity = toml.load(f)
+    loaded_entity = entity[[x for x in entity.keys()][0]]
+    assert loaded_entity['bookmarked'] is True
+    assert len(loaded_entity['content_blocks']) == 1
+
+
+def test_post_batch_wrong_rolls_back(client, root_entity):
+    """
+    Test that nothing in the batch is applied when one of the operations fails.
+    """
+    root_file, root_entity = root_entity
+
+    operations = [
+        {'op': 'add_entity', 'ref': 'project',
+         'args': {'name': 'Rolled back project', 'type': 'Project', 'parent': root_entity['ID'], 'user': 'Smaug'}},
+        {'op': 'add_text_block', 'args': {'ID': '123', 'body': 'Never written', 'user': 'Smaug'}},
+    ]
+    ret = client.post('/api/batch', json={'operations': operations})
+    assert ret.status_code == 404
+
+    structure = client.get('/api/entities').json()
+    assert 'Rolled back project' not in [x['name'] for x in structure[0]['children']]
+    assert len(list(root_file.parent.glob('*_Rolled back project.toml'))) == 0
+
+
+def test_post_entities_wrong_under_child_is_not_indexed(client, root_entity):
+    """
+    Test that an entity the parent does not accept is neither added to the lair nor written.
+    """
+    root_file, root_entity = root_entity
+
+    new_entity_arguments = {
+        'name': 'Misplaced project',
+        'type': 'Project',
+        'parent': root_entity['ID'],
+        'user': 'Smaug',
+        'under_child': '123',
+    }
+    ret = client.post('/api/entities', json=new_entity_arguments)
+    assert ret.status_code == 404
+
+    structure = client.get('/api/entities').json()
+    assert 'Misplaced project' not in [x['name'] for x in structure[0]['children']]
+    assert len(list(root_file.parent.glob('*_Misplaced project.toml'))) == 0
@@ -0,0 +1,28 @@
+from dragon_core.utils import atomic_write_text, write_batch, after_write
+
+
+def test_batched_files_appear_together_when_the_batch_ends(tmp_path):
+
+    first = tmp_path.joinpath('first.toml')
+    second = tmp_path.joinpath('second.toml')
+    first.write_text('old')
+
+    written = []
+    with write_batch():
+        atomic_write_text(first, 'new')
+        atomic_write_text(second, 'a')
+        atomic_write_text(second, 'b')
+        after_write(lambda: written.append(second.read_text()))
+
+        # Nothing is replaced until the batch ends.
+        assert first.read_text() == 'old'
+        assert not second.exists()
+        assert written == []
+
+    assert first.read_text() == 'new'
+    assert written == ['b']
+    # No temporary files are left behind.
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['first.toml', 'second.toml']
+
+    atomic_write_text(first, 'newer')
+    assert first.read_text() == 'newer'
@@ -0,0 +1,56 @@
+import json
+
+from dragon_core.components import create_text_block
+from dragon_core.api.links import BlockLinkCache
+
+
+def test_block_links_are_parsed_once_per_version(tmp_path, monkeypatch):
+
+    image = tmp_path.joinpath('plot.png')
+    block = create_text_block(f"See [the plot]({image}) and [the notebook](lair/notebook.toml).", 'test_user')
+    cache = BlockLinkCache()
+
+    assert cache.new_images(block) == {str(image)}
+    assert cache.rewrite_latest(block, {'lair/notebook.toml': 'some-uuid'}) == \
+        f"See [the plot]({image}) and [the notebook](some-uuid)."
+
+    # Unchanged blocks are not parsed again.
+    monkeypatch.setattr('dragon_core.api.links.split_entity_links', None)
+    monkeypatch.setattr('dragon_core.api.links.linked_images', None)
+    assert cache.new_images(block) == set()
+    assert cache.rewrite_latest(block, {}) == block.content[-1]
+    monkeypatch.undo()
+
+    # Only the images of the new versions are returned.
+    other_image = tmp_path.joinpath('other.jpg')
+    block.modify(block.content[-1] + f" Also [this one]({other_image}) and [the plot]({image}).", 'test_user')
+    assert cache.new_images(block) == {str(other_image)}
+
+
+def test_block_link_cache_is_bounded():
+
+    blocks = [create_text_block(f"Block [{i}](lair/notebook.toml).", 'test_user') for i in range(3)]
+    cache = BlockLinkCache(max_blocks=2)
+    for block in blocks:
+        cache.new_images(block)
+    assert len(cache) == 2
+
+    # Dropped blocks are parsed again the next time they are used.
+    assert cache.rewrite_latest(blocks[0], {'lair/notebook.toml': 'some-uuid'}) == "Block [0](some-uuid)."
+    cache.discard([blocks[0].ID, blocks[2].ID])
+    assert len(cache) == 0
+
+
+def test_block_json_is_kept_until_the_block_changes():
+
+    block = create_text_block("See [the notebook](lair/notebook.toml).", 'test_user')
+    cache = BlockLinkCache()
+
+    encoded = cache.encode(block, {'lair/notebook.toml': 'some-uuid'})
+    assert json.loads(encoded)['content'] == ["See [the notebook](some-uuid)."]
+    assert cache.encode(block, {'lair/notebook.toml': 'some-uuid'}) is encoded
+    assert json.loads(cache.encode(block)) == block.to_dict(full_history=True)
+
+    block.modify("Nothing linked anymore.", 'test_user')
+    assert json.loads(cache.encode(block, {}))['content'] == ["See [the notebook](lair/notebook.toml).",
+                                                              "Nothing linked anymore."]
@@ -0,0 +1,30 @@
+import os
+
+from dragon_core.api.caches import DiskCache
+
+
+def test_disk_cache_is_reloaded_and_evicts_the_least_recently_used(tmp_path):
+
+    directory = tmp_path.joinpath('cache')
+    cache = DiskCache(directory, max_bytes=30, suffix='.bin')
+    for key in ['a', 'b', 'c']:
+        cache.put_bytes(key, key.encode('utf-8') * 10)
+    assert len(cache) == 3 and cache.size == 30
+
+    # A file that is read becomes the most recently used one, the least recently used is deleted past max_bytes.
+    assert cache.get_bytes('a') == b'a' * 10
+    cache.put_bytes('d', b'd' * 10)
+    assert 'b' not in cache
+    assert not directory.joinpath('b.bin').exists()
+
+    # A new cache finds the files on disk, ordered by their modification time.
+    for age, key in enumerate(['d', 'a', 'c']):
+        os.utime(directory.joinpath(f'{key}.bin'), ns=(0, 10**18 - age * 10**9))
+    reloaded = DiskCache(directory, max_bytes=20, suffix='.bin')
+    assert len(reloaded) == 2
+    assert 'c' not in reloaded
+    assert reloaded.get_bytes('d') == b'd' * 10
+
+    # Files starting with a dot are temporary files, they are ignored.
+    directory.joinpath('.e.bin').write_bytes(b'e')
+    assert len(DiskCache(directory, max_bytes=20, suffix='.bin')) == 2
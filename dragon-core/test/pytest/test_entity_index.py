@@ -0,0 +1,92 @@
+from dragon_core.api.index import EntityIndex, EntitySkeleton
+from dragon_core.api.write_behind import WriteBehindScheduler
+
+
+class FakeEntity:
+    def __init__(self, ID):
+        self.ID = ID
+        self.name = 'entity ' + ID
+        self.parent = ''
+        self.children = []
+        self.deleted = False
+
+
+def test_skeletons_are_materialized_on_access_and_evicted_over_budget():
+
+    loaded = []
+
+    def loader(ID):
+        loaded.append(ID)
+        return FakeEntity(ID), 100
+
+    index = EntityIndex(loader=loader, memory_budget=250, can_evict=lambda ID: ID != 'pinned')
+    for ID in ['pinned', 'a', 'b', 'c']:
+        index.add_skeleton(EntitySkeleton(ID=ID, name='skeleton ' + ID, type='Project', parent=''))
+
+    # Navigating the index never loads anything.
+    assert 'a' in index
+    assert len(index) == 4
+    assert index.entity_type('a') == 'Project'
+    assert index.skeleton('a').name == 'skeleton a'
+    assert loaded == []
+
+    for ID in ['pinned', 'a', 'b']:
+        index[ID].name = 'changed ' + ID
+    assert loaded == ['pinned', 'a', 'b']
+
+    # Going over the budget evicts the least recently used entity that is allowed to be evicted.
+    index['c']
+    assert index.is_materialized('pinned')
+    assert not index.is_materialized('a')
+    assert index.skeleton('a').name == 'changed a'
+
+    index['a']
+    assert loaded == ['pinned', 'a', 'b', 'c', 'a']
+
+
+def test_entities_with_delayed_writes_are_not_evicted():
+
+    written = []
+    scheduler = WriteBehindScheduler(flush=written.append, quiet_period=60, max_delay=60)
+    index = EntityIndex(loader=lambda ID: (FakeEntity(ID), 100),
+                        memory_budget=150,
+                        can_evict=lambda ID: not scheduler.is_pending(ID))
+    try:
+        for ID in ['edited', 'a', 'b']:
+            index.add_skeleton(EntitySkeleton(ID=ID, name='skeleton ' + ID, type='Project', parent=''))
+
+        edited = index['edited']
+        edited.name = 'edited in memory'
+        scheduler.schedule('edited')
+
+        # Both loads go over the budget, only the entity without pending writes can be evicted.
+        index['a']
+        index['b']
+        assert index.is_materialized('edited')
+        assert not index.is_materialized('a')
+        assert index['edited'] is edited
+        assert written == []
+    finally:
+        scheduler.stop()
+    assert written == ['edited']
+
+
+def test_pinned_entities_are_not_evicted_while_they_are_changed():
+
+    index = EntityIndex(loader=lambda ID: (FakeEntity(ID), 100), memory_budget=1)
+    for ID in ['edited', 'a', 'b']:
+        index.add_skeleton(EntitySkeleton(ID=ID, name='skeleton ' + ID, type='Project', parent=''))
+
+    # A request holds the entity and changes it while other requests load entities over the budget.
+    with index.pinned(['edited']):
+        edited = index['edited']
+        index['a']
+        edited.name = 'edited in memory'
+        index['b']
+        assert index['edited'] is edited
+        assert not index.is_materialized('a')
+
+    # Once unpinned, the entity can be evicted again.
+    index['a']
+    assert not index.is_materialized('edited')
+    assert index.skeleton('edited').name == 'edited in memory'
@@ -0,0 +1,35 @@
+import json
+
+from dragon_core.modules import Project, Bucket
+from dragon_core.components import create_text_block, create_comment
+
+
+def test_to_dict_matches_to_TOML():
+
+    project = Project(name='project', user='test_user')
+    block = create_text_block("first version", 'test_user')
+    block.modify("second version", 'test_user')
+    project.content_blocks.append(block)
+    project.order.append((block.ID, "content_block", ""))
+    project.comments.append(create_comment("a comment", project.ID, project.ID, 'test_user'))
+
+    from_toml = json.loads(json.dumps(dict(project.to_TOML()[project.name])))
+    from_dict = project.to_dict()
+    from_dict['content_blocks'] = [json.dumps(block) for block in from_dict['content_blocks']]
+    from_dict['comments'] = [json.dumps(comment) for comment in from_dict['comments']]
+    from_dict = json.loads(json.dumps(from_dict))
+
+    assert from_dict.keys() == from_toml.keys()
+    for key in from_dict.keys():
+        if key in ('content_blocks', 'comments'):
+            assert [json.loads(x) for x in from_dict[key]] == [json.loads(x) for x in from_toml[key]]
+        else:
+            assert from_dict[key] == from_toml[key]
+
+
+def test_from_dict_round_trip():
+
+    bucket = Bucket(name='bucket', user='test_user', path_to_uuid={'instance.toml': 'an-id'})
+    loaded = Bucket.from_dict(json.loads(json.dumps(bucket.to_dict())))
+    assert loaded.to_dict() == bucket.to_dict()
+    assert loaded.path_to_uuid == {'instance.toml': 'an-id'}
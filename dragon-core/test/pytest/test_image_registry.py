@@ -0,0 +1,44 @@
+import os
+
+from PIL import Image
+
+from dragon_core.api.images import ImageRegistry, probe_image_size
+
+
+def test_probing_image_headers(tmp_path):
+
+    Image.new('RGB', (31, 17)).save(tmp_path.joinpath('img.png'))
+    Image.new('RGB', (64, 48)).save(tmp_path.joinpath('img.jpg'))
+    tmp_path.joinpath('broken.png').write_bytes(b'not an image')
+
+    assert probe_image_size(tmp_path.joinpath('img.png')) == (31, 17)
+    assert probe_image_size(tmp_path.joinpath('img.jpg')) == (64, 48)
+    assert probe_image_size(tmp_path.joinpath('broken.png')) is None
+
+
+def test_registry_only_updates_changed_images(tmp_path):
+
+    img_path = tmp_path.joinpath('img.png')
+    Image.new('RGB', (10, 20)).save(img_path)
+    registry_path = tmp_path.joinpath('registry.json')
+
+    registry = ImageRegistry(registry_path)
+    record = registry.refresh(img_path)
+    assert (record.width, record.height) == (10, 20)
+    registry.save()
+    assert registry_path.is_file()
+
+    # A new registry reads the records back and does not need to probe the image again.
+    registry = ImageRegistry(registry_path)
+    assert registry.refresh(img_path) == record
+    assert not registry._dirty
+
+    Image.new('RGB', (30, 40)).save(img_path)
+    stat = os.stat(img_path)
+    os.utime(img_path, ns=(stat.st_atime_ns, record.mtime_ns + 1_000_000_000))
+    record = registry.refresh(img_path)
+    assert (record.width, record.height) == (30, 40)
+
+    os.remove(img_path)
+    assert registry.refresh(img_path) is None
+    assert registry.get(img_path) is None
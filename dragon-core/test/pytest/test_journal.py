@@ -0,0 +1,87 @@
+from types import SimpleNamespace
+
+import pytest
+
+from dragon_core.components import create_text_block, create_comment
+from dragon_core.api.journal import Journal, apply_ops, block_op, version_op, comment_op, set_op
+
+
+def test_replaying_the_journal_is_idempotent(tmp_path):
+
+    journal = Journal(tmp_path.joinpath('_dragon_lair.journal'))
+
+    block = create_text_block('first', 'user')
+    journal.append('entity', [block_op(block), set_op('order', [(block.ID, 'content_block', True)])])
+    block.modify('second', 'user')
+    journal.append('entity', [version_op(block)])
+    journal.append('entity', [comment_op(create_comment('a comment', 'entity', 'entity', 'user'))])
+
+    ent = SimpleNamespace(content_blocks=[], comments=[], order=[], edit_times=[])
+    ops = journal.pending_ops()['entity']
+    apply_ops(ent, ops)
+    apply_ops(ent, ops)
+
+    assert ent.content_blocks[0].content == ['first', 'second']
+    assert len(ent.comments) == 1
+    assert ent.order == [(block.ID, 'content_block', True)]
+
+    # After a checkpoint and a trim only the later changes are left.
+    offset = journal.flush()
+    journal.checkpoint('entity')
+    journal.append('other', [set_op('bookmarked', True)])
+    journal.trim(offset)
+    assert list(journal.pending_ops().keys()) == ['other']
+
+    journal.close()
+
+
+def test_changes_appended_while_writing_survive_the_checkpoint(tmp_path):
+
+    journal = Journal(tmp_path.joinpath('_dragon_lair.journal'))
+    journal.append('entity', [set_op('bookmarked', True)])
+
+    # The entity is serialized here, then changed again before its checkpoint is appended.
+    serialized_at = journal.last_seq
+    journal.append('entity', [set_op('bookmarked', False)])
+    journal.checkpoint('entity', upto=serialized_at)
+    assert journal.pending_ops() == {'entity': [set_op('bookmarked', False)]}
+    journal.close()
+
+    # Sequence numbers keep growing after reopening the journal.
+    journal = Journal(tmp_path.joinpath('_dragon_lair.journal'))
+    assert journal.last_seq == serialized_at + 2
+    journal.checkpoint('entity')
+    assert journal.pending_ops() == {}
+    journal.close()
+
+
+class _FailingFile:
+    """
+    Journal file that writes half of the next data it gets and then fails, like a full disk.
+    """
+
+    def __init__(self, file):
+        self.file = file
+
+    def write(self, data):
+        self.file.write(data[:len(data) // 2])
+        raise OSError("No space left on device")
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+
+def test_failed_write_only_fails_the_lost_entries(tmp_path):
+
+    journal = Journal(tmp_path.joinpath('_dragon_lair.journal'))
+    journal.append('kept', [set_op('bookmarked', True)])
+
+    journal._file = _FailingFile(journal._file)
+    with pytest.raises(OSError):
+        journal.append('lost', [set_op('bookmarked', True)])
+
+    # The journal keeps working and the half written entry does not corrupt the next one.
+    journal.append('later', [set_op('bookmarked', True)])
+    journal.flush()
+    assert sorted(journal.pending_ops().keys()) == ['kept', 'later']
+    journal.close()
@@ -0,0 +1,88 @@
+import os
+import threading
+
+import pytest
+
+from dragon_core.api.watcher import LairWatcher
+
+
+def test_watcher_reports_only_external_changes(tmp_path):
+
+    nested = tmp_path.joinpath('bucket', 'measurement')
+    nested.mkdir(parents=True)
+    existing = tmp_path.joinpath('abcdef12_library.toml')
+    existing.write_text('a')
+    tmp_path.joinpath('not_an_entity.toml').write_text('a')
+
+    changes = []
+    watcher = LairWatcher(on_change=lambda changed, removed: changes.append((sorted(changed), sorted(removed))))
+    watcher.add_root(tmp_path)
+    assert watcher.poll() == ([], [])
+
+    new_instance = nested.joinpath('12345678_instance.toml')
+    new_instance.write_text('a')
+    own_write = tmp_path.joinpath('aaaaaaaa_own.toml')
+    own_write.write_text('a')
+    watcher.acknowledge(own_write)
+    existing.write_text('modified')
+
+    changed, removed = watcher.poll()
+    assert sorted(changed) == sorted([str(new_instance), str(existing)])
+    assert removed == []
+
+    os.remove(new_instance)
+    changed, removed = watcher.poll()
+    assert changed == [] and removed == [str(new_instance)]
+    assert len(changes) == 2
+
+
+def test_watcher_finds_files_replaced_without_checking_every_file(tmp_path):
+
+    existing = tmp_path.joinpath('abcdef12_library.toml')
+    existing.write_text('a')
+    watcher = LairWatcher(on_change=lambda changed, removed: None)
+    watcher.add_root(tmp_path)
+
+    # Files are written by renaming a temporary file over them, which changes the directory.
+    temporary = tmp_path.joinpath('abcdef12_library.toml.tmp')
+    temporary.write_text('replaced')
+    os.replace(temporary, existing)
+    assert watcher.poll(check_files=False) == ([str(existing)], [])
+    assert watcher.poll(check_files=False) == ([], [])
+
+
+def test_watcher_only_keeps_the_outermost_roots(tmp_path):
+
+    bucket = tmp_path.joinpath('bucket')
+    bucket.mkdir()
+    watcher = LairWatcher(on_change=lambda changed, removed: None)
+    watcher.add_root(bucket)
+    watcher.add_root(tmp_path)
+    watcher.add_root(bucket)
+    assert watcher.roots == [str(tmp_path)]
+
+
+def test_watcher_reports_changes_from_events(tmp_path):
+    pytest.importorskip('watchdog')
+
+    changes = []
+    event = threading.Event()
+
+    def on_change(changed, removed):
+        changes.append((sorted(changed), sorted(removed)))
+        event.set()
+
+    watcher = LairWatcher(on_change=on_change)
+    watcher.add_root(tmp_path)
+    watcher.start()
+    try:
+        assert watcher.uses_events
+        nested = tmp_path.joinpath('measurement')
+        nested.mkdir()
+        new_instance = nested.joinpath('12345678_instance.toml')
+        new_instance.write_text('a')
+        assert event.wait(5)
+        assert str(new_instance) in [path for changed, _ in changes for path in changed]
+        assert watcher.find('12345678_') == [str(new_instance)]
+    finally:
+        watcher.stop()
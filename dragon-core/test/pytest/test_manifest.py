@@ -0,0 +1,49 @@
+from dragon_core.api.manifest import Manifest
+
+
+def test_manifest_is_only_written_when_it_changes(tmp_path):
+
+    path = tmp_path.joinpath('_dragon_lair_manifest.json')
+    manifest = Manifest(path)
+    manifest.set('an-id', tmp_path.joinpath('anid1234_entity.toml'))
+    manifest.save()
+
+    loaded = Manifest(path)
+    assert loaded.translate('an-id') == str(tmp_path.joinpath('anid1234_entity.toml'))
+    # Unknown references, like paths, are returned as they are.
+    assert loaded.translate('some/path.toml') == 'some/path.toml'
+
+    mtime = path.stat().st_mtime_ns
+    loaded.set('an-id', tmp_path.joinpath('anid1234_entity.toml'))
+    loaded.save()
+    assert path.stat().st_mtime_ns == mtime
+
+    loaded.remove('an-id')
+    loaded.save()
+    assert len(Manifest(path)) == 0
+
+
+def test_manifest_changes_are_appended(tmp_path, monkeypatch):
+
+    path = tmp_path.joinpath('_dragon_lair_manifest.json')
+    manifest = Manifest(path)
+    for i in range(3):
+        manifest.set(f'id-{i}', tmp_path.joinpath(f'entity_{i}.toml'))
+        manifest.save()
+    manifest.remove('id-0')
+    manifest.save()
+    assert len(path.read_text().splitlines()) == 4
+    assert Manifest(path).paths == {'id-1': str(tmp_path.joinpath('entity_1.toml')),
+                                    'id-2': str(tmp_path.joinpath('entity_2.toml'))}
+
+    # Once the appended lines outnumber the entries the file is rewritten in a single line.
+    monkeypatch.setattr('dragon_core.api.manifest._MIN_COMPACTION_LINES', 2)
+    manifest.set('id-3', tmp_path.joinpath('entity_3.toml'))
+    manifest.save()
+    assert len(path.read_text().splitlines()) == 1
+    assert len(Manifest(path)) == 3
+
+    read_only = Manifest(path, read_only=True)
+    read_only.set('id-5', tmp_path.joinpath('entity_5.toml'))
+    read_only.save()
+    assert 'id-5' not in Manifest(path)
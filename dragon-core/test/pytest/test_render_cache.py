@@ -0,0 +1,75 @@
+import gzip
+import time
+from concurrent.futures import Future
+
+import nbformat
+from nbformat.v4 import new_notebook, new_markdown_cell
+
+from dragon_core.api.renders import RenderCache, RenderQueue, stream_html, RENDERED, NOT_RENDERED, MISSING
+
+
+def test_render_cache_reuses_renders_until_the_notebook_changes(tmp_path):
+
+    nb_path = tmp_path.joinpath('analysis.ipynb')
+    nbformat.write(new_notebook(cells=[new_markdown_cell("first analysis")]), nb_path)
+
+    cache = RenderCache(tmp_path.joinpath('renders'))
+    html = cache.render(nb_path)
+    assert "first analysis" in html
+    assert len(cache) == 1
+    assert cache.render(nb_path) == html
+
+    # A notebook that changes gets a new key, its old render is left to be evicted.
+    key = cache.key(nb_path)
+    nbformat.write(new_notebook(cells=[new_markdown_cell("second analysis, a bit longer")]), nb_path)
+    assert cache.key(nb_path) != key
+    assert "second analysis" in cache.render(nb_path)
+    assert len(cache) == 2
+
+
+def test_render_queue_renders_into_the_cache(tmp_path):
+
+    nb_path = tmp_path.joinpath('analysis.ipynb')
+    nbformat.write(new_notebook(cells=[new_markdown_cell("queued analysis")]), nb_path)
+
+    cache = RenderCache(tmp_path.joinpath('renders'))
+    queue = RenderQueue(cache, max_workers=1, max_queued=1)
+    try:
+        assert queue.submit(nb_path)
+        assert "queued analysis" in queue.render(nb_path)
+        # The render is stored by a callback right after it finishes.
+        deadline = time.monotonic() + 10
+        while len(queue) > 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert cache.key(nb_path) in cache
+        assert queue.status()['completed'] == 1
+    finally:
+        queue.stop()
+
+
+def test_render_state_and_streaming(tmp_path):
+
+    nb_path = tmp_path.joinpath('analysis.ipynb')
+    nbformat.write(new_notebook(cells=[new_markdown_cell("streamed analysis")]), nb_path)
+
+    queue = RenderQueue(RenderCache(tmp_path.joinpath('renders')), max_workers=0)
+    assert queue.state(tmp_path.joinpath('missing.ipynb')) == MISSING
+    assert queue.state(nb_path) == NOT_RENDERED
+    html = queue.render(nb_path)
+    assert queue.state(nb_path) == RENDERED
+
+    chunks = list(stream_html(html, compress=True, chunk_size=1024))
+    assert len(chunks) > 1
+    assert gzip.decompress(b''.join(chunks)).decode('utf-8') == html
+
+
+def test_render_does_not_wait_for_a_stuck_render(tmp_path):
+
+    nb_path = tmp_path.joinpath('analysis.ipynb')
+    nbformat.write(new_notebook(cells=[new_markdown_cell("stuck analysis")]), nb_path)
+
+    cache = RenderCache(tmp_path.joinpath('renders'))
+    queue = RenderQueue(cache, max_workers=1, wait_timeout=0.1)
+    # A render in the background that never finishes.
+    queue._pending[cache.key(nb_path)] = Future()
+    assert "stuck analysis" in queue.render(nb_path)
@@ -0,0 +1,49 @@
+from dragon_core.api.caches import ResponseCache
+
+
+def test_response_is_only_served_for_its_revision():
+
+    cache = ResponseCache(max_bytes=1024)
+    revision = cache.revision('an-id')
+    cache.put('an-id', revision, '{"name": "entity"}')
+    assert cache.get('an-id', revision) == '{"name": "entity"}'
+
+    # A response built while the entity changed is never stored.
+    new_revision = cache.bump('an-id')
+    assert new_revision > revision
+    assert cache.get('an-id', new_revision) is None
+    cache.put('an-id', revision, '{"name": "stale"}')
+    assert cache.get('an-id', new_revision) is None
+
+    cache.put('an-id', new_revision, '{"name": "renamed"}', validator=(1,))
+    assert cache.get('an-id', new_revision, validator=(2,)) is None
+    assert cache.get('an-id', new_revision, validator=(1,)) == '{"name": "renamed"}'
+
+
+def test_oldest_responses_are_dropped_over_the_budget():
+
+    cache = ResponseCache(max_bytes=10)
+    cache.put('a', 0, '12345')
+    cache.put('b', 0, '12345')
+    assert cache.get('a', 0) == '12345'
+
+    cache.put('c', 0, '12345')
+    assert cache.get('b', 0) is None
+    assert cache.get('a', 0) == '12345'
+    assert cache.size == 10
+
+
+def test_bumping_all_entities_invalidates_every_response():
+
+    cache = ResponseCache(max_bytes=1024)
+    cache.bump('changed')
+    revisions = {ID: cache.revision(ID) for ID in ('changed', 'unchanged')}
+    cache.put('unchanged', revisions['unchanged'], '{"name": "unchanged"}')
+
+    # For example after an entity was renamed, links in any response might point to its old path.
+    cache.bump_all()
+    assert len(cache) == 0
+    for ID, revision in revisions.items():
+        assert cache.revision(ID) > revision
+        cache.put(ID, revision, '{"name": "stale"}')
+        assert cache.get(ID, cache.revision(ID)) is None
@@ -0,0 +1,37 @@
+import threading
+
+from dragon_core.utils import SharedLock
+
+
+def test_exclusive_holder_waits_for_shared_holders():
+
+    lock = SharedLock()
+    events = []
+    shared_taken = threading.Event()
+    release_shared = threading.Event()
+
+    def edit():
+        with lock.shared():
+            shared_taken.set()
+            release_shared.wait(5)
+            events.append('edit done')
+
+    def batch():
+        with lock.exclusive():
+            events.append('batch')
+            # The thread holding the lock exclusively can still take it in either mode.
+            with lock.shared(), lock.exclusive():
+                events.append('nested')
+
+    edit_thread = threading.Thread(target=edit)
+    edit_thread.start()
+    shared_taken.wait(5)
+    batch_thread = threading.Thread(target=batch)
+    batch_thread.start()
+    batch_thread.join(0.2)
+    assert events == []
+
+    release_shared.set()
+    edit_thread.join(5)
+    batch_thread.join(5)
+    assert events == ['edit done', 'batch', 'nested']
@@ -0,0 +1,92 @@
+from dragon_core.modules import Library, Notebook
+from dragon_core.components import create_text_block, create_comment
+from dragon_core.utils import after_write
+from dragon_core.api.storage import SQLiteStorage
+from dragon_core.api.journal import Journal, set_op
+
+
+def test_sqlite_storage_round_trip(tmp_path):
+
+    library = Library(name='library', user='test_user')
+    notebook = Notebook(name='notebook', user='test_user', parent=library.ID)
+    library.add_child(notebook.ID)
+
+    block = create_text_block("first version", 'test_user')
+    notebook.content_blocks.append(block)
+    notebook.comments.append(create_comment("a comment", notebook.ID, block.ID, 'test_user'))
+
+    storage = SQLiteStorage(tmp_path.joinpath('lair.sqlite'))
+    with storage.batch():
+        storage.write(library, tmp_path.joinpath('library.toml'))
+        storage.write(notebook, tmp_path.joinpath('notebook.toml'))
+
+    # Only the new version is stored when the block changes.
+    block.modify("second version", 'test_user')
+    storage.write(notebook, tmp_path.joinpath('notebook.toml'))
+    storage.close()
+
+    storage = SQLiteStorage(tmp_path.joinpath('lair.sqlite'))
+    loaded = storage.load([str(tmp_path.joinpath('library.toml'))])
+    assert list(loaded.keys()) == [str(tmp_path.joinpath('library.toml')), str(tmp_path.joinpath('notebook.toml'))]
+
+    loaded_notebook = loaded[str(tmp_path.joinpath('notebook.toml'))].entity
+    assert loaded_notebook.parent == library.ID
+    assert list(loaded_notebook.content_blocks[0].content) == ["first version", "second version"]
+    assert loaded_notebook.comments[0].body == "a comment"
+
+    skeletons = storage.load([str(tmp_path.joinpath('library.toml'))], skeleton_depth=1)
+    assert skeletons[str(tmp_path.joinpath('notebook.toml'))].entity.type == 'Notebook'
+    storage.close()
+
+
+def test_sqlite_storage_rewrites_versions_after_a_rollback(tmp_path):
+
+    notebook = Notebook(name='notebook', user='test_user')
+    block = create_text_block("first version", 'test_user')
+    notebook.content_blocks.append(block)
+
+    storage = SQLiteStorage(tmp_path.joinpath('lair.sqlite'))
+    storage.write(notebook, tmp_path.joinpath('notebook.toml'))
+
+    block.modify("second version", 'test_user')
+    block.modify("third version", 'test_user')
+    try:
+        with storage.batch():
+            storage.write(notebook, tmp_path.joinpath('notebook.toml'))
+            raise RuntimeError("the batch failed")
+    except RuntimeError:
+        pass
+
+    # The versions that were rolled back are written again with the next change.
+    block.modify("fourth version", 'test_user')
+    storage.write(notebook, tmp_path.joinpath('notebook.toml'))
+    storage.close()
+
+    storage = SQLiteStorage(tmp_path.joinpath('lair.sqlite'))
+    loaded = storage.load([str(tmp_path.joinpath('notebook.toml'))])
+    loaded_notebook = loaded[str(tmp_path.joinpath('notebook.toml'))].entity
+    assert list(loaded_notebook.content_blocks[0].content) == ["first version", "second version", "third version",
+                                                             "fourth version"]
+    storage.close()
+
+
+def test_failed_sqlite_batch_keeps_the_journal_entries(tmp_path):
+
+    notebook = Notebook(name='notebook', user='test_user')
+    journal = Journal(tmp_path.joinpath('_dragon_lair.journal'))
+    seq = journal.append(notebook.ID, [set_op('bookmarked', True)])
+
+    storage = SQLiteStorage(tmp_path.joinpath('lair.sqlite'))
+    try:
+        with storage.batch():
+            storage.write(notebook, tmp_path.joinpath('notebook.toml'))
+            # What the entities module does once an entity is written, see `_entity_written`.
+            after_write(lambda: journal.checkpoint(notebook.ID, upto=seq))
+            raise RuntimeError("the batch failed")
+    except RuntimeError:
+        pass
+    storage.close()
+
+    # Nothing was stored, so the change is still replayed from the journal.
+    assert journal.pending_ops() == {notebook.ID: [set_op('bookmarked', True)]}
+    journal.close()
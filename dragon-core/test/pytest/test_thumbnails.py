@@ -0,0 +1,27 @@
+from io import BytesIO
+
+from PIL import Image
+
+from dragon_core.api.thumbnails import ThumbnailCache
+
+
+def test_thumbnails_are_downscaled_and_cached(tmp_path):
+
+    image_path = tmp_path.joinpath('plot.png')
+    Image.new('RGB', (2000, 1000), color='white').save(image_path)
+
+    cache = ThumbnailCache(tmp_path.joinpath('thumbnails'))
+    data = cache.thumbnail(image_path, 400)
+    with Image.open(BytesIO(data)) as thumbnail:
+        assert thumbnail.size == (400, 200)
+    assert len(cache) == 1
+    assert cache.thumbnail(image_path, 400) == data
+
+    # Every width and every version of the image has its own copy.
+    assert cache.key(image_path, 400) != cache.key(image_path, 1200)
+    Image.new('RGB', (2000, 1000), color='black').save(image_path)
+    assert cache.thumbnail(image_path, 400) != data
+    assert len(cache) == 2
+
+    # Images that are already small enough are not copied.
+    assert cache.thumbnail(image_path, 2000) is None
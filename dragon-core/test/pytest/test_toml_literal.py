@@ -0,0 +1,20 @@
+import json
+import tomllib
+
+import tomlkit
+
+from dragon_core.utils import json_to_toml_literal
+
+
+def test_json_in_literal_strings_reads_back_unchanged():
+
+    obj = {'body': "it's a ''' quote\x7f with\nnew lines\tand ünicode", 'content': [[3, 0, "'"]]}
+
+    doc = tomlkit.document()
+    table = tomlkit.table()
+    table['blocks'] = [json_to_toml_literal(json.dumps(obj, ensure_ascii=False))]
+    doc['entity'] = table
+
+    text = doc.as_string()
+    assert "blocks = ['" in text
+    assert json.loads(tomllib.loads(text)['entity']['blocks'][0]) == obj
@@ -0,0 +1,41 @@
+import json
+
+from dragon_core.components import ContentBlock, VersionHistory, create_text_block
+
+
+def test_history_round_trips_through_the_compact_format():
+
+    block = create_text_block('The first version of the paragraph.', 'user')
+    versions = [block.content[0]]
+    for i in range(100):
+        text = versions[-1].replace('paragraph', f'paragraph {i}') if i % 7 else versions[-1] + f' More text {i}.'
+        block.modify(text, 'user')
+        versions.append(text)
+
+    assert isinstance(block.content, VersionHistory)
+    assert block.latest_version()[0] == versions[-1]
+    assert block.content[3] == versions[3]
+    assert list(block.content) == versions
+
+    stored = str(block)
+    compact_content = json.dumps(json.loads(stored)['content'])
+    assert len(compact_content) < len(json.dumps(versions)) / 5
+
+    loaded = ContentBlock.from_dict(json.loads(stored))
+    assert list(loaded.content) == versions
+    assert loaded.to_dict(full_history=True)['content'] == versions
+
+    # Blocks with a single version and blocks stored before the compact format keep using plain lists.
+    single = create_text_block('only one', 'user')
+    assert json.loads(str(single))['content'] == ['only one']
+    legacy = ContentBlock.from_dict(json.loads(json.dumps(block.to_dict(full_history=True))))
+    assert list(legacy.content) == versions
+
+
+def test_replacing_the_latest_version():
+
+    history = VersionHistory(['a', 'ab', 'abc'])
+    history[-1] = 'abd'
+    assert list(history) == ['a', 'ab', 'abd']
+    history[0] = 'z'
+    assert list(history) == ['z', 'ab', 'abd']
@@ -0,0 +1,34 @@
+import time
+import threading
+
+from dragon_core.api.write_behind import WriteBehindScheduler
+
+
+def test_entities_stay_pending_until_written_and_failed_writes_are_retried():
+
+    attempts = []
+    writing = threading.Event()
+    release = threading.Event()
+
+    def flush(ID):
+        attempts.append(ID)
+        if len(attempts) == 1:
+            writing.set()
+            release.wait(5)
+            raise OSError("disk full")
+
+    scheduler = WriteBehindScheduler(flush=flush, quiet_period=0.01, max_delay=0.05)
+    try:
+        scheduler.schedule('a')
+        assert writing.wait(5)
+        # While it is being written the entity still has unwritten changes.
+        assert scheduler.is_pending('a')
+        release.set()
+
+        deadline = time.monotonic() + 5
+        while (len(attempts) < 2 or scheduler.is_pending('a')) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert attempts == ['a', 'a']
+        assert not scheduler.is_pending('a')
+    finally:
+        scheduler.stop()
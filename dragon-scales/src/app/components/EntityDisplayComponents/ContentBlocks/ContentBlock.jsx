@@ -250,7 +250,7 @@ export default function ContentBlock({contentBlock, parentId, reloadParent}) {
                         <ImageCardContent
                             component="img"
                             // the `?t=${Date.now()}` is to stop nextjs from caching the image to allow for real time updates
-                            image={`${process.env.NEXT_PUBLIC_API_BASE_URL || ""}/api/data/instance_image/${encodeURIComponent(displayContent[0].replace(/\//g, '#'))}`}
+                            image={`${process.env.NEXT_PUBLIC_API_BASE_URL || ""}/api/data/instance_image/${encodeURIComponent(displayContent[0].replace(/\//g, '#'))}?size=preview`}
                         />
                     </Link>
                     
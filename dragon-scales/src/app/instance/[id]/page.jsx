@@ -49,6 +49,28 @@ const ImageBox = styled(Box)(({theme}) => ({
     marginBottom: theme.spacing(2),
 }));
 
+const AnalysisBox = styled(Box)(({theme}) => ({
+    padding: theme.spacing(2),
+    marginBottom: theme.spacing(2),
+}));
+
+const AnalysisFrame = styled('iframe')(({theme}) => ({
+    width: '100%',
+    height: '80vh',
+    border: 'none',
+    marginBottom: theme.spacing(2),
+}));
+
+const formatSize = (size) => {
+    if (size === null || size === undefined) {
+        return 'N/A';
+    } else if (size < 1024 * 1024) {
+        return `${Math.round(size / 1024)} KB`;
+    } else {
+        return `${(size / (1024 * 1024)).toFixed(1)} MB`;
+    }
+}
+
 export default function Instance({ params }) {
 
     const unwrappedParams = use(params);
@@ -135,7 +157,7 @@ export default function Instance({ params }) {
                         {instance.images.map((img, index) => (
                             <ImageListItem key={index}>
                                 <img
-                                    src={`${process.env.NEXT_PUBLIC_API_BASE_URL || ""}/api/data/instance_image/${encodeURIComponent(img.replace(/\//g, '#'))}`}
+                                    src={`${process.env.NEXT_PUBLIC_API_BASE_URL || ""}/api/data/instance_image/${encodeURIComponent(img.replace(/\//g, '#'))}?size=thumbnail${instance.image_versions && instance.image_versions[img] ? `&v=${instance.image_versions[img]}` : ''}`}
                                     alt={`Instance image ${index + 1}`}
                                     loading="lazy"
                                 />
@@ -146,6 +168,30 @@ export default function Instance({ params }) {
                     <Typography variant="body1">No images available</Typography>
                 )}
             </ImageBox>
+
+            <AnalysisBox>
+                <Typography variant="h6">Analysis</Typography>
+                {instance.analysis && instance.analysis.length > 0 ? (
+                    // Every notebook is loaded on its own, the page does not wait for them to be rendered.
+                    instance.analysis.map((notebook) => (
+                        <Box key={notebook.index}>
+                            <Typography variant="body1"><b>{notebook.name}</b> ({formatSize(notebook.size)})</Typography>
+                            {notebook.status === 'missing' ? (
+                                <Typography variant="body1">Notebook not found</Typography>
+                            ) : (
+                                <AnalysisFrame
+                                    src={`${process.env.NEXT_PUBLIC_API_BASE_URL || ""}/api/entities/${instance.ID}/analysis/${notebook.index}`}
+                                    title={notebook.name}
+                                    loading="lazy"
+                                    sandbox="allow-scripts"
+                                />
+                            )}
+                        </Box>
+                    ))
+                ) : (
+                    <Typography variant="body1">No analysis available</Typography>
+                )}
+            </AnalysisBox>
         </Box>
     )
 